@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# bbox_buffers.py
+# *********************************************************************************************************************
+#
+# Measures the Postgres buffers touched by the map server's bounding box queries, for the places in the map's
+# bookmarks across zoom levels. Run it against a load without --no-hilbert-order and one with it to compare the
+# physical layouts. Fewer pages touched (hit + read) means a viewport's rows are closer together on disk.
+#
+# Takes the same Postgres & schema arguments as load-census.py, e.g.
+#   python benchmarks/bbox_buffers.py --census-year=2016 --pghost=localhost
+#
+# *********************************************************************************************************************
+
+import json
+import os
+import psycopg2
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.utils as utils  # noqa: E402
+
+bookmarks_file = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                              "web", "static", "bookmarks.json")
+
+
+def main():
+    args = utils.set_arguments()
+    settings = utils.get_settings(args)
+
+    pg_conn = psycopg2.connect(settings['pg_connect_string'])
+    pg_conn.autocommit = True
+    pg_cur = pg_conn.cursor()
+
+    # map the population stat - it's in every boundary's first table
+    if settings["census_year"] == "2011":
+        stat_id = "b3"
+        table_id = "b01"
+    else:
+        stat_id = "g3"
+        table_id = "g01"
+
+    with open(bookmarks_file, "r") as f:
+        bookmarks = json.load(f)
+
+    total_hit = 0
+    total_read = 0
+
+    print("{0:<12} {1:>4} {2:<6} {3:>8} {4:>10} {5:>10} {6:>10}"
+          .format("place", "zoom", "bdy", "rows", "hit", "read", "ms"))
+
+    for bookmark in bookmarks:
+        latitude, longitude = bookmark["latlng"]
+
+        for zoom_level in range(4, 17):
+            boundary_name, min_val = utils.get_boundary(zoom_level)
+            left, bottom, right, top = utils.get_viewport_bbox(latitude, longitude, zoom_level)
+
+            sql = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " \
+                  "SELECT bdy.id, bdy.name, bdy.population, tab.{0}, {1} AS geometry " \
+                  "FROM {2}.{3} AS bdy " \
+                  "INNER JOIN {4}.{3}_{5} AS tab ON bdy.id = tab.{6} " \
+                  "WHERE bdy.geom && ST_MakeEnvelope({7}, {8}, {9}, {10}, 4283)" \
+                .format(stat_id, utils.get_geometry_column(zoom_level, settings), settings['web_schema'],
+                        boundary_name, settings['data_schema'], table_id, settings['region_id_field'],
+                        left, bottom, right, top)
+
+            pg_cur.execute(sql)
+            plan = pg_cur.fetchone()[0][0]
+
+            hit = plan["Plan"]["Shared Hit Blocks"]
+            read = plan["Plan"]["Shared Read Blocks"]
+            total_hit += hit
+            total_read += read
+
+            print("{0:<12} {1:>4} {2:<6} {3:>8} {4:>10} {5:>10} {6:>10.1f}"
+                  .format(bookmark["name"], zoom_level, boundary_name, plan["Plan"]["Actual Rows"], hit, read,
+                          plan["Execution Time"]))
+
+    print("")
+    print("Total shared buffers : {0} hit, {1} read, {2} touched".format(total_hit, total_read, total_hit + total_read))
+
+    pg_cur.close()
+    pg_conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# classification.py
+# *********************************************************************************************************************
+#
+# Compares the map server's NumPy class breaks (web/classify.py) with the SQL versions in web/utils.py, for each
+# boundary the map uses. Reports the time taken by each and the breaks they return. Also reports how far the breaks
+# from a sample of the values (as the map server uses for big boundaries) are from the exact breaks.
+#
+# Takes the same Postgres & schema arguments as load-census.py, plus the stats to classify, e.g.
+#   python benchmarks/classification.py --census-year=2016 --stats g3 g1 --classes 7
+#
+# *********************************************************************************************************************
+
+import os
+import psycopg2
+import psycopg2.extras
+import sys
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.catalogue as catalogue  # noqa: E402
+import web.classify as classify  # noqa: E402
+import web.utils as utils  # noqa: E402
+
+
+def main():
+    parser = utils.get_argument_parser()
+    parser.add_argument('--stats', nargs='+', help='Stat ids to classify. Defaults to the population stat.')
+    parser.add_argument('--classes', type=int, default=7, help='Number of map classes. Defaults to 7.')
+    args = parser.parse_args()
+
+    settings = utils.get_settings(args)
+
+    pg_conn = psycopg2.connect(settings['pg_connect_string'])
+    pg_conn.autocommit = True
+    pg_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    metadata_catalogue = catalogue.MetadataCatalogue()
+    metadata_catalogue.load(pg_cur, settings)
+
+    if args.stats:
+        stat_ids = [stat_id.lower() for stat_id in args.stats]
+    elif settings["census_year"] == "2011":
+        stat_ids = ["b3"]
+    else:
+        stat_ids = ["g3"]
+
+    for stat_id in stat_ids:
+        stat_dict = metadata_catalogue.get_stat(stat_id)
+
+        if stat_dict is None:
+            print("Unknown stat : {0}".format(stat_id))
+            continue
+
+        for boundary_name, min_val in utils.get_boundary_list():
+            boundary_table = "{0}.{1}".format(settings["web_schema"], boundary_name)
+            data_table = "{0}.{1}_{2}".format(settings["data_schema"], boundary_name, stat_dict["table"])
+
+            if stat_dict["maptype"] == "values":
+                stat_field = "tab.{0}".format(stat_id)
+            else:
+                stat_field = "CASE WHEN bdy.population > 0 THEN tab.{0} / bdy.population * 100.0 ELSE 0 END" \
+                    .format(stat_id)
+
+            print("")
+            print("{0} - {1} ({2})".format(boundary_name, stat_id, stat_dict["maptype"]))
+
+            # SQL versions
+            sql_results = [
+                ("sql kmeans", lambda: utils.get_kmeans_bins(data_table, boundary_table, stat_field, args.classes,
+                                                             min_val, stat_dict["maptype"], pg_cur, settings)),
+                ("sql equal-interval", lambda: utils.get_equal_interval_bins(data_table, boundary_table, stat_field,
+                                                                             args.classes, stat_dict["maptype"],
+                                                                             pg_cur, settings)),
+                ("sql quantile", lambda: utils.get_equal_count_bins(data_table, boundary_table, stat_field,
+                                                                    args.classes, stat_dict["maptype"], pg_cur,
+                                                                    settings))]
+
+            for name, function in sql_results:
+                start_time = datetime.now()
+                bins = function()
+                print_result(name, datetime.now() - start_time, bins)
+
+            # NumPy versions - the values are fetched once for all methods
+            start_time = datetime.now()
+            values = classify.get_values(data_table, boundary_table, stat_field, min_val, stat_dict["maptype"],
+                                         pg_cur, settings)
+            print_result("fetch {0} values".format(len(values)), datetime.now() - start_time, list())
+
+            for method in ["kmeans", "jenks", "quantile", "equal-interval"]:
+                start_time = datetime.now()
+                bins = classify.get_bins(values, args.classes, method)
+                print_result("numpy {0}".format(method), datetime.now() - start_time, bins)
+
+            # approximate versions - from a sample of the values
+            sample_size = classify.get_sample_size(settings["class_breaks_rank_error"])
+
+            start_time = datetime.now()
+            sample_values = classify.get_sample_values(data_table, boundary_table, stat_field, min_val,
+                                                       stat_dict["maptype"], sample_size, pg_cur, settings)
+            print_result("fetch {0} sample values".format(len(sample_values)), datetime.now() - start_time, list())
+
+            for method in ["kmeans", "jenks", "quantile", "equal-interval"]:
+                start_time = datetime.now()
+                approx_bins = classify.get_bins(sample_values, args.classes, method)
+                duration = datetime.now() - start_time
+
+                errors = classify.get_break_errors(values, classify.get_bins(values, args.classes, method),
+                                                   approx_bins)
+                print_result("sample {0}".format(method), duration, approx_bins)
+
+                if errors["max_rank_error"] is not None:
+                    print("\t{0:<24} max value error {1:.2f}, max rank error {2:.2%} (bound {3:.2%})"
+                          .format("", errors["max_value_error"], errors["max_rank_error"],
+                                  settings["class_breaks_rank_error"]))
+
+    pg_cur.close()
+    pg_conn.close()
+
+
+def print_result(name, duration, bins):
+    print("\t{0:<24} {1:>10.1f} ms  {2}".format(name, duration.total_seconds() * 1000.0,
+                                                 ", ".join(["{0:.2f}".format(val) for val in bins])))
+
+
+if __name__ == '__main__':
+    main()
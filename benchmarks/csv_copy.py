@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# csv_copy.py
+# *********************************************************************************************************************
+#
+# Compares the loader's text and binary COPY modes (--copy-format) for the census data CSV files. Each file is copied
+# into an empty temp table like its loaded data table, so it needs a completed load. Reports rows/s for each mode,
+# and for binary mode how much of the time is spent parsing the CSV in the loader.
+#
+# Takes the same Postgres, schema & census data path arguments as load-census.py, e.g.
+#   python benchmarks/csv_copy.py --census-year=2016 --census-data-path=/tmp/census_2016_data --files 20
+#
+# *********************************************************************************************************************
+
+import os
+import psycopg2
+import sys
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.utils as utils  # noqa: E402
+
+
+def main():
+    parser = utils.get_argument_parser()
+    parser.add_argument('--files', type=int, default=10, help='Number of CSV files to copy. Defaults to 10.')
+    args = parser.parse_args()
+
+    settings = utils.get_settings(args)
+
+    pg_conn = psycopg2.connect(settings['pg_connect_string'])
+    pg_conn.autocommit = True
+    pg_cur = pg_conn.cursor()
+
+    # get the biggest data files - they're the ones that matter
+    file_list = list()
+
+    for root, dirs, files in os.walk(settings['data_directory']):
+        for file_name in files:
+            if file_name.lower().startswith(settings['data_file_prefix'].lower()):
+                if file_name.lower().endswith(settings['data_file_type'].lower()):
+                    file_path = os.path.join(root, file_name)
+                    file_name_components = file_name.lower().split("_")
+
+                    table = file_name_components[settings['table_name_part']]
+                    boundary = file_name_components[settings['bdy_name_part']]
+
+                    # the Australia wide data has a different file name structure (same fix as load-census.py)
+                    if "." in boundary:
+                        boundary = "aust"
+
+                    file_dict = dict()
+                    file_dict["path"] = file_path
+                    file_dict["table"] = "{0}_{1}".format(boundary, table)
+                    file_dict["size"] = os.path.getsize(file_path)
+
+                    file_list.append(file_dict)
+
+    file_list = sorted(file_list, key=lambda f: f["size"], reverse=True)[:args.files]
+
+    print("{0:<24} {1:>8} {2:>6} {3:>12} {4:>12} {5:>12} {6:>8}"
+          .format("table", "rows", "fields", "text rows/s", "binary rows/s", "parse ms", "speedup"))
+
+    totals = {"rows": 0, "text": 0.0, "binary": 0.0}
+
+    for file_dict in file_list:
+        data_table = "{0}.{1}".format(settings['data_schema'], file_dict["table"])
+
+        pg_cur.execute("SELECT count(*) - 1 FROM information_schema.columns "
+                       "WHERE table_schema = '{0}' AND table_name = '{1}'"
+                       .format(settings['data_schema'], file_dict["table"]))
+        num_fields = pg_cur.fetchone()[0]
+
+        if num_fields < 1:
+            print("{0:<24} not loaded".format(file_dict["table"]))
+            continue
+
+        durations = dict()
+
+        for copy_format in ["text", "binary"]:
+            pg_cur.execute("DROP TABLE IF EXISTS copy_test; CREATE TEMP TABLE copy_test (LIKE {0})"
+                           .format(data_table))
+
+            start_time = datetime.now()
+            utils.copy_csv_file(pg_cur, file_dict["path"], "copy_test", num_fields, copy_format)
+            durations[copy_format] = (datetime.now() - start_time).total_seconds()
+
+        pg_cur.execute("SELECT count(*) FROM copy_test")
+        num_rows = pg_cur.fetchone()[0]
+
+        # the client side work of the binary mode
+        start_time = datetime.now()
+        region_ids, values = utils.read_census_csv(utils.get_clean_csv_file(file_dict["path"]), num_fields)
+        utils.get_pgcopy_data(region_ids, values)
+        parse_time = (datetime.now() - start_time).total_seconds()
+
+        print("{0:<24} {1:>8} {2:>6} {3:>12.0f} {4:>12.0f} {5:>12.1f} {6:>7.2f}x"
+              .format(file_dict["table"], num_rows, num_fields, num_rows / durations["text"],
+                      num_rows / durations["binary"], parse_time * 1000.0, durations["text"] / durations["binary"]))
+
+        totals["rows"] += num_rows
+        totals["text"] += durations["text"]
+        totals["binary"] += durations["binary"]
+
+    if totals["rows"] > 0:
+        print("")
+        print("Total : {0} rows, text {1:.0f} rows/s, binary {2:.0f} rows/s"
+              .format(totals["rows"], totals["rows"] / totals["text"], totals["rows"] / totals["binary"]))
+
+    pg_cur.execute("DROP TABLE IF EXISTS copy_test")
+
+    pg_cur.close()
+    pg_conn.close()
+
+
+if __name__ == '__main__':
+    main()
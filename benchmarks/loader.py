@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# loader.py
+# *********************************************************************************************************************
+#
+# Times a full run of load-census.py and each of its stages, and appends the results to a JSON lines file so load
+# times can be compared across commits and settings. Optionally creates a synthetic dataset to load first (see
+# benchmarks/synthetic_census.py), so it doesn't need the ABS downloads.
+#
+# Any arguments it doesn't know are passed to load-census.py, e.g.
+#   python benchmarks/loader.py --synthetic-scale=0.01 --census-year=2016 --max-processes=4 --copy-format=binary
+#
+# The stage times are when each stage's last job finished, measured from the start of part 2 (the stages overlap)
+#
+# *********************************************************************************************************************
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from datetime import datetime
+
+repo_directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times a run of load-census.py. Arguments not listed here are passed to load-census.py.')
+    parser.add_argument('--synthetic-scale', type=float,
+                        help='Create and load a synthetic census at this scale (e.g. 0.01) instead of the ABS data.')
+    parser.add_argument('--synthetic-path', default=os.path.join(repo_directory, "benchmarks", "synthetic_data"),
+                        help='Local path for the synthetic census. Defaults to benchmarks/synthetic_data.')
+    parser.add_argument('--census-year', default='2016', help='Census year as YYYY. Defaults to 2016.')
+    parser.add_argument('--label', default='', help='Label to record with the results, e.g. what is being tested.')
+    parser.add_argument('--results-file', default=os.path.join(repo_directory, "benchmarks", "loader_results.jsonl"),
+                        help='JSON lines file to append the results to. Defaults to benchmarks/loader_results.jsonl.')
+    args, loader_args = parser.parse_known_args()
+
+    loader_args = ["--census-year", args.census_year] + loader_args
+
+    if args.synthetic_scale is not None:
+        synthetic_path = os.path.join(args.synthetic_path, "{0}_{1}".format(args.census_year, args.synthetic_scale))
+
+        # the dataset is only created once for each census year & scale
+        if not os.path.isdir(synthetic_path):
+            subprocess.check_call([sys.executable, os.path.join(repo_directory, "benchmarks", "synthetic_census.py"),
+                                   "--census-year", args.census_year, "--scale", str(args.synthetic_scale),
+                                   "--output-path", synthetic_path])
+
+        loader_args += ["--census-data-path", os.path.join(synthetic_path, "data"),
+                        "--census-bdys-path", os.path.join(synthetic_path, "bdys")]
+
+    result = dict()
+    result["timestamp"] = datetime.now().isoformat()
+    result["label"] = args.label
+    result["commit"] = get_git_commit()
+    result["args"] = loader_args
+    result["synthetic_scale"] = args.synthetic_scale
+    result["stages"] = dict()
+
+    start_time = datetime.now()
+
+    # the loader logs to the console on stderr
+    process = subprocess.Popen([sys.executable, os.path.join(repo_directory, "load-census.py")] + loader_args,
+                               cwd=repo_directory, stderr=subprocess.PIPE, universal_newlines=True)
+
+    for line in process.stderr:
+        sys.stderr.write(line)
+
+        # e.g. "Part 1 of 2 : Census metadata loaded! : 0:00:01.234567" or "- csv jobs done : 0:01:23.456789"
+        match = re.search(r"(Part \d of \d) : .* loaded! : (\d+:\d+:[\d.]+)", line)
+
+        if match is not None:
+            result["stages"][match.group(1).lower()] = get_seconds(match.group(2))
+
+        match = re.search(r"- (.+) jobs done : (\d+:\d+:[\d.]+)", line)
+
+        if match is not None:
+            result["stages"][match.group(1)] = get_seconds(match.group(2))
+
+        if "FAILED!" in line or "Something bad happened!" in line:
+            result["errors"] = result.get("errors", 0) + 1
+
+    result["return_code"] = process.wait()
+    result["total_seconds"] = (datetime.now() - start_time).total_seconds()
+
+    with open(args.results_file, "a") as results_file:
+        results_file.write(json.dumps(result, sort_keys=True) + "\n")
+
+    print("")
+    print("{0:<24} {1:>10}".format("stage", "seconds"))
+
+    for stage, seconds in sorted(result["stages"].items(), key=lambda item: item[1]):
+        print("{0:<24} {1:>10.1f}".format(stage, seconds))
+
+    print("{0:<24} {1:>10.1f}".format("total", result["total_seconds"]))
+    print("")
+    print("Results appended to {0}".format(args.results_file))
+
+    return result["return_code"] == 0 and result.get("errors", 0) == 0
+
+
+# e.g. 0:01:23.456789
+def get_seconds(duration_text):
+    hours, minutes, seconds = duration_text.split(":")
+
+    return int(hours) * 3600.0 + int(minutes) * 60.0 + float(seconds)
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo_directory,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# map_server_load.py
+# *********************************************************************************************************************
+#
+# Load tests a running map server (web/server.py) with simulated map users. Each user starts at one of the places in
+# the map's bookmarks, gets the stat's metadata, then pans and zooms around (zoom levels 4 to 17), getting the map
+# data for each view the same way loadmap.js does. The users' traces are random but repeatable (--seed), so runs
+# against different builds or settings can be compared.
+#
+# Reports the throughput, and the latency percentiles & response sizes for each route, boundary and zoom level.
+# Results can be appended to a JSON lines file to track them over time.
+#
+# Start the map server, then e.g.
+#   python benchmarks/map_server_load.py --census-year=2016 --users=40 --concurrency=8 --stats g3 g1
+#
+# Use a synthetic census load (see benchmarks/synthetic_census.py) if the ABS data isn't loaded
+#
+# *********************************************************************************************************************
+
+import gzip
+import json
+import numpy
+import os
+import random
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.utils as utils  # noqa: E402
+
+bookmarks_file = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                              "web", "static", "bookmarks.json")
+
+min_zoom = 4
+max_zoom = 17
+
+
+def main():
+    parser = utils.get_argument_parser()
+    parser.add_argument('--url', default='http://127.0.0.1:8081',
+                        help='Map server URL. Defaults to http://127.0.0.1:8081.')
+    parser.add_argument('--stats', nargs='+', help='Stat ids to map. Defaults to the population stat.')
+    parser.add_argument('--users', type=int, default=40, help='Number of simulated map users. Defaults to 40.')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='Number of pans & zooms each user makes. Defaults to 20.')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of users using the map at once. Defaults to 8.')
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help='Seconds each user waits after each map view is drawn. Defaults to 0.')
+    parser.add_argument('--seed', type=int, default=34, help='Random seed for the users\' traces. Defaults to 34.')
+    parser.add_argument('--results-file', help='JSON lines file to append the results to.')
+    args = parser.parse_args()
+
+    if args.stats:
+        stat_ids = [stat_id.lower() for stat_id in args.stats]
+    elif args.census_year == "2011":
+        stat_ids = ["b3"]
+    else:
+        stat_ids = ["g3"]
+
+    with open(bookmarks_file, "r") as f:
+        bookmarks = json.load(f)
+
+    traces = get_traces(bookmarks, stat_ids, args.users, args.steps, args.seed)
+
+    results = list()
+    results_lock = threading.Lock()
+
+    start_time = datetime.now()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for i, trace in enumerate(traces):
+            executor.submit(run_trace, args.url.rstrip("/"), "load-test-{0}".format(i), trace, args.think_time,
+                            results, results_lock)
+
+    duration = (datetime.now() - start_time).total_seconds()
+
+    print_results(results, duration, args)
+
+    if args.results_file:
+        save_results(results, duration, args)
+
+
+# each user's map views - a start place & zoom level, then a list of pans & zooms
+def get_traces(bookmarks, stat_ids, num_users, num_steps, seed):
+    random_generator = random.Random(seed)
+    traces = list()
+
+    for i in range(0, num_users):
+        bookmark = bookmarks[i % len(bookmarks)]
+        latitude, longitude = bookmark["latlng"]
+        zoom_level = random_generator.randint(min_zoom, 12)
+
+        trace = dict()
+        trace["stat"] = stat_ids[i % len(stat_ids)]
+        trace["views"] = [(latitude, longitude, zoom_level)]
+
+        for j in range(0, num_steps):
+            action = random_generator.random()
+
+            # users mostly zoom in to look at an area, then pan around it
+            if action < 0.35:
+                zoom_level = min(zoom_level + 1, max_zoom)
+            elif action < 0.5:
+                zoom_level = max(zoom_level - 1, min_zoom)
+            else:
+                # pan up to half a screen width or height (1280 x 800 pixels)
+                degrees_per_pixel = 360.0 / (256.0 * 2.0 ** zoom_level)
+                longitude += random_generator.uniform(-640.0, 640.0) * degrees_per_pixel
+                latitude += random_generator.uniform(-400.0, 400.0) * degrees_per_pixel
+
+            trace["views"].append((latitude, longitude, zoom_level))
+
+        traces.append(trace)
+
+    return traces
+
+
+def run_trace(url, client_id, trace, think_time, results, results_lock):
+    try:
+        # the map gets the stat's table and map classes first
+        response = get_response(url + "/get-metadata?" + urllib.parse.urlencode({"n": 7, "stats": trace["stat"]}))
+        add_result(results, results_lock, response, "/get-metadata", None, None)
+
+        if response["status"] != 200:
+            return
+
+        table_id = response["json"]["stats"][0]["table"]
+
+        for generation, (latitude, longitude, zoom_level) in enumerate(trace["views"]):
+            left, bottom, right, top = utils.get_viewport_bbox(latitude, longitude, zoom_level)
+
+            params = [("ml", left), ("mb", bottom), ("mr", right), ("mt", top), ("s", trace["stat"]),
+                      ("t", table_id), ("z", zoom_level), ("c", client_id), ("g", generation)]
+
+            response = get_response(url + "/get-data?" + urllib.parse.urlencode(params))
+
+            if response["json"] is not None:
+                boundary_name = response["json"].get("boundary")
+            else:
+                boundary_name = None
+
+            add_result(results, results_lock, response, "/get-data", boundary_name, zoom_level)
+
+            if think_time > 0.0:
+                threading.Event().wait(think_time)
+
+    except Exception as ex:
+        print("User {0} failed : {1}".format(client_id, ex))
+
+
+# gets a URL the way a browser would (accepting compressed responses). Returns the status, time taken & sizes
+def get_response(url):
+    request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+    start_time = datetime.now()
+
+    try:
+        with urllib.request.urlopen(request) as http_response:
+            status = http_response.status
+            encoding = http_response.headers.get("Content-Encoding")
+            body = http_response.read()
+    except urllib.error.HTTPError as ex:
+        status = ex.code
+        encoding = ex.headers.get("Content-Encoding")
+        body = ex.read()
+
+    response = dict()
+    response["ms"] = (datetime.now() - start_time).total_seconds() * 1000.0
+    response["status"] = status
+    response["bytes"] = len(body)
+
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+
+    response["json_bytes"] = len(body)
+
+    try:
+        response["json"] = json.loads(body.decode("utf-8"))
+    except ValueError:
+        response["json"] = None
+
+    return response
+
+
+def add_result(results, results_lock, response, route, boundary_name, zoom_level):
+    result = dict()
+    result["route"] = route
+    result["boundary"] = boundary_name
+    result["zoom"] = zoom_level
+    result["status"] = response["status"]
+    result["ms"] = response["ms"]
+    result["bytes"] = response["bytes"]
+    result["json_bytes"] = response["json_bytes"]
+
+    if response["json"] is not None and route == "/get-data":
+        result["features"] = len(response["json"].get("features", list()))
+    else:
+        result["features"] = 0
+
+    with results_lock:
+        results.append(result)
+
+
+# the results grouped by route, boundary & zoom level
+def get_groups(results):
+    groups = dict()
+
+    for result in results:
+        key = (result["route"], result["boundary"] or "", result["zoom"] if result["zoom"] is not None else -1)
+        groups.setdefault(key, list()).append(result)
+
+    return groups
+
+
+def get_summary(results):
+    latencies = numpy.array([result["ms"] for result in results])
+
+    summary = dict()
+    summary["requests"] = len(results)
+    summary["errors"] = len([result for result in results if result["status"] != 200])
+    summary["p50_ms"] = float(numpy.percentile(latencies, 50))
+    summary["p90_ms"] = float(numpy.percentile(latencies, 90))
+    summary["p99_ms"] = float(numpy.percentile(latencies, 99))
+    summary["max_ms"] = float(numpy.max(latencies))
+    summary["mean_bytes"] = float(numpy.mean([result["bytes"] for result in results]))
+    summary["mean_json_bytes"] = float(numpy.mean([result["json_bytes"] for result in results]))
+    summary["mean_features"] = float(numpy.mean([result["features"] for result in results]))
+
+    return summary
+
+
+def print_results(results, duration, args):
+    if len(results) == 0:
+        print("No responses - is the map server running at {0}?".format(args.url))
+        return
+
+    print("{0:<14} {1:<6} {2:>4} {3:>6} {4:>6} {5:>8} {6:>8} {7:>8} {8:>8} {9:>10} {10:>10} {11:>8}"
+          .format("route", "bdy", "zoom", "reqs", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms", "bytes",
+                  "json bytes", "features"))
+
+    for (route, boundary_name, zoom_level), group in sorted(get_groups(results).items()):
+        summary = get_summary(group)
+
+        print("{0:<14} {1:<6} {2:>4} {3:>6} {4:>6} {5:>8.1f} {6:>8.1f} {7:>8.1f} {8:>8.1f} {9:>10.0f} {10:>10.0f} "
+              "{11:>8.0f}".format(route, boundary_name, zoom_level if zoom_level >= 0 else "", summary["requests"],
+                                  summary["errors"], summary["p50_ms"], summary["p90_ms"], summary["p99_ms"],
+                                  summary["max_ms"], summary["mean_bytes"], summary["mean_json_bytes"],
+                                  summary["mean_features"]))
+
+    summary = get_summary(results)
+
+    print("")
+    print("{0} requests ({1} errors) in {2:.1f}s with {3} concurrent users : {4:.1f} requests/s, "
+          "p50 {5:.1f} ms, p90 {6:.1f} ms, p99 {7:.1f} ms, {8:.0f} bytes/s"
+          .format(summary["requests"], summary["errors"], duration, args.concurrency, summary["requests"] / duration,
+                  summary["p50_ms"], summary["p90_ms"], summary["p99_ms"],
+                  sum([result["bytes"] for result in results]) / duration))
+
+
+def save_results(results, duration, args):
+    output_dict = dict()
+    output_dict["timestamp"] = datetime.now().isoformat()
+    output_dict["url"] = args.url
+    output_dict["users"] = args.users
+    output_dict["steps"] = args.steps
+    output_dict["concurrency"] = args.concurrency
+    output_dict["seed"] = args.seed
+    output_dict["seconds"] = duration
+    output_dict["requests_per_second"] = len(results) / duration
+    output_dict["total"] = get_summary(results) if len(results) > 0 else None
+    output_dict["groups"] = list()
+
+    for (route, boundary_name, zoom_level), group in sorted(get_groups(results).items()):
+        group_dict = get_summary(group)
+        group_dict["route"] = route
+        group_dict["boundary"] = boundary_name
+        group_dict["zoom"] = zoom_level if zoom_level >= 0 else None
+        output_dict["groups"].append(group_dict)
+
+    with open(args.results_file, "a") as results_file:
+        results_file.write(json.dumps(output_dict, sort_keys=True) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# synthetic_census.py
+# *********************************************************************************************************************
+#
+# Creates a synthetic Census 2011 or 2016 dataset in the layout load-census.py expects - metadata Excel files, data
+# CSV files and boundary Shapefiles - so the loader and map server can be tested and benchmarked without downloading
+# the ABS data.
+#
+# The boundaries are nested grids over the Australian mainland's extent: each boundary type is a 2^n x 2^n grid, so
+# every boundary is made of whole meshblocks. The grid cell edges are jittered (identically for neighbouring cells) to
+# give the simplification something to do. Populations are random per meshblock and summed for the other
+# boundaries.
+#
+# --scale sets the number of boundaries relative to the real ones, e.g. 0.01 gives ~4,000 meshblocks and ~1,000 SA1s
+#
+#   python benchmarks/synthetic_census.py --census-year=2016 --scale=0.01 --output-path=/tmp/synthetic_2016
+#
+# then load it with:
+#
+#   python load-census.py --census-year=2016 --census-data-path=/tmp/synthetic_2016/data
+#     --census-bdys-path=/tmp/synthetic_2016/bdys
+#
+# Writing the Excel files needs the openpyxl module
+#
+# *********************************************************************************************************************
+
+import argparse
+import math
+import numpy
+import os
+import re
+import struct
+import sys
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.utils as utils  # noqa: E402
+
+# extent of the boundaries (the mainland & Tasmania)
+min_x = 113.0
+min_y = -44.0
+max_x = 154.0
+max_y = -10.0
+
+# vertices per meshblock edge
+edge_vertices = 2
+
+# approximate number of boundaries in the real censuses
+boundary_counts = {
+    "add": 13, "ced": 150, "gccsa": 34, "iare": 430, "iloc": 1130, "ireg": 58, "lga": 565, "mb": 358000,
+    "nrmr": 56, "poa": 2600, "ra": 35, "sa1": 57000, "sa2": 2300, "sa3": 358, "sa4": 107, "sed": 450, "sla": 1390,
+    "sos": 30, "sosr": 11, "ssc": 15000, "ste": 9, "sua": 101, "tr": 76, "ucl": 1850
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Creates a synthetic census dataset for testing census-loader.')
+    parser.add_argument('--census-year', default='2016', help='Census year as YYYY (2011 or 2016). Defaults to 2016.')
+    parser.add_argument('--scale', type=float, default=0.01,
+                        help='Number of boundaries relative to the real census. Defaults to 0.01.')
+    parser.add_argument('--tables', type=int, default=5,
+                        help='Number of data tables (as well as the population & indigenous tables). Defaults to 5.')
+    parser.add_argument('--stats', type=int, default=20, help='Number of stats per data table. Defaults to 20.')
+    parser.add_argument('--seed', type=int, default=34, help='Random seed. Defaults to 34.')
+    parser.add_argument('--output-path', required=True, help='Local path to create the data & bdys folders in.')
+    args = parser.parse_args()
+
+    # the loader's file names and fields for the census year
+    settings = utils.get_settings(utils.get_argument_parser().parse_args(['--census-year', args.census_year]))
+
+    if settings is None:
+        print("Invalid Census Year - set it to 2011 or 2016")
+        return False
+
+    data_path = os.path.join(args.output_path, "data")
+    bdys_path = os.path.join(args.output_path, "bdys")
+
+    for path in [data_path, bdys_path]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    start_time = datetime.now()
+
+    # grid level of each boundary type - the meshblocks are the finest
+    levels = dict()
+
+    for boundary_dict in settings['bdy_table_dicts']:
+        boundary_name = boundary_dict["boundary"]
+        real_count = boundary_counts.get(boundary_name, 100)
+
+        # keep the coarse boundaries close to their real counts
+        count = max(real_count * args.scale, min(real_count, 9))
+        levels[boundary_name] = max(int(round(math.log(count, 4))), 1)
+
+    levels["mb"] = max(levels.values())
+
+    # random population for each meshblock, summed for each boundary
+    random = numpy.random.RandomState(args.seed)
+    mb_size = 2 ** levels["mb"]
+    mb_population = numpy.round(random.lognormal(4.5, 1.2, (mb_size, mb_size)))
+
+    # meshblocks with no-one in them (e.g. parks & water)
+    mb_population[random.random_sample((mb_size, mb_size)) < 0.1] = 0.0
+
+    tables = get_tables(settings['census_year'], args.tables, args.stats)
+
+    create_metadata_file(data_path, tables, settings)
+    print("Metadata created : {0}".format(datetime.now() - start_time))
+
+    for boundary_dict in settings['bdy_table_dicts']:
+        boundary_name = boundary_dict["boundary"]
+        level = levels[boundary_name]
+
+        population = get_boundary_population(mb_population, levels["mb"], level)
+
+        if boundary_name != "mb":
+            create_data_files(data_path, boundary_name, level, population, tables, random, settings)
+
+        create_shapefiles(bdys_path, boundary_dict, level, levels["mb"], settings)
+
+        print("{0} : {1} boundaries created : {2}".format(boundary_name, (2 ** level) ** 2,
+                                                          datetime.now() - start_time))
+
+    return True
+
+
+# the data tables and their stats. The first table has the population stats, the indigenous table is only used by
+# the indigenous boundaries
+def get_tables(census_year, num_tables, num_stats):
+    if census_year == "2011":
+        prefix = "B"
+    else:
+        prefix = "G"
+
+    tables = list()
+    stat_number = 1
+
+    for i in range(1, num_tables + 1):
+        table_dict = dict()
+        table_dict["table"] = "{0}{1:02d}".format(prefix, i)
+        table_dict["name"] = "Synthetic Table {0}".format(i)
+        table_dict["stats"] = list()
+
+        for j in range(1, num_stats + 1):
+            if i == 1 and j == 1:
+                long_id = "Total_Persons_Males"
+            elif i == 1 and j == 2:
+                long_id = "Total_Persons_Females"
+            elif i == 1 and j == 3:
+                long_id = "Total_Persons_Persons"
+            elif i == 2 and j % 5 == 0:
+                long_id = "Median_Synthetic_Value_{0}".format(j)
+            elif i == 2 and j % 5 == 1:
+                long_id = "Average_Synthetic_Value_{0}".format(j)
+            else:
+                long_id = "Synthetic_Count_{0}_{1}".format(i, j)
+
+            table_dict["stats"].append(("{0}{1}".format(prefix, stat_number), long_id))
+            stat_number += 1
+
+        tables.append(table_dict)
+
+    # indigenous population table
+    tables.append({"table": "I01A", "name": "Synthetic Indigenous Status", "indigenous": True,
+                   "stats": [("I1", "Indigenous_Persons_Males"), ("I2", "Indigenous_Persons_Females"),
+                             ("I3", "Indigenous_Persons_Persons")]})
+
+    return tables
+
+
+# the metadata workbook - one sheet of tables and one of stats, both with a few title rows above the header row
+def create_metadata_file(data_path, tables, settings):
+    import pandas
+
+    title_rows = [["Australian Bureau of Statistics"], ["Synthetic Census of Population and Housing"], []]
+
+    table_rows = title_rows + [["Table number", "Table name", "Table population"]]
+
+    for table_dict in tables:
+        table_rows.append([table_dict["table"], table_dict["name"], "Persons"])
+
+    stat_rows = title_rows + [["Sequential", "Short", "Long", "DataPack file", "Profile table",
+                               "Column heading description in profile"]]
+
+    for table_dict in tables:
+        for stat_id, long_id in table_dict["stats"]:
+            short_id = "".join([word[:4] for word in long_id.split("_")])[:16]
+            stat_rows.append([stat_id, short_id, long_id, table_dict["table"], table_dict["table"],
+                              long_id.split("_")[-1]])
+
+    # the 2016 metadata file is an .xls - pandas reads it based on its content, not its name
+    file_name = "{0}synthetic{1}".format(settings['metadata_file_prefix'], settings['metadata_file_type'])
+
+    with pandas.ExcelWriter(os.path.join(data_path, file_name), engine="openpyxl") as writer:
+        pandas.DataFrame(table_rows).to_excel(writer, sheet_name="Table Number", index=False, header=False)
+        pandas.DataFrame(stat_rows).to_excel(writer, sheet_name="Cell Descriptors", index=False, header=False)
+
+
+# sum the meshblock populations for a grid level
+def get_boundary_population(mb_population, mb_level, level):
+    factor = 2 ** (mb_level - level)
+    size = 2 ** level
+
+    return mb_population.reshape(size, factor, size, factor).sum(axis=(1, 3))
+
+
+def create_data_files(data_path, boundary_name, level, population, tables, random, settings):
+    size = 2 ** level
+    region_ids = [get_region_id(boundary_name, level, x, y) for y in range(0, size) for x in range(0, size)]
+    persons = population.flatten()
+
+    for table_dict in tables:
+        # the indigenous boundaries only have the indigenous table & vice versa
+        if (boundary_name[:1] == "i") != table_dict.get("indigenous", False):
+            continue
+
+        columns = list()
+
+        for stat_id, long_id in table_dict["stats"]:
+            if long_id.endswith("_Males"):
+                values = numpy.round(persons * random.uniform(0.47, 0.53, len(persons)))
+                males = values
+            elif long_id.endswith("_Females"):
+                values = persons - males
+            elif long_id.endswith("_Persons"):
+                values = persons
+            elif long_id.startswith("Median"):
+                values = numpy.round(random.uniform(20.0, 60.0, len(persons)))
+            elif long_id.startswith("Average"):
+                values = numpy.round(random.uniform(1.5, 3.5, len(persons)), 1)
+            else:
+                values = numpy.round(persons * random.beta(1.0, 8.0, len(persons)))
+
+            columns.append(values)
+
+        values = numpy.column_stack(columns)
+
+        # some cells are randomly adjusted (suppressed) - they're written as '..'
+        suppressed = random.random_sample(values.shape) < 0.001
+        suppressed[:, :3] = False
+
+        if settings['census_year'] == "2011":
+            file_name = "{0}{1}_AUST_{2}_short.csv".format(settings['data_file_prefix'], table_dict["table"],
+                                                            boundary_name.upper())
+        else:
+            file_name = "{0}{1}_{2}_AUS.csv".format(settings['data_file_prefix'], table_dict["table"],
+                                                    boundary_name.upper())
+
+        with open(os.path.join(data_path, file_name), "w") as csv_file:
+            header = [settings['region_id_field'].upper()] + [long_id for stat_id, long_id in table_dict["stats"]]
+            csv_file.write(",".join(header) + "\n")
+
+            for i, region_id in enumerate(region_ids):
+                row = [".." if suppressed[i, j] else "{0:g}".format(value) for j, value in enumerate(values[i])]
+                csv_file.write(region_id + "," + ",".join(row) + "\n")
+
+
+# region ids start with a state digit, like the ABS's
+def get_region_id(boundary_name, level, x, y):
+    size = 2 ** level
+    state = get_state_index(level, x, y) + 1
+
+    return "{0}{1:0{2}d}".format(state, y * size + x, len(str(size * size)))
+
+
+# the state (index in the settings) a grid cell is in - the states are the 4 x 4 grid
+def get_state_index(level, x, y):
+    state_level = min(level, 2)
+    factor = 2 ** (level - state_level)
+
+    return ((y // factor) * (2 ** state_level) + x // factor) % 9
+
+
+# writes a boundary's Shapefile(s) - meshblocks have one per state
+def create_shapefiles(bdys_path, boundary_dict, level, mb_level, settings):
+    boundary_name = boundary_dict["boundary"]
+    size = 2 ** level
+
+    fields = get_fields(boundary_dict)
+
+    # all cells, grouped by file
+    file_cells = dict()
+
+    for y in range(0, size):
+        for x in range(0, size):
+            if boundary_name == "mb":
+                state = settings['states'][get_state_index(level, x, y)]
+                file_name = "MB_{0}_{1}".format(settings['census_year'], state)
+            else:
+                file_name = "{0}_{1}_AUST".format(boundary_name.upper(), settings['census_year'])
+
+            file_cells.setdefault(file_name, list()).append((x, y))
+
+    for file_name, cells in file_cells.items():
+        polygons = list()
+        records = list()
+
+        for x, y in cells:
+            polygons.append(get_cell_polygon(x, y, level, mb_level))
+
+            region_id = get_region_id(boundary_name, level, x, y)
+            area_sqkm = get_cell_area(y, level)
+
+            record = list()
+
+            for field_name, field_type, field_length, field_decimals in fields:
+                if field_type == "N" and field_name.endswith("sqm"):
+                    record.append(area_sqkm * 1000000.0)
+                elif field_type == "N":
+                    record.append(area_sqkm)
+                elif field_name == boundary_dict["id_field"]:
+                    record.append(region_id)
+                else:
+                    record.append("Synthetic {0} {1}".format(boundary_name.upper(), region_id))
+
+            records.append(record)
+
+        write_shapefile(os.path.join(bdys_path, file_name), polygons, fields, records)
+
+
+# the dbf fields for a boundary - its id field and the fields used in its name & area expressions
+def get_fields(boundary_dict):
+    fields = [(boundary_dict["id_field"], "C", 20, 0)]
+
+    for expression in [boundary_dict["name_field"], boundary_dict["area_field"]]:
+        # remove the string literals and get the field names
+        for field_name in re.findall("[a-z_][a-z0-9_]*", re.sub("'[^']*'", "", expression.lower())):
+            if field_name not in [field[0] for field in fields]:
+                if "sqkm" in field_name or "sqm" in field_name or "area" in field_name:
+                    fields.append((field_name, "N", 20, 6))
+                else:
+                    fields.append((field_name, "C", 80, 0))
+
+    return fields
+
+
+# area (in square km) of a grid cell, roughly
+def get_cell_area(y, level):
+    size = 2 ** level
+    width = (max_x - min_x) / size
+    height = (max_y - min_y) / size
+    latitude = min_y + (y + 0.5) * height
+
+    return width * 111.32 * math.cos(math.radians(latitude)) * height * 110.57
+
+
+# the cell's outer ring, clockwise. Its edges have a vertex every meshblock edge_vertices, so neighbouring cells at
+# any level share exactly the same edges
+def get_cell_polygon(x, y, level, mb_level):
+    steps = (2 ** (mb_level - level)) * edge_vertices
+
+    # lattice coordinates of the cell's corners
+    left = x * steps
+    right = left + steps
+    bottom = y * steps
+    top = bottom + steps
+
+    ring = list()
+
+    # up the left side, across the top, down the right side, back along the bottom
+    for i in range(bottom, top):
+        ring.append(get_vertical_edge_point(left, i, mb_level))
+
+    for i in range(left, right):
+        ring.append(get_horizontal_edge_point(i, top, mb_level))
+
+    for i in range(top, bottom, -1):
+        ring.append(get_vertical_edge_point(right, i, mb_level))
+
+    for i in range(right, left, -1):
+        ring.append(get_horizontal_edge_point(i, bottom, mb_level))
+
+    ring.append(ring[0])
+
+    return ring
+
+
+def get_lattice_step(mb_level):
+    lattice_size = (2 ** mb_level) * edge_vertices
+
+    return (max_x - min_x) / lattice_size, (max_y - min_y) / lattice_size
+
+
+# the vertices between the meshblock corners are jittered across the edge
+def get_vertical_edge_point(lattice_x, lattice_y, mb_level):
+    step_x, step_y = get_lattice_step(mb_level)
+    offset = 0.0
+
+    if lattice_y % edge_vertices != 0:
+        offset = get_jitter(lattice_x, lattice_y, 1) * step_x * 0.35
+
+    return min_x + lattice_x * step_x + offset, min_y + lattice_y * step_y
+
+
+def get_horizontal_edge_point(lattice_x, lattice_y, mb_level):
+    step_x, step_y = get_lattice_step(mb_level)
+    offset = 0.0
+
+    if lattice_x % edge_vertices != 0:
+        offset = get_jitter(lattice_x, lattice_y, 2) * step_y * 0.35
+
+    return min_x + lattice_x * step_x, min_y + lattice_y * step_y + offset
+
+
+# a repeatable pseudo random number between -1 and 1 for a lattice point
+def get_jitter(lattice_x, lattice_y, direction):
+    value = ((lattice_x * 73856093) ^ (lattice_y * 19349663) ^ (direction * 83492791)) & 0xffffffff
+    value = (value * 2654435761) & 0xffffffff
+
+    return value / 2147483647.5 - 1.0
+
+
+# writes a polygon Shapefile (.shp, .shx & .dbf) - one single ring polygon per record
+def write_shapefile(path, polygons, fields, records):
+    shp_records = list()
+
+    for polygon in polygons:
+        xs = [point[0] for point in polygon]
+        ys = [point[1] for point in polygon]
+
+        content = struct.pack("<i4d2i", 5, min(xs), min(ys), max(xs), max(ys), 1, len(polygon))
+        content += struct.pack("<i", 0)
+        content += b"".join([struct.pack("<2d", point[0], point[1]) for point in polygon])
+
+        shp_records.append(content)
+
+    all_xs = [point[0] for polygon in polygons for point in polygon]
+    all_ys = [point[1] for polygon in polygons for point in polygon]
+    bbox = (min(all_xs), min(all_ys), max(all_xs), max(all_ys))
+
+    # file lengths are in 16 bit words
+    shp_length = 100 + sum([8 + len(content) for content in shp_records])
+    shx_length = 100 + 8 * len(shp_records)
+
+    with open(path + ".shp", "wb") as shp_file, open(path + ".shx", "wb") as shx_file:
+        shp_file.write(get_shapefile_header(shp_length, bbox))
+        shx_file.write(get_shapefile_header(shx_length, bbox))
+
+        offset = 100
+
+        for i, content in enumerate(shp_records):
+            shp_file.write(struct.pack(">2i", i + 1, len(content) // 2))
+            shp_file.write(content)
+
+            shx_file.write(struct.pack(">2i", offset // 2, len(content) // 2))
+            offset += 8 + len(content)
+
+    # GDA94
+    with open(path + ".prj", "w") as prj_file:
+        prj_file.write('GEOGCS["GCS_GDA_1994",DATUM["D_GDA_1994",SPHEROID["GRS_1980",6378137.0,298.257222101]],'
+                       'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+    write_dbf(path + ".dbf", fields, records)
+
+
+def get_shapefile_header(file_length, bbox):
+    header = struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length // 2)
+    header += struct.pack("<2i", 1000, 5)
+    header += struct.pack("<8d", bbox[0], bbox[1], bbox[2], bbox[3], 0.0, 0.0, 0.0, 0.0)
+
+    return header
+
+
+# writes a dBase III file. Field names are limited to 10 characters
+def write_dbf(path, fields, records):
+    record_length = 1 + sum([field[2] for field in fields])
+    header_length = 32 + 32 * len(fields) + 1
+    today = datetime.now()
+
+    with open(path, "wb") as dbf_file:
+        dbf_file.write(struct.pack("<4BIHH20x", 3, today.year - 1900, today.month, today.day, len(records),
+                                   header_length, record_length))
+
+        for field_name, field_type, field_length, field_decimals in fields:
+            dbf_file.write(struct.pack("<11sc4xBB14x", field_name.upper()[:10].encode("ascii"),
+                                       field_type.encode("ascii"), field_length, field_decimals))
+
+        dbf_file.write(b"\r")
+
+        for record in records:
+            values = list()
+
+            for (field_name, field_type, field_length, field_decimals), value in zip(fields, record):
+                if field_type == "N":
+                    text = "{0:>{1}.{2}f}".format(value, field_length, field_decimals)
+                else:
+                    text = "{0:<{1}}".format(value, field_length)
+
+                values.append(text[:field_length].encode("ascii"))
+
+            dbf_file.write(b" " + b"".join(values))
+
+        dbf_file.write(b"\x1a")
+
+
+if __name__ == '__main__':
+    main()
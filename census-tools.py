@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# census-tools.py
+# *********************************************************************************************************************
+#
+# Command line tools for working with a census-loader database
+#
+# Commands:
+#   lookup : finds the census boundaries a CSV or NDJSON file of points are in, and their stats, e.g.
+#     python census-tools.py lookup --input customers.csv --output customers_census.csv --stats g3 g1
+#       --boundaries mb sa1 sa2 sa3 sa4 lga poa
+#   export : writes the stats of every region of a boundary type, and optionally their boundaries, to a CSV, Parquet
+#     or GeoPackage file, e.g.
+#     python census-tools.py export --boundary sa2 --stats g3 g1 --zoom 12 --output sa2.gpkg
+#
+# Takes the same Postgres & schema arguments as load-census.py
+#
+# *********************************************************************************************************************
+
+import io
+import psycopg2  # module needs to be installed
+import psycopg2.extras
+import sys
+import web.catalogue as catalogue
+import web.export as export
+import web.lookup as lookup
+import web.utils as utils
+
+from datetime import datetime
+
+
+def main():
+    parser = utils.get_argument_parser()
+    parser.add_argument('command', choices=['lookup', 'export'], help='Tool to run.')
+    parser.add_argument('--input', default='-', help='Input file. Defaults to stdin.')
+    parser.add_argument('--output', default='-', help='Output file. Defaults to stdout.')
+    parser.add_argument('--input-format', choices=['csv', 'ndjson'],
+                        help='Input file format. Defaults to ndjson for .json & .ndjson files, otherwise csv.')
+    parser.add_argument('--output-format', choices=['csv', 'ndjson'],
+                        help='Output format. Defaults to the input format.')
+    parser.add_argument('--boundaries', nargs='+', help='lookup only. Boundaries to find. Defaults to all of them.')
+    parser.add_argument('--stats', nargs='+', help='Stat ids to output.')
+    parser.add_argument('--stats-boundary', default='sa1',
+                        help='lookup only. Boundary to get the stats for. Defaults to sa1.')
+    parser.add_argument('--boundary', help='export only. Boundary to export.')
+    parser.add_argument('--zoom', type=int,
+                        help='export only. Zoom level (4 to 17) of the display boundaries to export. '
+                             'Defaults to no boundaries.')
+    parser.add_argument('--format', choices=sorted(export.export_formats.keys()),
+                        help='export only. Output file format. Defaults to the output file\'s extension.')
+    args = parser.parse_args()
+
+    settings = utils.get_settings(args)
+
+    if settings is None:
+        print("Invalid Census Year - set it to 2011 or 2016", file=sys.stderr)
+        return False
+
+    pg_conn = psycopg2.connect(settings['pg_connect_string'])
+
+    try:
+        if args.command == "lookup":
+            return run_lookup(pg_conn, args, settings)
+        elif args.command == "export":
+            return run_export(pg_conn, args, settings)
+    finally:
+        pg_conn.close()
+
+
+def run_lookup(pg_conn, args, settings):
+    start_time = datetime.now()
+
+    input_format = args.input_format
+
+    if input_format is None:
+        input_format = "ndjson" if args.input.lower().endswith("json") else "csv"
+
+    output_format = args.output_format or input_format
+
+    try:
+        boundaries = lookup.get_lookup_boundaries(settings, args.boundaries)
+
+        if not args.boundaries:
+            boundaries = lookup.get_loaded_boundaries(pg_conn, boundaries, settings)
+
+        stats = get_stats(pg_conn, args.stats, settings)
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return False
+
+    if len(stats) > 0 and args.stats_boundary not in [boundary_dict["boundary"] for boundary_dict in boundaries]:
+        print("Stats boundary isn't one of the boundaries : {0}".format(args.stats_boundary), file=sys.stderr)
+        return False
+
+    input_file = sys.stdin if args.input == "-" else io.open(args.input, "r", encoding="utf-8", newline="")
+    output_file = sys.stdout if args.output == "-" else io.open(args.output, "w", encoding="utf-8", newline="")
+
+    num_points = 0
+
+    try:
+        def count_points(points):
+            nonlocal num_points
+
+            for point in points:
+                num_points += 1
+                yield point
+
+        points = count_points(lookup.read_points(input_file, input_format))
+        row_batches = lookup.lookup_points(pg_conn, points, boundaries, stats, args.stats_boundary, settings)
+
+        for output in lookup.get_output_lines(row_batches, lookup.get_output_columns(boundaries, stats),
+                                              output_format):
+            output_file.write(output)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    print("Looked up {0} points in {1}".format(num_points, datetime.now() - start_time), file=sys.stderr)
+
+    return True
+
+
+def run_export(pg_conn, args, settings):
+    start_time = datetime.now()
+
+    output_format = args.format or args.output.rsplit(".", 1)[-1].lower()
+
+    if args.output == "-" or output_format not in export.export_formats:
+        print("An output file with a csv, parquet or gpkg extension (or --format) is needed", file=sys.stderr)
+        return False
+
+    if args.boundary not in [boundary_dict["boundary"] for boundary_dict in settings['bdy_table_dicts']
+                             if boundary_dict["boundary"] != "mb"]:
+        print("Invalid boundary : {0}".format(args.boundary), file=sys.stderr)
+        return False
+
+    if args.zoom is not None:
+        geometry_column = utils.get_geometry_column(min(max(args.zoom, 4), 17), settings)
+    else:
+        geometry_column = None
+
+    try:
+        stats = get_stats(pg_conn, args.stats, settings)
+    except ValueError as ex:
+        print(ex, file=sys.stderr)
+        return False
+
+    num_rows = export.export_boundary(pg_conn, args.output, args.boundary, stats, geometry_column, output_format,
+                                      settings)
+
+    print("Exported {0} regions in {1}".format(num_rows, datetime.now() - start_time), file=sys.stderr)
+
+    return True
+
+
+# the (stat id, table) of each stat, from the metadata
+def get_stats(pg_conn, stat_ids, settings):
+    if not stat_ids:
+        return list()
+
+    pg_cur = pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    metadata_catalogue = catalogue.MetadataCatalogue()
+    metadata_catalogue.load(pg_cur, settings)
+
+    pg_cur.close()
+    pg_conn.rollback()
+
+    stats = list()
+
+    for stat_id in stat_ids:
+        stat_dict = metadata_catalogue.get_stat(stat_id)
+
+        if stat_dict is None:
+            raise ValueError("Invalid stat : {0}".format(stat_id))
+
+        stats.append((stat_dict["id"], stat_dict["table"]))
+
+    return stats
+
+
+if __name__ == '__main__':
+    if not main():
+        sys.exit(1)
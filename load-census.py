@@ -17,20 +17,23 @@
 #    See http://abs.gov.au for the correct attribution
 
 # Process:
-#   1. load census metadata Excel files using Pandas dataframes
+#   1. load census metadata Excel files using Pandas dataframes (cached after the first load)
 #   2. load all census data CSV files
 #   3. load census boundary Shapefiles
 #   4. create web display optimised census boundaries using Visvalingam-Whyatt simplification
 #   5. fire up the map server and party on!
 #
+#   Steps 2 to 4 run as one graph of jobs - e.g. a boundary's display version is created as soon as its Shapefile
+#   and population table are loaded, while the other files are still loading
+#
 # *********************************************************************************************************************
 
 import io
 import logging.config
 import os
-import pandas  # module needs to be installed (IMPORTANT: need to install 'xlrd' module for Pandas to read .xlsx files)
 import psycopg2  # module needs to be installed
 import psycopg2.extensions
+import web.scheduler as scheduler
 import web.utils as utils
 
 from datetime import datetime
@@ -66,12 +69,13 @@ def main():
         logger.fatal("Unable to add PostGIS extension\nACTION: Check your Postgres user privileges or PostGIS install")
         return False
 
-    # test if ST_ClusterKMeans exists (only in PostGIS 2.3+). It's used to create classes to display the data in the map
+    # test if ST_ClusterKMeans exists (only in PostGIS 2.3+). It's used by the SQL version of the map classes
     utils.check_postgis_version(pg_cur, settings, logger)
 
     if not settings.get('st_clusterkmeans_supported'):
-        logger.warning("YOU NEED TO INSTALL POSTGIS 2.3 OR HIGHER FOR THE MAP SERVER TO WORK\n"
-                       "t utilises the ST_ClusterKMeans() function in v2.3+")
+        logger.warning("PostGIS 2.3 or higher is needed to compare the map server's class breaks with the SQL "
+                       "versions in benchmarks/classification.py\n"
+                       "It utilises the ST_ClusterKMeans() function in v2.3+")
 
     # START LOADING DATA
 
@@ -84,22 +88,62 @@ def main():
     # --census-data-path=/Users/hugh.saalmans/tmp/abs_census_2011_data
     # --census-bdys-path=/Users/hugh.saalmans/minus34/data/abs_2011
 
-    # PART 1 - load census data from CSV files
+    # PART 1 - load census metadata from the Excel files (the data tables are created from it)
     logger.info("")
     start_time = datetime.now()
-    logger.info("Part 1 of 2 : Start census data load : {0}".format(start_time))
+    logger.info("Part 1 of 2 : Start census metadata load : {0}".format(start_time))
     create_metadata_tables(pg_cur, settings['metadata_file_prefix'], settings['metadata_file_type'], settings)
-    populate_data_tables(settings['data_file_prefix'], settings['data_file_type'],
-                         settings['table_name_part'], settings['bdy_name_part'], settings)
-    logger.info("Part 1 of 2 : Census data loaded! : {0}".format(datetime.now() - start_time))
+    logger.info("Part 1 of 2 : Census metadata loaded! : {0}".format(datetime.now() - start_time))
 
-    # PART 2 - load census boundaries from Shapefiles and optimise them for web visualisation
+    # PART 2 - load census data from CSV files & boundaries from Shapefiles and optimise them for web visualisation.
+    # Run as one graph of jobs, each starting as soon as its inputs are loaded
     logger.info("")
     start_time = datetime.now()
-    logger.info("Part 2 of 2 : Start census boundary load : {0}".format(start_time))
-    load_boundaries(pg_cur, settings)
-    create_display_boundaries(pg_cur, settings)
-    logger.info("Part 2 of 2 : Census boundaries loaded! : {0}".format(datetime.now() - start_time))
+    logger.info("Part 2 of 2 : Start census data & boundary load : {0}".format(start_time))
+    prepare_load(pg_cur, settings)
+
+    data_table_jobs = get_data_table_jobs(settings['data_file_prefix'], settings['data_file_type'],
+                                          settings['table_name_part'], settings['bdy_name_part'], settings)
+    boundary_load_jobs = get_boundary_load_jobs(settings)
+    display_jobs = get_display_boundary_jobs(settings, boundary_load_jobs)
+
+    job_scheduler = scheduler.JobScheduler(logger)
+    job_scheduler.add_list(data_table_jobs)
+    job_scheduler.add_list(boundary_load_jobs)
+    job_scheduler.add_list(display_jobs)
+    job_scheduler.add_list(get_boundary_density_jobs(settings, display_jobs))
+
+    if settings['hilbert_order']:
+        hilbert_jobs = get_hilbert_order_jobs(settings, data_table_jobs, display_jobs)
+        job_scheduler.add_list(hilbert_jobs)
+    else:
+        hilbert_jobs = list()
+
+    if settings['fast_load']:
+        job_scheduler.add_list(get_fast_load_jobs(settings, data_table_jobs, boundary_load_jobs, display_jobs,
+                                                  hilbert_jobs))
+
+    job_scheduler.add_list(get_region_profile_jobs(settings, data_table_jobs, display_jobs, hilbert_jobs))
+
+    meshblock_jobs = get_meshblock_jobs(settings, boundary_load_jobs)
+    job_scheduler.add_list(meshblock_jobs)
+    job_scheduler.add_list(get_concordance_jobs(settings, data_table_jobs, meshblock_jobs, hilbert_jobs))
+
+    if settings['previous_census_year'] is not None:
+        job_scheduler.add_list(get_change_jobs(pg_cur, settings, data_table_jobs, boundary_load_jobs, meshblock_jobs))
+
+    pool = utils.get_worker_pool(settings)
+
+    if settings['adaptive_processes']:
+        job_scheduler.run(pool, settings['max_concurrent_processes'], settings['min_concurrent_processes'],
+                          lambda: utils.get_database_load(pg_cur, settings))
+    else:
+        job_scheduler.run(pool, settings['max_concurrent_processes'])
+
+    pool.close()
+    pool.join()
+
+    logger.info("Part 2 of 2 : Census data & boundaries loaded! : {0}".format(datetime.now() - start_time))
 
     # close Postgres connection
     pg_cur.close()
@@ -147,6 +191,9 @@ def create_metadata_tables(pg_cur, prefix, suffix, settings):
                     file_dict["name"] = file_name
                     file_dict["path"] = file_path
 
+                    # hash each workbook once here, not once per worksheet job
+                    file_dict["hash"] = utils.get_file_hash(file_path)
+
                     file_list.append(file_dict)
 
     # are there any files to load?
@@ -154,51 +201,43 @@ def create_metadata_tables(pg_cur, prefix, suffix, settings):
         logger.fatal("No Census metadata XLS files found\nACTION: Check your '--census-data-path' value")
         logger.fatal("\t- Step 1 of 4 : create metadata tables FAILED!")
     else:
-        # read in excel worksheets into pandas dataframes
-        for file_dict in file_list:
-
-            xl = pandas.ExcelFile(file_dict["path"])
-
-            sheets = xl.sheet_names
-            i = 0
-
-            for table_dict in settings["census_metadata_dicts"]:
-
-                df = xl.parse(sheets[i])
-
-                # drop unwanted rows at the top
-                j = 0
-                first_row = False
+        # the cleaned worksheets are cached - unless the cache directory isn't safe to read from
+        try:
+            cache_directory = utils.get_cache_directory(settings)
+        except OSError as ex:
+            logger.warning("\t- Not caching the metadata : {0}".format(ex))
+            cache_directory = None
 
-                while not first_row:
-                    cell = df.iloc[j, 0]
+        # parse the excel worksheets in parallel (one job per worksheet)
+        work_list = list()
 
-                    if str(cell).lower() == table_dict["first_row"]:
-                        df_clean = df.drop(df.index[0:j+1])
-                        first_row = True
-
-                        # drop excess columns in unclean Excel worksheets
-                        if table_dict["table"] == "metadata_stats":
-                            try:
-                                df_clean.drop(df.columns[[6, 7, 8]], axis=1, inplace=True)
-                            except:
-                                pass
-
-                        # export to in-memory tab delimited text file
-                        tsv_file = io.StringIO()
-                        df_clean.to_csv(tsv_file, sep="\t", index=False, header=False)
-                        tsv_file.seek(0)  # move position back to beginning of file before reading
+        for file_dict in file_list:
+            for i, table_dict in enumerate(settings["census_metadata_dicts"]):
+                sheet_dict = dict()
+                sheet_dict["name"] = file_dict["name"]
+                sheet_dict["path"] = file_dict["path"]
+                sheet_dict["hash"] = file_dict["hash"]
+                sheet_dict["sheet"] = i
+                sheet_dict["table"] = table_dict["table"]
+                sheet_dict["first_row"] = table_dict["first_row"]
+
+                if cache_directory is not None:
+                    sheet_dict["cache_file"] = os.path.join(cache_directory, "metadata_{0}_{1}_{2}.tsv"
+                                                            .format(file_dict["hash"], i, table_dict["table"]))
+                else:
+                    sheet_dict["cache_file"] = None
 
-                        # import into Postgres
-                        sql = "COPY {0}.{1} FROM stdin WITH CSV DELIMITER as '\t' NULL as ''" \
-                            .format(settings['data_schema'], table_dict["table"])
-                        pg_cur.copy_expert(sql, tsv_file)
+                work_list.append(sheet_dict)
 
-                    j += 1
+        sheet_list = utils.multiprocess_metadata_sheets(work_list, settings, logger)
 
-                i += 1
+        # import into Postgres
+        for sheet_dict in sheet_list:
+            sql = "COPY {0}.{1} FROM stdin WITH CSV DELIMITER as '\t' NULL as ''" \
+                .format(settings['data_schema'], sheet_dict["table"])
+            pg_cur.copy_expert(sql, io.StringIO(sheet_dict["tsv"]))
 
-            logger.info("\t\t- imported {0}".format(file_dict["name"]))
+            logger.info("\t\t- imported {0} : {1}".format(sheet_dict["name"], sheet_dict["table"]))
 
     # clean up invalid rows
     pg_cur.execute("DELETE FROM {0}.metadata_tables WHERE table_number IS NULL".format(settings['data_schema']))
@@ -220,13 +259,58 @@ def create_metadata_tables(pg_cur, prefix, suffix, settings):
     logger.info("\t- Step 1 of 2 : metadata tables created : {0}".format(datetime.now() - start_time))
 
 
-# create stats tables and import data from CSV files using multiprocessing
-def populate_data_tables(prefix, suffix, table_name_part, bdy_name_part, settings):
-    # Step 2 of 2 : create & populate stats tables with CSV files using multiprocessing
+# creates the schemas and shared objects the load's jobs write to
+def prepare_load(pg_cur, settings):
     start_time = datetime.now()
 
-    # get the file list and create sql copy statements
-    file_list = []
+    # create schemas
+    for schema_name in [settings['boundary_schema'], settings['web_schema']]:
+        if schema_name != "public":
+            pg_cur.execute("CREATE SCHEMA IF NOT EXISTS {0} AUTHORIZATION {1}".format(schema_name, settings['pg_user']))
+
+    # create the table for the boundary density grids
+    sql = "DROP TABLE IF EXISTS {0}.boundary_density CASCADE;" \
+          "CREATE TABLE {0}.boundary_density (boundary text NOT NULL, cell_x integer NOT NULL, " \
+          "cell_y integer NOT NULL, features integer NOT NULL, " \
+          "CONSTRAINT boundary_density_pkey PRIMARY KEY (boundary, cell_x, cell_y)) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.boundary_density OWNER TO {1}".format(settings['web_schema'], settings['pg_user'])
+    pg_cur.execute(sql)
+
+    # create the table of the boundaries each meshblock is in
+    sql = "DROP TABLE IF EXISTS {0}.mb_boundaries CASCADE;" \
+          "CREATE TABLE {0}.mb_boundaries (mb_id text NOT NULL, boundary text NOT NULL, id text NOT NULL) " \
+          "WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.mb_boundaries OWNER TO {1}".format(settings['web_schema'], settings['pg_user'])
+    pg_cur.execute(sql)
+
+    # create the table of every stat of each region, for getting a region's whole profile with one lookup. The profiles
+    # are big enough to be compressed by Postgres
+    sql = "DROP TABLE IF EXISTS {0}.region_profiles CASCADE;" \
+          "CREATE TABLE {0}.region_profiles (boundary text NOT NULL, id text NOT NULL, profile jsonb NOT NULL, " \
+          "CONSTRAINT region_profiles_pkey PRIMARY KEY (boundary, id)) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.region_profiles OWNER TO {1}".format(settings['web_schema'], settings['pg_user'])
+    pg_cur.execute(sql)
+
+    # create the table of how much of each boundary is in each boundary of another type
+    sql = "DROP TABLE IF EXISTS {0}.boundary_concordance CASCADE;" \
+          "CREATE TABLE {0}.boundary_concordance (from_boundary text NOT NULL, from_id text NOT NULL, " \
+          "to_boundary text NOT NULL, to_id text NOT NULL, area double precision NOT NULL, " \
+          "population double precision NOT NULL, from_area_share double precision NULL, " \
+          "from_population_share double precision NULL, to_area_share double precision NULL, " \
+          "to_population_share double precision NULL) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.boundary_concordance OWNER TO {1}".format(settings['web_schema'], settings['pg_user'])
+    pg_cur.execute(sql)
+
+    if settings['hilbert_order']:
+        create_hilbert_key_function(pg_cur, settings)
+
+    logger.info("\t- schemas prepared : {0}".format(datetime.now() - start_time))
+
+
+# create stats tables and import data from CSV files
+def get_data_table_jobs(prefix, suffix, table_name_part, bdy_name_part, settings):
+    job_list = list()
+
     # get a dictionary of all files matching the filename prefix
     for root, dirs, files in os.walk(settings['data_directory']):
         for file_name in files:
@@ -250,34 +334,27 @@ def populate_data_tables(prefix, suffix, table_name_part, bdy_name_part, setting
                         "name": file_name
                     }
 
-                    # if boundary == "ced":  # for testing
-                    print(file_dict)
-                    file_list.append(file_dict)
+                    job_list.append(scheduler.Job(get_data_table_job_name(boundary, table), "csv",
+                                                  utils.run_csv_import_multiprocessing, [file_dict, settings],
+                                                  cost=os.path.getsize(file_path)))
 
     # are there any files to load?
-    if len(file_list) == 0:
+    if len(job_list) == 0:
         logger.fatal("No Census data CSV files found\nACTION: Check your '--census-data-path' value")
-        logger.fatal("\t- Step 2 of 2 : stats table create & populate FAILED!")
-    else:
-        # load all files using multiprocessing
-        utils.multiprocess_csv_import(file_list, settings, logger)
-        logger.info("\t- Step 2 of 2 : stats tables created & populated : {0}".format(datetime.now() - start_time))
 
+    return job_list
 
-# loads the admin bdy shapefiles using the shp2pgsql command line tool (part of PostGIS), using multiprocessing
-def load_boundaries(pg_cur, settings):
-    # Step 1 of 2 : load census boundaries
-    start_time = datetime.now()
 
-    # create schema
-    if settings['boundary_schema'] != "public":
-        pg_cur.execute("CREATE SCHEMA IF NOT EXISTS {0} AUTHORIZATION {1}"
-                       .format(settings['boundary_schema'], settings['pg_user']))
+def get_data_table_job_name(boundary_name, table):
+    return "csv:{0}_{1}".format(boundary_name, table)
 
-    # get file list
-    table_list = list()
-    create_list = list()
-    append_list = list()
+
+# loads the admin bdy shapefiles using the shp2pgsql command line tool (part of PostGIS)
+def get_boundary_load_jobs(settings):
+    job_list = list()
+
+    # the jobs for each table - states after the first are appended to it (only applies to meshblocks in Census 2016)
+    table_jobs = dict()
 
     # get a dictionary of Shapefile paths
     for root, dirs, files in os.walk(settings['boundaries_local_directory']):
@@ -298,58 +375,47 @@ def load_boundaries(pg_cur, settings):
                     file_dict['pg_table'] = file_name.replace(".shp", "")
 
                 file_dict['pg_schema'] = settings['boundary_schema']
+                file_dict['spatial'] = True
+
+                # the shapefile's size, including its attributes
+                cost = os.path.getsize(file_dict['file_path'])
+                dbf_path = os.path.splitext(file_dict['file_path'])[0] + ".dbf"
 
-                # set to replace or append to table depending on whether this is the 1st state for that dataset
-                # (only applies to meshblocks in Census 2016)
-                table_list_add = False
+                if os.path.isfile(dbf_path):
+                    cost += os.path.getsize(dbf_path)
 
-                if file_dict['pg_table'] not in table_list:
-                    table_list_add = True
+                # set to replace or append to table depending on whether this is the 1st state for that dataset.
+                # Appends to a table run one at a time (large sets of parallel INSERTs cause database deadlocks)
+                previous_jobs = table_jobs.setdefault(file_dict['pg_table'], list())
 
+                if len(previous_jobs) == 0:
                     file_dict['delete_table'] = True
+                    job_name = get_boundary_load_job_name(file_dict['pg_table'])
+                    deps = list()
                 else:
                     file_dict['delete_table'] = False
+                    job_name = "{0}:{1}".format(get_boundary_load_job_name(file_dict['pg_table']), len(previous_jobs))
+                    deps = [previous_jobs[-1].name]
 
-                file_dict['spatial'] = True
-
-                if table_list_add:
-                    table_list.append(file_dict['pg_table'])
-                    create_list.append(file_dict)
-                else:
-                    append_list.append(file_dict)
-
-    # logger.info(create_list)
-    # logger.info(append_list)
+                job = scheduler.Job(job_name, "shapefile", utils.intermediate_shapefile_load_step,
+                                    [file_dict, settings], cost=cost, deps=deps)
+                previous_jobs.append(job)
+                job_list.append(job)
 
     # are there any files to load?
-    if len(create_list) == 0:
+    if len(job_list) == 0:
         logger.fatal("No census boundary files found\nACTION: Check your 'census-bdys-path' argument")
-    else:
-        # load files in separate processes
-        utils.multiprocess_shapefile_load(create_list, settings, logger)
 
-        # Run the appends one at a time (Can't multi process as large sets of parallel INSERTs cause database deadlocks)
-        # utils.multiprocess_shapefile_load(append_list, settings, logger)
-        for shp in append_list:
-            utils.import_shapefile_to_postgres(pg_cur, shp['file_path'], shp['pg_table'], shp['pg_schema'],
-                                               shp['delete_table'], True)
+    return job_list
 
-        logger.info("\t- Step 1 of 2 : boundaries loaded : {0}".format(datetime.now() - start_time))
 
+def get_boundary_load_job_name(pg_table):
+    return "shapefile:{0}".format(pg_table)
 
-def create_display_boundaries(pg_cur, settings):
-    # Step 2 of 2 : create web optimised versions of the census boundaries
-    start_time = datetime.now()
-
-    # create schema
-    if settings['web_schema'] != "public":
-        pg_cur.execute("CREATE SCHEMA IF NOT EXISTS {0} AUTHORIZATION {1}"
-                       .format(settings['web_schema'], settings['pg_user']))
 
-    # prepare boundaries for all tiled map zoom levels
-    create_sql_list = list()
-    insert_sql_list = list()
-    vacuum_sql_list = list()
+# creates web optimised versions of the census boundaries. Each one needs its boundary's shapefile(s) & population
+def get_display_boundary_jobs(settings, boundary_load_jobs):
+    job_list = list()
 
     for boundary_dict in settings['bdy_table_dicts']:
         boundary_name = boundary_dict["boundary"]
@@ -365,7 +431,7 @@ def create_display_boundaries(pg_cur, settings):
             # build create table statement
             create_table_list = list()
             create_table_list.append("DROP TABLE IF EXISTS {0}.{1} CASCADE;")
-            create_table_list.append("CREATE TABLE {0}.{1} (")
+            create_table_list.append("CREATE {3} {0}.{1} (")
 
             # build column list
             column_list = list()
@@ -374,44 +440,68 @@ def create_display_boundaries(pg_cur, settings):
             column_list.append("area double precision NOT NULL")
             column_list.append("population double precision NOT NULL")
             column_list.append("geom geometry(MultiPolygon, 4283) NULL")
+            column_list.append("hilbert_key bigint NULL")
 
             for zoom_level in range(4, 18):
-                display_zoom = str(zoom_level).zfill(2)
-                column_list.append("geojson_{0} jsonb NOT NULL".format(display_zoom))
+                geom_column = utils.get_geometry_column(zoom_level, settings)
+
+                if settings['geometry_format'] == "twkb":
+                    column_list.append("{0} bytea NOT NULL".format(geom_column))
+                else:
+                    column_list.append("{0} jsonb NOT NULL".format(geom_column))
+
+            # vertex and byte counts of the geometries for each zoom level, for estimating map response sizes
+            column_list.append("geometry_points integer[] NULL")
+            column_list.append("geometry_bytes integer[] NULL")
 
             # add columns to create table statement and finish it
             create_table_list.append(",".join(column_list))
             create_table_list.append(") WITH (OIDS=FALSE);")
-            create_table_list.append("ALTER TABLE {0}.{1} OWNER TO {2};")
-            create_table_list.append("CREATE INDEX {1}_geom_idx ON {0}.{1} USING gist (geom);")
-            create_table_list.append("ALTER TABLE {0}.{1} CLUSTER ON {1}_geom_idx")
+            create_table_list.append("ALTER TABLE {0}.{1} OWNER TO {2}")
 
-            sql = "".join(create_table_list).format(settings['web_schema'], pg_table, settings['pg_user'])
-            create_sql_list.append(sql)
+            # the spatial index is created at the end of a fast load
+            if not settings['fast_load']:
+                create_table_list.append(";CREATE INDEX {1}_geom_idx ON {0}.{1} USING gist (geom);")
+                create_table_list.append("ALTER TABLE {0}.{1} CLUSTER ON {1}_geom_idx")
+
+            create_sql = "".join(create_table_list).format(settings['web_schema'], pg_table, settings['pg_user'],
+                                                           utils.get_create_table_type(settings))
 
             # get population field and table
-            if boundary_name[:1] == "i":
-                pop_stat = "i3"
-                pop_table = "i01a"
-            elif settings["census_year"] == "2011":
-                pop_stat = "b3"
-                pop_table = "b01"
-            else:
-                pop_stat = "g3"
-                pop_table = "g01"
+            pop_stat, pop_table = get_population_stat(boundary_name, settings)
+
+            # count the vertices and bytes of each zoom level's geometries
+            points_list = list()
+            bytes_list = list()
+
+            for zoom_level in range(4, 18):
+                geom_column = utils.get_geometry_column(zoom_level, settings)
+
+                if settings['geometry_format'] == "twkb":
+                    points_list.append("ST_NPoints(ST_GeomFromTWKB({0}))".format(geom_column))
+                    bytes_list.append("octet_length({0})".format(geom_column))
+                else:
+                    points_list.append("ST_NPoints(ST_GeomFromGeoJSON({0}::text))".format(geom_column))
+                    bytes_list.append("octet_length({0}::text)".format(geom_column))
 
             # build insert statement
             insert_into_list = list()
             insert_into_list.append("INSERT INTO {0}.{1}".format(settings['web_schema'], pg_table))
+
+            # the vertex & byte counts (at the end) are counted from the display geometries in the same statement, so
+            # each row is only written once
+            insert_into_list.append("SELECT disp.*, ARRAY[{0}], ARRAY[{1}] FROM ("
+                                    .format(",".join(points_list), ",".join(bytes_list)))
             insert_into_list.append("SELECT bdy.{0} AS id, {1} AS name, SUM(bdy.{2}) AS area, tab.{3} AS population,"
                                     .format(id_field, name_field, area_field, pop_stat))
 
             # thin geometry to make querying faster
             tolerance = utils.get_tolerance(10)
             insert_into_list.append("ST_Transform(ST_Multi(ST_Union(ST_SimplifyVW("
-                                    "ST_Transform(geom, 3577), {0}))), 4283),".format(tolerance,))
+                                    "ST_Transform(geom, 3577), {0}))), 4283) AS geom,".format(tolerance,))
+            insert_into_list.append("NULL::bigint AS hilbert_key,")
 
-            # create statements for geojson optimised for each zoom level
+            # create statements for geojson (or twkb) optimised for each zoom level
             geojson_list = list()
 
             for zoom_level in range(4, 18):
@@ -419,10 +509,17 @@ def create_display_boundaries(pg_cur, settings):
                 tolerance = utils.get_tolerance(zoom_level)
                 # trim coords to only the significant ones
                 decimal_places = utils.get_decimal_places(zoom_level)
+                geom_column = utils.get_geometry_column(zoom_level, settings)
 
-                geojson_list.append("ST_AsGeoJSON(ST_Transform(ST_Multi(ST_Union(ST_SimplifyVW(ST_Transform("
-                                    "bdy.geom, 3577), {0}))), 4283), {1})::jsonb"
-                                    .format(tolerance, decimal_places))
+                if settings['geometry_format'] == "twkb":
+                    # quantize coords to integers at the same precision
+                    geojson_list.append("ST_AsTWKB(ST_Transform(ST_Multi(ST_Union(ST_SimplifyVW(ST_Transform("
+                                        "bdy.geom, 3577), {0}))), 4283), {1}) AS {2}"
+                                        .format(tolerance, decimal_places, geom_column))
+                else:
+                    geojson_list.append("ST_AsGeoJSON(ST_Transform(ST_Multi(ST_Union(ST_SimplifyVW(ST_Transform("
+                                        "bdy.geom, 3577), {0}))), 4283), {1})::jsonb AS {2}"
+                                        .format(tolerance, decimal_places, geom_column))
 
             insert_into_list.append(",".join(geojson_list))
             insert_into_list.append("FROM {0}.{1} AS bdy".format(settings['boundary_schema'], input_pg_table))
@@ -431,17 +528,595 @@ def create_display_boundaries(pg_cur, settings):
             insert_into_list.append("ON bdy.{0} = tab.{1}".format(id_field, settings["region_id_field"]))
             insert_into_list.append("WHERE bdy.geom IS NOT NULL")
             insert_into_list.append("GROUP BY {0}, {1}, {2}".format(id_field, name_field, pop_stat))
+            insert_into_list.append(") AS disp")
+
+            insert_sql = " ".join(insert_into_list)
+
+            vacuum_sql = "VACUUM ANALYZE {0}.{1}".format(settings['web_schema'], pg_table)
+
+            # wait for the boundary's shapefile(s) and population table
+            load_jobs = [job for job in boundary_load_jobs if job.args[0]['pg_table'] == input_pg_table]
+
+            deps = [job.name for job in load_jobs]
+            deps.append(get_data_table_job_name(boundary_name, pop_table))
+
+            # simplifying the geometries for 14 zoom levels is the slowest part of the load
+            cost = sum([job.cost for job in load_jobs]) * 14
+
+            job_list.append(scheduler.Job(get_display_boundary_job_name(boundary_name), "display boundary",
+                                          utils.run_sql_list_multiprocessing,
+                                          [[create_sql, insert_sql, vacuum_sql], settings], cost=cost, deps=deps))
+
+    return job_list
+
+
+def get_display_boundary_job_name(boundary_name):
+    return "display:{0}".format(boundary_name)
+
+
+# get the population stat and its table for a boundary
+def get_population_stat(boundary_name, settings):
+    if boundary_name[:1] == "i":
+        return "i3", "i01a"
+    elif settings["census_year"] == "2011":
+        return "b3", "b01"
+    else:
+        return "g3", "g01"
+
+
+# counts the web boundaries in each cell of a lat/long grid - the map server uses them to estimate how many boundaries
+# are in a map view, to choose the finest boundary type it can return
+def get_boundary_density_jobs(settings, display_jobs):
+    job_list = list()
+
+    # count each boundary in the cell its centroid falls in
+    for display_job in display_jobs:
+        boundary_name = display_job.name.split(":")[1]
+
+        sql = "INSERT INTO {0}.boundary_density " \
+              "SELECT '{1}', floor(ST_X(pnt) / {2})::integer, floor(ST_Y(pnt) / {2})::integer, count(*) " \
+              "FROM (SELECT ST_Centroid(geom) AS pnt FROM {0}.{1} WHERE geom IS NOT NULL) AS sub " \
+              "GROUP BY 2, 3".format(settings['web_schema'], boundary_name, settings['density_cell_size'])
+
+        job_list.append(scheduler.Job(get_boundary_density_job_name(boundary_name), "density grid",
+                                      utils.run_sql_multiprocessing, [sql, settings], cost=display_job.cost / 100.0,
+                                      deps=[display_job.name]))
+
+    sql = "ANALYZE {0}.boundary_density".format(settings['web_schema'])
+    job_list.append(scheduler.Job("density:analyze", "density grid", utils.run_sql_multiprocessing, [sql, settings],
+                                  deps=[job.name for job in job_list]))
+
+    return job_list
+
+
+def get_boundary_density_job_name(boundary_name):
+    return "density:{0}".format(boundary_name)
+
+
+# Hilbert curve index of a lat/long on a 2^16 x 2^16 grid covering Australia and its external territories
+def create_hilbert_key_function(pg_cur, settings):
+    sql = "CREATE OR REPLACE FUNCTION {0}.hilbert_key(x double precision, y double precision) " \
+          "RETURNS bigint AS $$ " \
+          "DECLARE " \
+          "n bigint := 65536; " \
+          "ix bigint := least(greatest(floor((x - 96.0) / 73.0 * n), 0), n - 1); " \
+          "iy bigint := least(greatest(floor((y + 55.0) / 46.0 * n), 0), n - 1); " \
+          "s bigint := n / 2; " \
+          "rx bigint; " \
+          "ry bigint; " \
+          "t bigint; " \
+          "d bigint := 0; " \
+          "BEGIN " \
+          "WHILE s > 0 LOOP " \
+          "rx := CASE WHEN (ix & s) > 0 THEN 1 ELSE 0 END; " \
+          "ry := CASE WHEN (iy & s) > 0 THEN 1 ELSE 0 END; " \
+          "d := d + s * s * ((3 * rx) # ry); " \
+          "IF ry = 0 THEN " \
+          "IF rx = 1 THEN " \
+          "ix := n - 1 - ix; " \
+          "iy := n - 1 - iy; " \
+          "END IF; " \
+          "t := ix; " \
+          "ix := iy; " \
+          "iy := t; " \
+          "END IF; " \
+          "s := s / 2; " \
+          "END LOOP; " \
+          "RETURN d; " \
+          "END; " \
+          "$$ LANGUAGE plpgsql IMMUTABLE STRICT".format(settings['web_schema'])
+    pg_cur.execute(sql)
+
+
+# physically orders the web and data tables by a Hilbert curve key of each region's centroid. Map queries read
+# spatially clustered boundaries - this puts their census data rows next to each other on disk as well
+def get_hilbert_order_jobs(settings, data_table_jobs, display_jobs):
+    job_list = list()
+
+    for display_job in display_jobs:
+        boundary_name = display_job.name.split(":")[1]
+
+        # set the key on the web table and cluster on it (after its density grid has been counted)
+        sql = "UPDATE {0}.{1} SET hilbert_key = " \
+              "{0}.hilbert_key(ST_X(ST_Centroid(geom)), ST_Y(ST_Centroid(geom)));" \
+              "CREATE INDEX {1}_hilbert_key_idx ON {0}.{1} USING btree (hilbert_key);" \
+              "CLUSTER {0}.{1} USING {1}_hilbert_key_idx;" \
+              "ANALYZE {0}.{1}".format(settings['web_schema'], boundary_name)
+
+        web_job = scheduler.Job("hilbert:{0}".format(boundary_name), "hilbert order", utils.run_sql_multiprocessing,
+                                [sql, settings], cost=display_job.cost / 20.0,
+                                deps=[display_job.name, get_boundary_density_job_name(boundary_name)])
+        job_list.append(web_job)
+
+        # rewrite each of the boundary's data tables in the same order (CLUSTER can't use another table's key)
+        for data_table_job in data_table_jobs:
+            file_dict = data_table_job.args[0]
+
+            if file_dict["boundary"] == boundary_name:
+                table_name = "{0}_{1}".format(file_dict["boundary"], file_dict["table"])
+
+                sql = "DROP TABLE IF EXISTS {0}.{1}_sorted;" \
+                      "CREATE {5} {0}.{1}_sorted AS " \
+                      "SELECT tab.* FROM {0}.{1} AS tab " \
+                      "LEFT OUTER JOIN {2}.{3} AS bdy ON tab.{4} = bdy.id " \
+                      "ORDER BY bdy.hilbert_key, tab.{4};" \
+                      "DROP TABLE {0}.{1} CASCADE;" \
+                      "ALTER TABLE {0}.{1}_sorted RENAME TO {1}" \
+                    .format(settings['data_schema'], table_name, settings['web_schema'], boundary_name,
+                            settings['region_id_field'], utils.get_create_table_type(settings))
+
+                # the primary key is added at the end of a fast load
+                if not settings['fast_load']:
+                    sql += ";ALTER TABLE {0}.{1} ADD CONSTRAINT {1}_pkey PRIMARY KEY ({2});" \
+                           "ANALYZE {0}.{1}".format(settings['data_schema'], table_name, settings['region_id_field'])
+
+                job_list.append(scheduler.Job("hilbert:{0}".format(table_name), "hilbert order",
+                                              utils.run_sql_multiprocessing, [sql, settings],
+                                              cost=data_table_job.cost, deps=[web_job.name, data_table_job.name]))
+
+    return job_list
+
+
+# finishes a fast load - adds the primary keys & spatial indexes that were left off the unlogged tables and analyses
+# them, optionally making them logged first. Each table's job runs once nothing else writes to it
+def get_fast_load_jobs(settings, data_table_jobs, boundary_load_jobs, display_jobs, hilbert_jobs):
+    job_list = list()
+
+    if settings['set_logged']:
+        # rewrites the table to the WAL - done before the indexes are built so they're only written once
+        set_logged_sql = "ALTER TABLE {0}.{1} SET LOGGED;"
+    else:
+        set_logged_sql = ""
+
+    # census data tables
+    for data_table_job in data_table_jobs:
+        file_dict = data_table_job.args[0]
+        table_name = "{0}_{1}".format(file_dict["boundary"], file_dict["table"])
+
+        deps = [data_table_job.name]
+        deps.extend([job.name for job in hilbert_jobs if job.name == "hilbert:{0}".format(table_name)])
+
+        # the display boundaries read the population tables
+        if get_population_stat(file_dict["boundary"], settings)[1] == file_dict["table"]:
+            deps.extend([job.name for job in display_jobs
+                         if job.name == get_display_boundary_job_name(file_dict["boundary"])])
+
+        sql = set_logged_sql + \
+            "ALTER TABLE {0}.{1} ADD CONSTRAINT {1}_pkey PRIMARY KEY ({2});" \
+            "ALTER TABLE {0}.{1} CLUSTER ON {1}_pkey"
+        sql = sql.format(settings['data_schema'], table_name, settings['region_id_field'])
+
+        vacuum_sql = "VACUUM ANALYZE {0}.{1}".format(settings['data_schema'], table_name)
+
+        job_list.append(scheduler.Job("index:{0}".format(table_name), "fast load index",
+                                      utils.run_sql_list_multiprocessing, [[sql, vacuum_sql], settings],
+                                      cost=data_table_job.cost, deps=deps))
+
+    # raw boundary tables
+    table_jobs = dict()
+
+    for boundary_load_job in boundary_load_jobs:
+        table_jobs.setdefault(boundary_load_job.args[0]['pg_table'], list()).append(boundary_load_job)
+
+    for pg_table, load_jobs in table_jobs.items():
+        deps = [job.name for job in load_jobs]
+        deps.extend([job.name for job in display_jobs
+                     if "{0}_{1}_aust".format(job.name.split(":")[1], settings["census_year"]) == pg_table])
+
+        sql = set_logged_sql + \
+            "CREATE INDEX {1}_geom_idx ON {0}.{1} USING gist (geom);" \
+            "ALTER TABLE {0}.{1} CLUSTER ON {1}_geom_idx"
+        sql = sql.format(settings['boundary_schema'], pg_table)
+
+        vacuum_sql = "VACUUM ANALYZE {0}.{1}".format(settings['boundary_schema'], pg_table)
+
+        job_list.append(scheduler.Job("index:{0}".format(pg_table), "fast load index",
+                                      utils.run_sql_list_multiprocessing, [[sql, vacuum_sql], settings],
+                                      cost=sum([job.cost for job in load_jobs]), deps=deps))
+
+    # web boundary tables (their Hilbert key index, if any, is already built)
+    for display_job in display_jobs:
+        boundary_name = display_job.name.split(":")[1]
+
+        deps = [display_job.name, get_boundary_density_job_name(boundary_name)]
+        deps.extend([job.name for job in hilbert_jobs if job.name == "hilbert:{0}".format(boundary_name)])
+
+        # the data tables' Hilbert ordering reads the web table
+        deps.extend([job.name for job in hilbert_jobs if job.name.startswith("hilbert:{0}_".format(boundary_name))])
+
+        sql = set_logged_sql + \
+            "CREATE INDEX {1}_geom_idx ON {0}.{1} USING gist (geom)"
+        sql = sql.format(settings['web_schema'], boundary_name)
+
+        if not settings['hilbert_order']:
+            sql += ";ALTER TABLE {0}.{1} CLUSTER ON {1}_geom_idx".format(settings['web_schema'], boundary_name)
+
+        vacuum_sql = "VACUUM ANALYZE {0}.{1}".format(settings['web_schema'], boundary_name)
+
+        job_list.append(scheduler.Job("index:web_{0}".format(boundary_name), "fast load index",
+                                      utils.run_sql_list_multiprocessing, [[sql, vacuum_sql], settings],
+                                      cost=display_job.cost / 20.0, deps=deps))
+
+    return job_list
+
+
+# combines all the stats of each region into one profile, for each boundary with display boundaries. Each boundary's
+# job waits for its tables to be ordered & indexed
+def get_region_profile_jobs(settings, data_table_jobs, display_jobs, hilbert_jobs):
+    job_list = list()
+
+    hilbert_job_names = [job.name for job in hilbert_jobs]
+
+    for display_job in display_jobs:
+        boundary_name = display_job.name.split(":")[1]
+        table_jobs = [job for job in data_table_jobs if job.args[0]["boundary"] == boundary_name]
+
+        if len(table_jobs) == 0:
+            continue
+
+        deps = [display_job.name]
+        deps.extend([job.name for job in table_jobs])
+
+        for table_name in [boundary_name] + ["{0}_{1}".format(boundary_name, job.args[0]["table"])
+                                             for job in table_jobs]:
+            if "hilbert:{0}".format(table_name) in hilbert_job_names:
+                deps.append("hilbert:{0}".format(table_name))
+
+            if settings['fast_load']:
+                deps.append("index:{0}".format(table_name) if table_name != boundary_name
+                            else "index:web_{0}".format(boundary_name))
+
+        # each table's stats, without the region id
+        profile_list = list()
+        join_list = list()
+
+        for i, job in enumerate(table_jobs):
+            profile_list.append("COALESCE(to_jsonb(tab_{0}) - '{1}', '{{}}'::jsonb)"
+                                .format(i, settings['region_id_field']))
+            join_list.append("LEFT JOIN {0}.{1}_{2} AS tab_{3} ON tab_{3}.{4} = bdy.id"
+                             .format(settings['data_schema'], boundary_name, job.args[0]["table"], i,
+                                     settings['region_id_field']))
+
+        sql = "INSERT INTO {0}.region_profiles " \
+              "SELECT '{1}', bdy.id, jsonb_strip_nulls({2}) FROM {0}.{1} AS bdy {3}" \
+            .format(settings['web_schema'], boundary_name, " || ".join(profile_list), " ".join(join_list))
+
+        job_list.append(scheduler.Job("profile:{0}".format(boundary_name), "region profile",
+                                      utils.run_sql_multiprocessing, [sql, settings],
+                                      cost=sum([job.cost for job in table_jobs]), deps=deps))
+
+    if len(job_list) > 0:
+        sql = "ANALYZE {0}.region_profiles".format(settings['web_schema'])
+
+        job_list.append(scheduler.Job("profile:analyze", "region profile", utils.run_sql_multiprocessing,
+                                      [sql, settings], cost=1, deps=[job.name for job in job_list]))
+
+    return job_list
+
+
+# creates a point (inside the polygon) and area for each meshblock, and the boundaries each meshblock is in. The map
+# server adds up the meshblocks in a custom area to estimate its stats
+def get_meshblock_jobs(settings, boundary_load_jobs):
+    job_list = list()
+
+    # the boundary load jobs for each raw boundary table
+    table_jobs = dict()
+
+    for boundary_load_job in boundary_load_jobs:
+        table_jobs.setdefault(boundary_load_job.args[0]['pg_table'], list()).append(boundary_load_job)
+
+    boundary_dicts = {boundary_dict["boundary"]: boundary_dict for boundary_dict in settings['bdy_table_dicts']}
+    mb_table = "mb_{0}_aust".format(settings["census_year"])
+
+    if "mb" not in boundary_dicts or mb_table not in table_jobs:
+        logger.warning("\t- No meshblock boundaries to load - custom area summaries won't be available")
+        return job_list
+
+    sql = "DROP TABLE IF EXISTS {0}.meshblocks CASCADE;" \
+          "CREATE TABLE {0}.meshblocks (id text NOT NULL PRIMARY KEY, area double precision NOT NULL, " \
+          "geom geometry(Point, 4283) NULL) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.meshblocks OWNER TO {1};" \
+          "INSERT INTO {0}.meshblocks " \
+          "SELECT {2}::text, SUM({3}), ST_PointOnSurface(ST_Collect(geom)) FROM {4}.{5} " \
+          "WHERE geom IS NOT NULL GROUP BY {2};" \
+          "CREATE INDEX meshblocks_geom_idx ON {0}.meshblocks USING gist (geom);" \
+          "ANALYZE {0}.meshblocks" \
+        .format(settings['web_schema'], settings['pg_user'], boundary_dicts["mb"]["id_field"],
+                boundary_dicts["mb"]["area_field"], settings['boundary_schema'], mb_table)
+
+    points_job = scheduler.Job("meshblocks:points", "meshblocks", utils.run_sql_multiprocessing, [sql, settings],
+                               cost=sum([job.cost for job in table_jobs[mb_table]]) / 10.0,
+                               deps=get_raw_boundary_deps(mb_table, table_jobs, settings))
+    job_list.append(points_job)
+
+    # the boundary each meshblock's point is in, for each boundary type
+    for boundary_name, boundary_dict in boundary_dicts.items():
+        pg_table = "{0}_{1}_aust".format(boundary_name, settings["census_year"])
+
+        if boundary_name == "mb" or pg_table not in table_jobs:
+            continue
+
+        sql = "INSERT INTO {0}.mb_boundaries " \
+              "SELECT DISTINCT ON (mb.id) mb.id, '{1}', bdy.{2}::text FROM {0}.meshblocks AS mb " \
+              "INNER JOIN {3}.{4} AS bdy ON ST_Intersects(bdy.geom, mb.geom) " \
+              "ORDER BY mb.id, bdy.{2}" \
+            .format(settings['web_schema'], boundary_name, boundary_dict["id_field"], settings['boundary_schema'],
+                    pg_table)
+
+        deps = [points_job.name] + get_raw_boundary_deps(pg_table, table_jobs, settings)
+
+        job_list.append(scheduler.Job("meshblocks:{0}".format(boundary_name), "meshblocks",
+                                      utils.run_sql_multiprocessing, [sql, settings],
+                                      cost=points_job.cost, deps=deps))
+
+    sql = "ALTER TABLE {0}.mb_boundaries ADD CONSTRAINT mb_boundaries_pkey PRIMARY KEY (boundary, mb_id);" \
+          "CREATE INDEX mb_boundaries_id_idx ON {0}.mb_boundaries USING btree (boundary, id);" \
+          "ANALYZE {0}.mb_boundaries".format(settings['web_schema'])
+
+    job_list.append(scheduler.Job("meshblocks:index", "meshblocks", utils.run_sql_multiprocessing, [sql, settings],
+                                  cost=points_job.cost, deps=[job.name for job in job_list]))
+
+    return job_list
+
+
+# creates the concordances between each pair of boundary types by adding up the meshblocks they share, with each
+# meshblock weighted by its area & population. Meshblock populations are estimated from their SA1's population
+def get_concordance_jobs(settings, data_table_jobs, meshblock_jobs, hilbert_jobs):
+    job_list = list()
+
+    boundary_names = [job.name.split(":")[1] for job in meshblock_jobs
+                      if job.name not in ("meshblocks:points", "meshblocks:index")]
+
+    pop_stat, pop_table = get_population_stat("sa1", settings)
+    pop_job_name = get_data_table_job_name("sa1", pop_table)
+
+    if "sa1" not in boundary_names or pop_job_name not in [job.name for job in data_table_jobs]:
+        logger.warning("\t- No meshblock & SA1 populations to load - boundary concordances won't be available")
+        return job_list
+
+    # each meshblock's share of its SA1's area & population
+    sql = "DROP TABLE IF EXISTS {0}.mb_weights CASCADE;" \
+          "CREATE TABLE {0}.mb_weights (mb_id text NOT NULL PRIMARY KEY, area double precision NOT NULL, " \
+          "population double precision NOT NULL) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.mb_weights OWNER TO {1};" \
+          "INSERT INTO {0}.mb_weights " \
+          "SELECT mb.id, mb.area, " \
+          "COALESCE(tab.{2} * mb.area / NULLIF(SUM(mb.area) OVER (PARTITION BY cor.id), 0), 0) " \
+          "FROM {0}.meshblocks AS mb " \
+          "LEFT JOIN {0}.mb_boundaries AS cor ON cor.mb_id = mb.id AND cor.boundary = 'sa1' " \
+          "LEFT JOIN {3}.sa1_{4} AS tab ON tab.{5} = cor.id;" \
+          "ANALYZE {0}.mb_weights" \
+        .format(settings['web_schema'], settings['pg_user'], pop_stat, settings['data_schema'], pop_table,
+                settings['region_id_field'])
+
+    # the population table is rewritten by its Hilbert ordering, and indexed in a fast load
+    pop_table_name = "sa1_{0}".format(pop_table)
+
+    deps = ["meshblocks:index", pop_job_name]
+    deps.extend([job.name for job in hilbert_jobs if job.name == "hilbert:{0}".format(pop_table_name)])
+
+    if settings['fast_load']:
+        deps.append("index:{0}".format(pop_table_name))
+
+    weights_job = scheduler.Job("concordance:weights", "concordance", utils.run_sql_multiprocessing, [sql, settings],
+                                cost=sum([job.cost for job in meshblock_jobs]) / len(meshblock_jobs), deps=deps)
+    job_list.append(weights_job)
+
+    # both directions of each pair of boundary types, in parallel
+    for from_index, from_boundary in enumerate(boundary_names):
+        for to_boundary in boundary_names[from_index + 1:]:
+            sql = "WITH pairs AS (" \
+                  "SELECT from_cor.id AS from_id, to_cor.id AS to_id, SUM(wgt.area) AS area, " \
+                  "SUM(wgt.population) AS population FROM {0}.mb_weights AS wgt " \
+                  "INNER JOIN {0}.mb_boundaries AS from_cor ON from_cor.mb_id = wgt.mb_id " \
+                  "AND from_cor.boundary = '{1}' " \
+                  "INNER JOIN {0}.mb_boundaries AS to_cor ON to_cor.mb_id = wgt.mb_id AND to_cor.boundary = '{2}' " \
+                  "GROUP BY from_cor.id, to_cor.id" \
+                  "), shares AS (" \
+                  "SELECT from_id, to_id, area, population, " \
+                  "area / NULLIF(SUM(area) OVER (PARTITION BY from_id), 0) AS from_area_share, " \
+                  "population / NULLIF(SUM(population) OVER (PARTITION BY from_id), 0) AS from_population_share, " \
+                  "area / NULLIF(SUM(area) OVER (PARTITION BY to_id), 0) AS to_area_share, " \
+                  "population / NULLIF(SUM(population) OVER (PARTITION BY to_id), 0) AS to_population_share " \
+                  "FROM pairs" \
+                  ") INSERT INTO {0}.boundary_concordance " \
+                  "SELECT '{1}', from_id, '{2}', to_id, area, population, from_area_share, from_population_share, " \
+                  "to_area_share, to_population_share FROM shares " \
+                  "UNION ALL " \
+                  "SELECT '{2}', to_id, '{1}', from_id, area, population, to_area_share, to_population_share, " \
+                  "from_area_share, from_population_share FROM shares" \
+                .format(settings['web_schema'], from_boundary, to_boundary)
+
+            job_list.append(scheduler.Job("concordance:{0}-{1}".format(from_boundary, to_boundary), "concordance",
+                                          utils.run_sql_multiprocessing, [sql, settings], cost=weights_job.cost,
+                                          deps=[weights_job.name]))
+
+    sql = "CREATE INDEX boundary_concordance_from_idx ON {0}.boundary_concordance " \
+          "USING btree (from_boundary, from_id, to_boundary);" \
+          "ANALYZE {0}.boundary_concordance".format(settings['web_schema'])
+
+    job_list.append(scheduler.Job("concordance:index", "concordance", utils.run_sql_multiprocessing, [sql, settings],
+                                  cost=weights_job.cost, deps=[job.name for job in job_list]))
+
+    return job_list
+
+
+# creates the previous census' stats for this census' boundaries, so the map server can map the changes with simple
+# joins. The previous meshblocks (with their estimated populations) are matched to this census' meshblocks by their
+# points, then each boundary's previous regions are apportioned to its current regions by population
+def get_change_jobs(pg_cur, settings, data_table_jobs, boundary_load_jobs, meshblock_jobs):
+    job_list = list()
+
+    previous_web_schema = settings['previous_web_schema']
+    previous_data_schema = settings['previous_data_schema']
+
+    pg_cur.execute("SELECT table_schema, table_name FROM information_schema.tables WHERE table_schema IN (%s, %s)",
+                   (previous_web_schema, previous_data_schema))
+    previous_tables = {(row[0], row[1]) for row in pg_cur.fetchall()}
+
+    mb_table = "mb_{0}_aust".format(settings["census_year"])
+    table_jobs = dict()
+
+    for boundary_load_job in boundary_load_jobs:
+        table_jobs.setdefault(boundary_load_job.args[0]['pg_table'], list()).append(boundary_load_job)
+
+    if (previous_web_schema, "mb_weights") not in previous_tables or "meshblocks:index" not in \
+            [job.name for job in meshblock_jobs]:
+        logger.warning("\t- No meshblock tables in {0} or this load - changes since {1} won't be available"
+                       .format(previous_web_schema, settings['previous_census_year']))
+        return job_list
+
+    # the stats in both censuses, matched by their long ids
+    pg_cur.execute("SELECT lower(sequential_id), lower(long_id), lower(table_number) FROM {0}.metadata_stats"
+                   .format(previous_data_schema))
+    previous_stats = {row[1]: (row[0], row[2]) for row in pg_cur.fetchall() if row[1] is not None}
+
+    pg_cur.execute("SELECT lower(sequential_id), lower(long_id), lower(table_number) FROM {0}.metadata_stats "
+                   "ORDER BY sequential_id".format(settings['data_schema']))
+    table_stats = dict()
+
+    for stat_id, long_id, table in pg_cur.fetchall():
+        if long_id in previous_stats:
+            table_stats.setdefault(table, list()).append((stat_id, long_id) + previous_stats[long_id])
+
+    # each previous meshblock's current meshblock
+    boundary_dict = [bdy_dict for bdy_dict in settings['bdy_table_dicts'] if bdy_dict["boundary"] == "mb"][0]
+
+    sql = "DROP TABLE IF EXISTS {0}.previous_meshblocks CASCADE;" \
+          "CREATE TABLE {0}.previous_meshblocks (previous_mb_id text NOT NULL PRIMARY KEY, mb_id text NULL, " \
+          "area double precision NOT NULL, population double precision NOT NULL) WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.previous_meshblocks OWNER TO {1};" \
+          "INSERT INTO {0}.previous_meshblocks " \
+          "SELECT wgt.mb_id, cur.mb_id, wgt.area, wgt.population FROM {2}.mb_weights AS wgt " \
+          "INNER JOIN {2}.meshblocks AS pmb ON pmb.id = wgt.mb_id " \
+          "LEFT JOIN LATERAL (SELECT {3}::text AS mb_id FROM {4}.{5} WHERE ST_Intersects(geom, pmb.geom) " \
+          "LIMIT 1) AS cur ON TRUE;" \
+          "CREATE INDEX previous_meshblocks_mb_id_idx ON {0}.previous_meshblocks USING btree (mb_id);" \
+          "ANALYZE {0}.previous_meshblocks;" \
+          "DROP TABLE IF EXISTS {0}.previous_concordance CASCADE;" \
+          "CREATE TABLE {0}.previous_concordance (boundary text NOT NULL, id text NOT NULL, " \
+          "previous_id text NOT NULL, population double precision NOT NULL, share double precision NULL) " \
+          "WITH (OIDS=FALSE);" \
+          "ALTER TABLE {0}.previous_concordance OWNER TO {1}" \
+        .format(settings['web_schema'], settings['pg_user'], previous_web_schema, boundary_dict["id_field"],
+                settings['boundary_schema'], mb_table)
+
+    meshblocks_job = scheduler.Job("change:meshblocks", "change", utils.run_sql_multiprocessing, [sql, settings],
+                                   cost=sum([job.cost for job in table_jobs[mb_table]]) / 10.0,
+                                   deps=get_raw_boundary_deps(mb_table, table_jobs, settings))
+    job_list.append(meshblocks_job)
+
+    # the share of each previous region's population in each current region, for the boundaries in both censuses
+    boundary_names = [job.name.split(":")[1] for job in meshblock_jobs
+                      if job.name not in ("meshblocks:points", "meshblocks:index")]
+
+    pg_cur.execute("SELECT DISTINCT boundary FROM {0}.mb_boundaries".format(previous_web_schema))
+    previous_boundary_names = [row[0] for row in pg_cur.fetchall()]
+
+    boundary_names = [boundary_name for boundary_name in boundary_names if boundary_name in previous_boundary_names]
+
+    for boundary_name in boundary_names:
+        sql = "WITH pairs AS (" \
+              "SELECT cur.id, prev.id AS previous_id, SUM(pmb.population) AS population, SUM(pmb.area) AS area " \
+              "FROM {0}.previous_meshblocks AS pmb " \
+              "INNER JOIN {1}.mb_boundaries AS prev ON prev.mb_id = pmb.previous_mb_id AND prev.boundary = '{2}' " \
+              "INNER JOIN {0}.mb_boundaries AS cur ON cur.mb_id = pmb.mb_id AND cur.boundary = '{2}' " \
+              "GROUP BY cur.id, prev.id" \
+              ") INSERT INTO {0}.previous_concordance " \
+              "SELECT '{2}', id, previous_id, population, COALESCE(" \
+              "population / NULLIF(SUM(population) OVER (PARTITION BY previous_id), 0), " \
+              "area / NULLIF(SUM(area) OVER (PARTITION BY previous_id), 0)) FROM pairs" \
+            .format(settings['web_schema'], previous_web_schema, boundary_name)
+
+        job_list.append(scheduler.Job("change:{0}".format(boundary_name), "change", utils.run_sql_multiprocessing,
+                                      [sql, settings], cost=meshblocks_job.cost,
+                                      deps=[meshblocks_job.name, "meshblocks:{0}".format(boundary_name)]))
+
+    sql = "CREATE INDEX previous_concordance_id_idx ON {0}.previous_concordance USING btree (boundary, id);" \
+          "ANALYZE {0}.previous_concordance".format(settings['web_schema'])
+
+    index_job = scheduler.Job("change:index", "change", utils.run_sql_multiprocessing, [sql, settings],
+                              cost=meshblocks_job.cost, deps=[job.name for job in job_list])
+    job_list.append(index_job)
+
+    # the previous stats of each current region, in a {boundary}_{table}_previous table for each current data table
+    for data_table_job in data_table_jobs:
+        boundary_name = data_table_job.args[0]["boundary"]
+        table = data_table_job.args[0]["table"]
+        stats = [stat for stat in table_stats.get(table, list())
+                 if (previous_data_schema, "{0}_{1}".format(boundary_name, stat[3])) in previous_tables]
+
+        if boundary_name not in boundary_names or len(stats) == 0:
+            continue
+
+        column_list = ["{0} text NOT NULL PRIMARY KEY".format(settings['region_id_field'])]
+        select_list = ["con.id"]
+        join_list = list()
+        table_aliases = dict()
+
+        for stat_id, long_id, previous_stat_id, previous_table in stats:
+            if previous_table not in table_aliases:
+                table_aliases[previous_table] = "prev_{0}".format(len(table_aliases))
+                join_list.append("LEFT JOIN {0}.{1}_{2} AS {3} ON {3}.{4} = con.previous_id"
+                                 .format(previous_data_schema, boundary_name, previous_table,
+                                         table_aliases[previous_table], settings['previous_region_id_field']))
+
+            previous_field = "{0}.{1}".format(table_aliases[previous_table], previous_stat_id)
+            column_list.append("{0} double precision NULL".format(stat_id))
+
+            # medians & averages are weighted by population, counts are apportioned
+            if "median" in long_id or "average" in long_id:
+                select_list.append("SUM({0} * con.population) / "
+                                   "NULLIF(SUM(CASE WHEN {0} IS NOT NULL THEN con.population END), 0)"
+                                   .format(previous_field))
+            else:
+                select_list.append("SUM({0} * con.share)".format(previous_field))
+
+        pg_table = "{0}_{1}_previous".format(boundary_name, table)
+
+        sql = "DROP TABLE IF EXISTS {0}.{1} CASCADE;" \
+              "CREATE TABLE {0}.{1} ({2}) WITH (OIDS=FALSE);" \
+              "ALTER TABLE {0}.{1} OWNER TO {3};" \
+              "INSERT INTO {0}.{1} SELECT {4} FROM {5}.previous_concordance AS con {6} " \
+              "WHERE con.boundary = '{7}' GROUP BY con.id;" \
+              "ANALYZE {0}.{1}" \
+            .format(settings['data_schema'], pg_table, ", ".join(column_list), settings['pg_user'],
+                    ", ".join(select_list), settings['web_schema'], " ".join(join_list), boundary_name)
+
+        job_list.append(scheduler.Job("change:{0}".format(pg_table), "change", utils.run_sql_multiprocessing,
+                                      [sql, settings], cost=data_table_job.cost, deps=[index_job.name]))
+
+    return job_list
 
-            sql = " ".join(insert_into_list)
-            insert_sql_list.append(sql)
 
-            vacuum_sql_list.append("VACUUM ANALYZE {0}.{1}".format(settings['web_schema'], pg_table))
+# the jobs that load a raw boundary table - and index it in a fast load (the spatial joins need the index)
+def get_raw_boundary_deps(pg_table, table_jobs, settings):
+    deps = [job.name for job in table_jobs[pg_table]]
 
-    utils.multiprocess_list("sql", create_sql_list, settings, logger)
-    utils.multiprocess_list("sql", insert_sql_list, settings, logger)
-    utils.multiprocess_list("sql", vacuum_sql_list, settings, logger)
+    if settings['fast_load']:
+        deps.append("index:{0}".format(pg_table))
 
-    logger.info("\t- Step 2 of 2 : web optimised boundaries created : {0}".format(datetime.now() - start_time))
+    return deps
 
 
 if __name__ == '__main__':
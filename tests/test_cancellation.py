@@ -0,0 +1,236 @@
+# tests cancelling running map queries from other threads - the socket watcher and other requests' threads cancel
+# queries they don't own, without the owning request's Flask context
+
+import functools
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import web.cancellation as cancellation  # noqa: E402
+import web.singleflight as singleflight  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cancels = 0
+
+    def cancel(self):
+        self.cancels += 1
+
+
+def cancel_in_thread(query, reason):
+    thread = threading.Thread(target=query.cancel, args=(reason,))
+    thread.start()
+    thread.join()
+
+
+class CancellationTest(unittest.TestCase):
+    def test_cancel_from_thread(self):
+        flights = singleflight.SingleFlight()
+        connection = FakeConnection()
+
+        with cancellation.cancellable_query(connection, "client", 1, None,
+                                            functools.partial(flights.check_shared, "/get-data?s=g3", None)) as query:
+            cancel_in_thread(query, "Client disconnected")
+
+        self.assertEqual(connection.cancels, 1)
+        self.assertEqual(query.cancelled_reason, "Client disconnected")
+
+    def test_shared_query_not_cancelled_from_thread(self):
+        flights = singleflight.SingleFlight()
+        connection = FakeConnection()
+        key = "/get-data?s=g3"
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def run_query():
+            with cancellation.cancellable_query(connection, "client", 1, None,
+                                                functools.partial(flights.check_shared, key,
+                                                                  flights.get_call(key))) as query:
+                started.set()
+                release.wait(5)
+
+                return query.cancelled_reason
+
+        leader = threading.Thread(target=flights.do, args=(key, run_query))
+        leader.start()
+        started.wait(5)
+
+        # another request for the same key waits on the running one
+        waiter = threading.Thread(target=flights.do, args=(key, lambda: None))
+        waiter.start()
+
+        while not flights.has_waiters(key):
+            time.sleep(0.01)
+
+        query = cancellation.running_queries["client"][0]
+        cancel_in_thread(query, "Request superseded by a newer request")
+
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(connection.cancels, 0)
+        self.assertIsNone(query.cancelled_reason)
+
+    def test_cancelled_query_not_joined(self):
+        flights = singleflight.SingleFlight()
+        connection = FakeConnection()
+        key = "/get-data?s=g3"
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def run_query():
+            with cancellation.cancellable_query(connection, "client", 1, None,
+                                                functools.partial(flights.check_shared, key,
+                                                                  flights.get_call(key))) as query:
+                started.set()
+                release.wait(5)
+
+                return query.cancelled_reason
+
+        leader_results = list()
+        leader = threading.Thread(target=lambda: leader_results.append(flights.do(key, run_query)))
+        leader.start()
+        started.wait(5)
+
+        cancel_in_thread(cancellation.running_queries["client"][0], "Client disconnected")
+
+        # a request arriving after the cancel gets its own call, not the cancelled one's result
+        self.assertEqual(flights.do(key, lambda: "fresh"), "fresh")
+
+        release.set()
+        leader.join()
+
+        self.assertEqual(connection.cancels, 1)
+        self.assertEqual(leader_results, ["Client disconnected"])
+        self.assertEqual(flights.get_stats()["in_flight"], 0)
+
+    def test_superseded_query_shared_with_other_client(self):
+        flights = singleflight.SingleFlight()
+        key = "/get-data?s=g3"
+
+        joined = threading.Event()
+
+        # client a has moved on to a newer map view
+        with cancellation.cancellable_query(FakeConnection(), "client_a", 2):
+            def run_query():
+                joined.wait(5)
+
+                with cancellation.cancellable_query(FakeConnection(), "client_a", 1, None,
+                                                    functools.partial(flights.check_shared, key,
+                                                                      flights.get_call(key))) as query:
+                    return query.cancelled_reason
+
+            leader_results = list()
+            leader = threading.Thread(target=lambda: leader_results.append(flights.do(key, run_query)))
+            leader.start()
+
+            while flights.get_call(key) is None:
+                time.sleep(0.01)
+
+            # client b asks for the same map view - the out of date request from client a still runs for it
+            waiter_results = list()
+            waiter = threading.Thread(target=lambda: waiter_results.append(flights.do(key, lambda: "client b")))
+            waiter.start()
+
+            while not flights.has_waiters(key):
+                time.sleep(0.01)
+
+            joined.set()
+            leader.join()
+            waiter.join()
+
+        self.assertEqual(leader_results, [None])
+        self.assertEqual(waiter_results, [None])
+
+    def test_cancelled_result_not_shared_with_other_client(self):
+        flights = singleflight.SingleFlight()
+        key = "/get-data?s=g3"
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def run_cancelled():
+            started.set()
+            release.wait(5)
+
+            return "", 409
+
+        leader_results = list()
+        leader = threading.Thread(target=lambda: leader_results.append(
+            flights.do(key, run_cancelled, lambda result: result[1] != 409)))
+        leader.start()
+        started.wait(5)
+
+        # client b waits on client a's request, which is then cancelled - so client b runs its own
+        waiter_results = list()
+        waiter = threading.Thread(target=lambda: waiter_results.append(
+            flights.do(key, lambda: ("client b", 200), lambda result: result[1] != 409)))
+        waiter.start()
+
+        while not flights.has_waiters(key):
+            time.sleep(0.01)
+
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(leader_results, [("", 409)])
+        self.assertEqual(waiter_results, [("client b", 200)])
+
+    def test_client_disconnect(self):
+        connection = FakeConnection()
+        server_socket, client_socket = socket.socketpair()
+
+        with cancellation.cancellable_query(connection, None, None, server_socket) as query:
+            client_socket.close()
+
+            for i in range(50):
+                if query.cancelled_reason is not None:
+                    break
+
+                time.sleep(cancellation.poll_interval / 2.0)
+
+        server_socket.close()
+
+        self.assertEqual(connection.cancels, 1)
+        self.assertEqual(query.cancelled_reason, "Client disconnected")
+
+    def test_newer_generation_cancels_older(self):
+        old_connection = FakeConnection()
+        same_connection = FakeConnection()
+
+        with cancellation.cancellable_query(old_connection, "client", 1) as old_query:
+            with cancellation.cancellable_query(same_connection, "client", 1) as same_query:
+                with cancellation.cancellable_query(FakeConnection(), "client", 2) as new_query:
+                    self.assertIsNone(new_query.cancelled_reason)
+
+        self.assertEqual(old_connection.cancels, 1)
+        self.assertEqual(same_connection.cancels, 1)
+        self.assertIsNotNone(old_query.cancelled_reason)
+        self.assertIsNotNone(same_query.cancelled_reason)
+        self.assertEqual(cancellation.running_queries, dict())
+
+    def test_same_generation_not_cancelled(self):
+        first_connection = FakeConnection()
+        second_connection = FakeConnection()
+
+        with cancellation.cancellable_query(first_connection, "client", 3) as first_query:
+            with cancellation.cancellable_query(second_connection, "client", 3) as second_query:
+                pass
+
+        self.assertEqual(first_connection.cancels + second_connection.cancels, 0)
+        self.assertIsNone(first_query.cancelled_reason)
+        self.assertIsNone(second_query.cancelled_reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
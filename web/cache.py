@@ -0,0 +1,65 @@
+
+# a thread safe, least recently used cache of map server responses, limited by their total size
+#
+# the census data never changes after a load, so a response only leaves the cache to make room for newer ones
+
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+
+            return item[0]
+
+    def put(self, key, value, size):
+        """
+        Add a value of size bytes, removing the least recently used values to make room for it.
+        Values bigger than the whole cache aren't added.
+        """
+        if size > self.max_bytes:
+            return False
+
+        with self.lock:
+            old_item = self.items.pop(key, None)
+
+            if old_item is not None:
+                self.bytes -= old_item[1]
+
+            while self.bytes + size > self.max_bytes:
+                old_key, old_item = self.items.popitem(last=False)
+                self.bytes -= old_item[1]
+                self.evictions += 1
+
+            self.items[key] = (value, size)
+            self.bytes += size
+
+        return True
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def get_stats(self):
+        with self.lock:
+            return {"items": len(self.items), "bytes": self.bytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,121 @@
+
+# cancels running map queries when the client has gone away or has sent a newer request
+#
+# the map fires a new request on every pan & zoom - without this the earlier ones run to completion on the server,
+# holding connections from the pool while the client has already moved on
+
+import select
+import socket
+import threading
+
+from contextlib import contextmanager
+
+# how often (in seconds) to check if the client has disconnected
+poll_interval = 0.2
+
+# the running queries of the latest request generation for each client
+running_queries = dict()
+running_queries_lock = threading.RLock()
+
+
+class RunningQuery:
+    def __init__(self, connection, client_id, generation, is_shared):
+        self.connection = connection
+        self.client_id = client_id
+        self.generation = generation
+        self.is_shared = is_shared
+        self.cancelled_reason = None
+        self.finished = False
+
+    def cancel(self, reason):
+        # once finished the connection goes back to the pool - it mustn't be cancelled after that
+        with running_queries_lock:
+            if self.cancelled_reason is not None or self.finished:
+                return
+
+            # other requests are waiting on this query's result - let it finish. If not, is_shared() stops any more
+            # from waiting on it
+            if self.is_shared is not None and self.is_shared():
+                return
+
+            self.cancelled_reason = reason
+
+            # psycopg2's cancel is thread safe - it asks Postgres to cancel whatever the connection is running
+            self.connection.cancel()
+
+
+@contextmanager
+def cancellable_query(connection, client_id=None, generation=None, client_socket=None, is_shared=None):
+    """
+    Cancels the connection's running statement if a newer request (a higher generation) arrives from the same
+    client, or if the client's socket is closed. Unless is_shared() says other requests are waiting on the result -
+    if none are, it must also stop any more from waiting on it.
+    Requests with the same generation (e.g. the map data & refined geometry for the same map view) don't cancel each
+    other.
+    """
+    query = RunningQuery(connection, client_id, generation, is_shared)
+
+    # cancel the client's previous request, or this one if it's already out of date
+    if client_id is not None and generation is not None:
+        with running_queries_lock:
+            previous_queries = running_queries.get(client_id, list())
+
+            if any(previous_query.generation > generation for previous_query in previous_queries):
+                # still run it if other requests (e.g. from other clients) are already waiting on its result
+                if is_shared is None or not is_shared():
+                    query.cancelled_reason = "Request superseded by a newer request"
+            else:
+                for previous_query in previous_queries:
+                    if previous_query.generation < generation:
+                        previous_query.cancel("Request superseded by a newer request")
+
+                running_queries[client_id] = [previous_query for previous_query in previous_queries
+                                              if previous_query.generation == generation] + [query]
+
+    finished = threading.Event()
+
+    if client_socket is not None:
+        watcher = threading.Thread(target=watch_client_socket, args=(client_socket, query, finished))
+        watcher.daemon = True
+        watcher.start()
+
+    try:
+        yield query
+    finally:
+        finished.set()
+
+        with running_queries_lock:
+            query.finished = True
+
+            client_queries = running_queries.get(client_id, list())
+
+            if query in client_queries:
+                client_queries.remove(query)
+
+                if len(client_queries) == 0:
+                    del running_queries[client_id]
+
+
+def watch_client_socket(client_socket, query, finished):
+    while not finished.wait(poll_interval):
+        if client_disconnected(client_socket):
+            query.cancel("Client disconnected")
+            return
+
+
+def client_disconnected(client_socket):
+    try:
+        readable, writable, errored = select.select([client_socket], [], [], 0)
+
+        # a readable socket with nothing to read has been closed by the client
+        if readable:
+            return len(client_socket.recv(1, socket.MSG_PEEK)) == 0
+    except (OSError, ValueError):
+        return True
+
+    return False
+
+
+def get_client_socket(environ):
+    # the dev server and gunicorn both expose the client's socket to the app
+    return environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
@@ -0,0 +1,152 @@
+
+# an in-memory copy of the census metadata tables, loaded once when the map server starts
+#
+# the metadata never changes after a load, so there's no need to query it for every request. It's used to describe
+# the stats, to search for them and to validate the stat & table ids the map asks for
+
+import bisect
+import re
+
+# fields returned to the map for each stat
+stat_output_fields = ["id", "table", "description", "type", "maptype"]
+
+
+class MetadataCatalogue:
+    def __init__(self):
+        self.tables = dict()
+        self.stats = dict()
+
+        # sorted list of the words in the stat descriptions and a lookup of the stats they're in (for searching)
+        self.words = list()
+        self.word_stats = dict()
+
+    def load(self, pg_cur, settings):
+        pg_cur.execute("SELECT lower(table_number) AS table_number, table_name, table_description "
+                       "FROM {0}.metadata_tables".format(settings["data_schema"]))
+
+        for row in pg_cur.fetchall():
+            table_dict = dict()
+            table_dict["table"] = row["table_number"]
+            table_dict["name"] = row["table_name"]
+            table_dict["description"] = row["table_description"]
+            table_dict["stats"] = list()
+
+            self.tables[row["table_number"]] = table_dict
+
+        pg_cur.execute("SELECT sequential_id, long_id, lower(table_number) AS table_number, "
+                       "column_heading_description "
+                       "FROM {0}.metadata_stats "
+                       "ORDER BY sequential_id".format(settings["data_schema"]))
+
+        for row in pg_cur.fetchall():
+            stat_id = row["sequential_id"].lower()
+            long_id = row["long_id"] or ""
+
+            stat_dict = dict()
+            stat_dict["id"] = stat_id
+            stat_dict["table"] = row["table_number"]
+            stat_dict["description"] = long_id.replace("_", " ")
+            stat_dict["type"] = row["column_heading_description"]
+            stat_dict["long_id"] = long_id
+
+            # map raw values for totals, medians & averages, otherwise map them as a percentage of the population
+            if stat_id == "b3" or "median" in long_id.lower() or "average" in long_id.lower():
+                stat_dict["maptype"] = "values"
+            else:
+                stat_dict["maptype"] = "percent"
+
+            # the order the metadata table sorts them in
+            stat_dict["order"] = len(self.stats)
+
+            self.stats[stat_id] = stat_dict
+
+            # stats can be in table number variants (e.g. g01 has g01a & g01b parts in some censuses)
+            for table_number, table_dict in self.tables.items():
+                if stat_dict["table"] is not None and stat_dict["table"].startswith(table_number):
+                    table_dict["stats"].append(stat_id)
+
+            # index the words in the stat's id, table and description
+            search_text = " ".join([stat_id, stat_dict["table"] or "", stat_dict["description"],
+                                    stat_dict["type"] or ""])
+
+            for word in get_words(search_text):
+                self.word_stats.setdefault(word, set()).add(stat_id)
+
+        self.words = sorted(self.word_stats.keys())
+
+    def get_stat(self, stat_id):
+        return self.stats.get(stat_id.lower())
+
+    def get_stat_output(self, stat_id):
+        stat_dict = self.get_stat(stat_id)
+
+        if stat_dict is None:
+            return None
+
+        return {field: stat_dict[field] for field in stat_output_fields}
+
+    def get_stats_output(self, stat_ids):
+        stat_list = [self.stats[stat_id.lower()] for stat_id in set(stat_ids) if stat_id.lower() in self.stats]
+
+        return [self.get_stat_output(stat_dict["id"]) for stat_dict in sorted(stat_list, key=lambda s: s["order"])]
+
+    def is_valid_stat(self, stat_id, table_id):
+        # a missing stat or table parameter is invalid too
+        if stat_id is None or table_id is None:
+            return False
+
+        stat_dict = self.get_stat(stat_id)
+
+        return stat_dict is not None and stat_dict["table"] == table_id.lower()
+
+    def search(self, query, limit=20):
+        """
+        Find the stats that have a word starting with each word in the query (i.e. search as you type).
+        Exact stat id matches come first, then the stats in metadata order.
+        """
+        query_words = get_words(query)
+
+        if len(query_words) == 0:
+            return list()
+
+        matched_ids = None
+
+        for query_word in query_words:
+            word_ids = set()
+
+            # the words starting with the query word are next to each other in the sorted list
+            i = bisect.bisect_left(self.words, query_word)
+
+            while i < len(self.words) and self.words[i].startswith(query_word):
+                word_ids.update(self.word_stats[self.words[i]])
+                i += 1
+
+            if matched_ids is None:
+                matched_ids = word_ids
+            else:
+                matched_ids &= word_ids
+
+            if len(matched_ids) == 0:
+                return list()
+
+        query_id = query.strip().lower()
+        stat_list = sorted([self.stats[stat_id] for stat_id in matched_ids],
+                           key=lambda s: (s["id"] != query_id, s["order"]))
+
+        output_list = list()
+
+        for stat_dict in stat_list[:limit]:
+            output_dict = self.get_stat_output(stat_dict["id"])
+
+            table_dict = self.tables.get(stat_dict["table"])
+
+            if table_dict is not None:
+                output_dict["table_name"] = table_dict["name"]
+
+            output_list.append(output_dict)
+
+        return output_list
+
+
+def get_words(text):
+    return [word for word in re.split("[^a-z0-9]+", text.lower()) if word != ""]
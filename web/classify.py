@@ -0,0 +1,190 @@
+
+# creates the map classes (i.e. colour breaks) for a stat from an array of its values, using NumPy
+#
+# the values for a boundary & stat are fetched from Postgres once and classified in memory. This replaces running
+# PostGIS ST_ClusterKMeans (a 2D algorithm) over points made from the 1D values, which needs PostGIS 2.3+ and is slow
+# for the big boundaries like SA1s
+
+import math
+import numpy
+
+# Fisher-Jenks is O(classes x values^2) - larger arrays are reduced to this many evenly spaced order statistics
+max_jenks_values = 3000
+
+
+# get the values of a stat for a boundary, excluding those with small populations that distort the map classes
+def get_values(data_table, boundary_table, stat_field, min_val, map_type, pg_cur, settings):
+    sql = "SELECT array_agg({0}) AS vals FROM {1} AS tab " \
+          "INNER JOIN {2} AS bdy ON tab.{3} = bdy.id " \
+          "WHERE bdy.population > {4}" \
+        .format(stat_field, data_table, boundary_table, settings['region_id_field'], float(min_val))
+
+    pg_cur.execute(sql)
+    row = pg_cur.fetchone()
+
+    return filter_values(row["vals"], map_type)
+
+
+# get a sample of the values of a stat for a boundary. Every nth boundary in Hilbert curve order (i.e. a spatially
+# stratified, systematic sample), falling back to id order if the tables haven't been ordered by the curve
+def get_sample_values(data_table, boundary_table, stat_field, min_val, map_type, sample_size, pg_cur, settings):
+    sql = "SELECT count(*) AS num_rows FROM {0} WHERE population > {1}".format(boundary_table, float(min_val))
+    pg_cur.execute(sql)
+    step = max(pg_cur.fetchone()["num_rows"] // sample_size, 1)
+
+    sql = "SELECT array_agg({0}) AS vals FROM {1} AS tab " \
+          "INNER JOIN (" \
+          "SELECT id, population, row_number() OVER (ORDER BY hilbert_key, id) AS row_num " \
+          "FROM {2} WHERE population > {3}" \
+          ") AS bdy ON tab.{4} = bdy.id " \
+          "WHERE bdy.row_num % {5} = 0" \
+        .format(stat_field, data_table, boundary_table, float(min_val), settings['region_id_field'], step)
+
+    pg_cur.execute(sql)
+    row = pg_cur.fetchone()
+
+    return filter_values(row["vals"], map_type)
+
+
+# the sample size needed for the ranks of all sampled values to be within rank_error (a fraction of all values) of
+# their true ranks, with the given confidence (Dvoretzky-Kiefer-Wolfowitz inequality). Quantile breaks have the same
+# bound. The other methods work on the shape of the distribution, which the sample keeps within that bound, but a
+# break can still move between clusters (see benchmarks/classification.py)
+def get_sample_size(rank_error, confidence=0.95):
+    return int(math.ceil(math.log(2.0 / (1.0 - confidence)) / (2.0 * rank_error * rank_error)))
+
+
+# how far approximate class breaks are from the exact ones, in value and in rank (as a fraction of all values)
+def get_break_errors(values, exact_bins, approx_bins):
+    errors = dict()
+
+    if len(values) == 0 or len(exact_bins) != len(approx_bins):
+        errors["max_value_error"] = None
+        errors["max_rank_error"] = None
+        return errors
+
+    exact = numpy.array(exact_bins)
+    approx = numpy.array(approx_bins)
+
+    exact_ranks = numpy.searchsorted(values, exact, side="right") / float(len(values))
+    approx_ranks = numpy.searchsorted(values, approx, side="right") / float(len(values))
+
+    errors["max_value_error"] = float(numpy.max(numpy.abs(exact - approx)))
+    errors["max_rank_error"] = float(numpy.max(numpy.abs(exact_ranks - approx_ranks)))
+
+    return errors
+
+
+def filter_values(value_list, map_type):
+    values = numpy.array([val for val in value_list or list() if val is not None], dtype=numpy.float64)
+
+    # changes since the previous census (map_type == "change") can be negative
+    if map_type == "values":
+        values = values[values > 0.0]
+    elif map_type == "percent":
+        values = values[(values > 0.0) & (values < 100.0)]
+
+    return numpy.sort(values)
+
+
+# get the class breaks for a sorted array of values. all methods return the upper bound of each class, except
+# equal interval that returns the lower bounds (the same as the SQL versions in utils.py)
+def get_bins(values, num_classes, method):
+    if len(values) == 0:
+        return list()
+
+    if method == "jenks":
+        bins = get_jenks_bins(values, num_classes)
+    elif method == "quantile":
+        bins = get_quantile_bins(values, num_classes)
+    elif method == "equal-interval":
+        bins = get_equal_interval_bins(values, num_classes)
+    else:
+        bins = get_kmeans_bins(values, num_classes)
+
+    return [float(val) for val in bins]
+
+
+# 1D k-means (Lloyd's algorithm). In 1D the clusters are contiguous ranges of the sorted values, so each iteration
+# is a binary search for the midpoints between the centroids plus a few cumulative sum lookups
+def get_kmeans_bins(values, num_classes, max_iterations=100):
+    num_classes = min(num_classes, len(numpy.unique(values)))
+
+    cumulative_sums = numpy.concatenate(([0.0], numpy.cumsum(values)))
+
+    # start with the centroids of equal count classes
+    ends = numpy.linspace(0, len(values), num_classes + 1).astype(numpy.int64)
+    centroids = (cumulative_sums[ends[1:]] - cumulative_sums[ends[:-1]]) / numpy.maximum(ends[1:] - ends[:-1], 1)
+
+    for i in range(0, max_iterations):
+        midpoints = (centroids[1:] + centroids[:-1]) / 2.0
+        new_ends = numpy.concatenate(([0], numpy.searchsorted(values, midpoints, side="right"), [len(values)]))
+
+        if numpy.array_equal(new_ends, ends):
+            break
+
+        ends = new_ends
+        counts = ends[1:] - ends[:-1]
+        sums = cumulative_sums[ends[1:]] - cumulative_sums[ends[:-1]]
+
+        # keep empty clusters where they were
+        centroids = numpy.where(counts > 0, sums / numpy.maximum(counts, 1), centroids)
+
+    # the maximum value in each (non-empty) cluster
+    return [values[end - 1] for start, end in zip(ends[:-1], ends[1:]) if end > start]
+
+
+# Fisher-Jenks natural breaks - the optimal classes that minimise the sum of squared deviations within each class
+def get_jenks_bins(values, num_classes):
+    if len(values) > max_jenks_values:
+        values = values[numpy.linspace(0, len(values) - 1, max_jenks_values).astype(numpy.int64)]
+
+    num_values = len(values)
+    num_classes = min(num_classes, num_values)
+
+    sums = numpy.concatenate(([0.0], numpy.cumsum(values)))
+    squared_sums = numpy.concatenate(([0.0], numpy.cumsum(values * values)))
+
+    # cost[k, j] is the lowest total squared deviation for values 0..j in k + 1 classes
+    # start[k, j] is the first value of the last class in that solution
+    cost = numpy.full((num_classes, num_values), numpy.inf)
+    start = numpy.zeros((num_classes, num_values), dtype=numpy.int64)
+
+    ends = numpy.arange(1, num_values + 1)
+    cost[0] = squared_sums[ends] - sums[ends] * sums[ends] / ends
+
+    for k in range(1, num_classes):
+        for j in range(k, num_values):
+            # squared deviations of every possible last class (i..j)
+            starts = numpy.arange(k, j + 1)
+            counts = j + 1 - starts
+            segment_sums = sums[j + 1] - sums[starts]
+            deviations = (squared_sums[j + 1] - squared_sums[starts]) - segment_sums * segment_sums / counts
+
+            totals = cost[k - 1, starts - 1] + deviations
+            best = numpy.argmin(totals)
+
+            cost[k, j] = totals[best]
+            start[k, j] = starts[best]
+
+    # walk back through the solution to get the upper bound of each class
+    bins = list()
+    end = num_values - 1
+
+    for k in range(num_classes - 1, -1, -1):
+        bins.append(values[end])
+        end = start[k, end] - 1
+
+    return list(reversed(bins))
+
+
+# equal count classes - the same split as Postgres' ntile()
+def get_quantile_bins(values, num_classes):
+    return [group[-1] for group in numpy.array_split(values, num_classes) if len(group) > 0]
+
+
+def get_equal_interval_bins(values, num_classes):
+    min_val = values[0]
+    delta = (values[-1] - min_val) / float(num_classes)
+
+    return [min_val + delta * i for i in range(0, num_classes)]
@@ -0,0 +1,277 @@
+
+# exports the stats (and optionally the display boundaries) of every region of a boundary type as CSV, Parquet or
+# GeoPackage files
+#
+# rows are read from a server side cursor and written a chunk at a time, so memory use is the same however big the
+# export is. Files are written under a temporary name and renamed when they're complete, so a half written export is
+# never served
+
+import csv
+import io
+import os
+import sqlite3
+import struct
+
+# file extension & mime type of each format
+export_formats = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet",
+                  "gpkg": "application/geopackage+sqlite3"}
+
+# rows per fetch from the server side cursor (and per Parquet row group)
+chunk_size = 10000
+
+# coordinate systems every GeoPackage needs, plus GDA94 (the census boundaries' coordinate system)
+gpkg_spatial_ref_systems = [
+    ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", "undefined cartesian coordinate reference system"),
+    ("Undefined geographic SRS", 0, "NONE", 0, "undefined", "undefined geographic coordinate reference system"),
+    ("WGS 84 geodetic", 4326, "EPSG", 4326,
+     'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+     'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+     'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+     "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid"),
+    ("GDA94", 4283, "EPSG", 4283,
+     'GEOGCS["GDA94",DATUM["Geocentric_Datum_of_Australia_1994",SPHEROID["GRS 1980",6378137,298.257222101,'
+     'AUTHORITY["EPSG","7019"]],TOWGS84[0,0,0,0,0,0,0],AUTHORITY["EPSG","6283"]],'
+     'PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+     'AUTHORITY["EPSG","4283"]]',
+     "longitude/latitude coordinates in decimal degrees on the GRS 1980 spheroid")]
+
+
+def get_export_columns(stats, with_geometry):
+    columns = ["id", "name", "area", "population"] + [stat_id for stat_id, table in stats]
+
+    if with_geometry:
+        columns.append("geometry")
+
+    return columns
+
+
+def get_export_sql(boundary_name, stats, geometry_column, output_format, settings):
+    """
+    Get the SQL for the export's rows, in the order of get_export_columns(). Stats are a list of (stat id, table)
+    tuples. The geometry (if geometry_column isn't None) is GeoJSON text for CSV, otherwise WKB. GeoPackage rows also
+    get each geometry's bounds.
+    """
+    select_list = ["bdy.id", "bdy.name", "bdy.area", "bdy.population"]
+    join_list = list()
+    table_aliases = dict()
+
+    for stat_id, table in stats:
+        if table not in table_aliases:
+            table_aliases[table] = "tab_{0}".format(len(table_aliases))
+            join_list.append("LEFT JOIN {0}.{1}_{2} AS {3} ON {3}.{4} = bdy.id"
+                             .format(settings['data_schema'], boundary_name, table, table_aliases[table],
+                                     settings['region_id_field']))
+
+        select_list.append("{0}.{1}".format(table_aliases[table], stat_id))
+
+    if geometry_column is not None:
+        if settings['geometry_format'] == "twkb":
+            geometry_sql = "ST_GeomFromTWKB(bdy.{0})".format(geometry_column)
+        else:
+            geometry_sql = "ST_GeomFromGeoJSON(bdy.{0}::text)".format(geometry_column)
+
+        if output_format == "csv":
+            if settings['geometry_format'] == "twkb":
+                select_list.append("ST_AsGeoJSON({0})".format(geometry_sql))
+            else:
+                select_list.append("bdy.{0}::text".format(geometry_column))
+        else:
+            join_list.append("CROSS JOIN LATERAL (SELECT {0} AS geom) AS shp".format(geometry_sql))
+            select_list.append("ST_AsBinary(shp.geom)")
+
+            if output_format == "gpkg":
+                select_list.extend(["ST_XMin(shp.geom)", "ST_XMax(shp.geom)", "ST_YMin(shp.geom)",
+                                    "ST_YMax(shp.geom)"])
+
+    return "SELECT {0} FROM {1}.{2} AS bdy {3} ORDER BY bdy.id" \
+        .format(", ".join(select_list), settings['web_schema'], boundary_name, " ".join(join_list))
+
+
+def export_boundary(pg_conn, file_path, boundary_name, stats, geometry_column, output_format, settings):
+    """
+    Write the stats of every region of a boundary type (and their geometries at a display table geometry column, if
+    geometry_column isn't None) to a file. Returns the number of rows written.
+    """
+    columns = get_export_columns(stats, geometry_column is not None)
+    sql = get_export_sql(boundary_name, stats, geometry_column, output_format, settings)
+
+    temp_file_path = "{0}.{1}.tmp".format(file_path, os.getpid())
+
+    # a named cursor reads the rows from Postgres as they're needed
+    pg_cur = pg_conn.cursor(name="census_export")
+    pg_cur.itersize = chunk_size
+
+    try:
+        pg_cur.execute(sql)
+
+        if output_format == "csv":
+            num_rows = write_csv(temp_file_path, columns, get_chunks(pg_cur))
+        elif output_format == "parquet":
+            num_rows = write_parquet(temp_file_path, columns, get_chunks(pg_cur))
+        else:  # output_format == "gpkg"
+            num_rows = write_gpkg(temp_file_path, boundary_name, columns, get_chunks(pg_cur))
+
+        os.replace(temp_file_path, file_path)
+    finally:
+        pg_conn.rollback()
+        pg_cur.close()
+
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+    return num_rows
+
+
+def get_chunks(pg_cur):
+    while True:
+        rows = pg_cur.fetchmany(chunk_size)
+
+        if len(rows) == 0:
+            break
+
+        yield rows
+
+
+def write_csv(file_path, columns, row_chunks):
+    num_rows = 0
+
+    with io.open(file_path, "w", encoding="utf-8", newline="") as output_file:
+        writer = csv.writer(output_file, lineterminator="\n")
+        writer.writerow(columns)
+
+        for rows in row_chunks:
+            writer.writerows(rows)
+            num_rows += len(rows)
+
+    return num_rows
+
+
+def write_parquet(file_path, columns, row_chunks):
+    import pyarrow  # module needs to be installed (only for Parquet exports)
+    import pyarrow.parquet
+
+    fields = [pyarrow.field("id", pyarrow.string()), pyarrow.field("name", pyarrow.string())]
+    fields.extend([pyarrow.field(column, pyarrow.float64()) for column in columns[2:] if column != "geometry"])
+
+    # WKB geometries, as in GeoParquet
+    if columns[-1] == "geometry":
+        fields.append(pyarrow.field("geometry", pyarrow.binary()))
+
+    schema = pyarrow.schema(fields)
+    num_rows = 0
+
+    with pyarrow.parquet.ParquetWriter(file_path, schema, compression="snappy") as writer:
+        for rows in row_chunks:
+            arrays = list()
+
+            for index, field in enumerate(fields):
+                values = [row[index] for row in rows]
+
+                if field.name == "geometry":
+                    values = [bytes(value) if value is not None else None for value in values]
+
+                arrays.append(pyarrow.array(values, type=field.type))
+
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            num_rows += len(rows)
+
+    return num_rows
+
+
+def write_gpkg(file_path, table_name, columns, row_chunks):
+    """
+    Write a GeoPackage (an SQLite database) with one feature table - or an attributes table if there aren't any
+    geometries. Geometries are in the GeoPackage binary format - a header with the bounds, then the WKB.
+    """
+    with_geometry = columns[-1] == "geometry"
+    attribute_columns = [column for column in columns if column != "geometry"]
+
+    connection = sqlite3.connect(file_path)
+
+    try:
+        connection.execute("PRAGMA application_id = 1196444487")  # 'GPKG'
+        connection.execute("PRAGMA user_version = 10200")
+
+        connection.execute("CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, "
+                           "organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, "
+                           "definition TEXT NOT NULL, description TEXT)")
+        connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", gpkg_spatial_ref_systems)
+
+        connection.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, "
+                           "data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', "
+                           "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                           "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, "
+                           "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+
+        connection.execute("CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, "
+                           "column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, "
+                           "z TINYINT NOT NULL, m TINYINT NOT NULL, "
+                           "CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), "
+                           "CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), "
+                           "CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))")
+
+        column_list = ["fid INTEGER PRIMARY KEY AUTOINCREMENT", "id TEXT", "name TEXT"]
+        column_list.extend(["\"{0}\" DOUBLE".format(column) for column in attribute_columns[2:]])
+
+        if with_geometry:
+            column_list.append("geom MULTIPOLYGON")
+
+        connection.execute("CREATE TABLE \"{0}\" ({1})".format(table_name, ", ".join(column_list)))
+
+        insert_sql = "INSERT INTO \"{0}\" ({1}) VALUES ({2})" \
+            .format(table_name, ", ".join(["\"{0}\"".format(column) for column in attribute_columns] +
+                                          (["geom"] if with_geometry else list())),
+                    ", ".join(["?"] * (len(attribute_columns) + (1 if with_geometry else 0))))
+
+        bounds = None
+        num_rows = 0
+
+        for rows in row_chunks:
+            values_list = list()
+
+            for row in rows:
+                values = list(row[:len(attribute_columns)])
+
+                if with_geometry:
+                    wkb, min_x, max_x, min_y, max_y = row[len(attribute_columns):]
+
+                    if wkb is None:
+                        values.append(None)
+                    else:
+                        values.append(get_gpkg_geometry(bytes(wkb), 4283, (min_x, max_x, min_y, max_y)))
+
+                        if bounds is None:
+                            bounds = [min_x, max_x, min_y, max_y]
+                        else:
+                            bounds = [min(bounds[0], min_x), max(bounds[1], max_x),
+                                      min(bounds[2], min_y), max(bounds[3], max_y)]
+
+                values_list.append(values)
+
+            connection.executemany(insert_sql, values_list)
+            num_rows += len(rows)
+
+        if with_geometry:
+            if bounds is None:
+                bounds = [None, None, None, None]
+
+            connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, "
+                               "max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, 4283)",
+                               (table_name, table_name, bounds[0], bounds[2], bounds[1], bounds[3]))
+            connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'MULTIPOLYGON', 4283, 0, 0)",
+                               (table_name,))
+        else:
+            connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier) "
+                               "VALUES (?, 'attributes', ?)", (table_name, table_name))
+
+        connection.commit()
+    finally:
+        connection.close()
+
+    return num_rows
+
+
+# a GeoPackage binary geometry - 'GP', version 0, flags (little endian header with an xy envelope), the srs id and
+# the envelope (min x, max x, min y, max y), followed by the WKB
+def get_gpkg_geometry(wkb, srs_id, envelope):
+    return b"GP" + struct.pack("<BBi4d", 0, 0x03, srs_id, *envelope) + wkb
@@ -0,0 +1,277 @@
+
+# finds the census boundaries that lists of points are in, and the points' stats
+#
+# the points are copied into a temp table in batches and each batch is joined to every boundary table in one query,
+# using their spatial indexes - never a query per point. Input and output are streamed a batch at a time, so the
+# number of points is only limited by time
+
+import csv
+import io
+import json
+import math
+
+# points per temp table (i.e. per query)
+batch_size = 50000
+
+# column (or key) names accepted for the points' coordinates & ids
+longitude_names = ["longitude", "lon", "lng", "long", "x"]
+latitude_names = ["latitude", "lat", "y"]
+id_names = ["id", "point_id"]
+
+
+def get_lookup_boundaries(settings, boundary_names=None):
+    """
+    Get the settings for the boundaries to look up - all of them if boundary_names is empty.
+    Raises a ValueError for unknown boundaries.
+    """
+    boundary_dicts = {boundary_dict["boundary"]: boundary_dict for boundary_dict in settings['bdy_table_dicts']}
+
+    if not boundary_names:
+        return list(boundary_dicts.values())
+
+    for boundary_name in boundary_names:
+        if boundary_name not in boundary_dicts:
+            raise ValueError("Invalid boundary : {0}".format(boundary_name))
+
+    return [boundary_dicts[boundary_name] for boundary_name in boundary_names]
+
+
+def get_loaded_boundaries(pg_conn, boundaries, settings):
+    """
+    Get the boundaries whose tables have been loaded - not every boundary in the settings is in every database.
+    """
+    table_names = get_table_names(pg_conn, settings['boundary_schema'])
+
+    return [boundary_dict for boundary_dict in boundaries
+            if get_boundary_table_name(boundary_dict, settings) in table_names]
+
+
+def get_missing_tables(pg_conn, boundaries, stats, stats_boundary, settings):
+    """
+    Get the names of the boundary & data tables a lookup needs that haven't been loaded.
+    """
+    boundary_table_names = get_table_names(pg_conn, settings['boundary_schema'])
+    data_table_names = get_table_names(pg_conn, settings['data_schema'])
+
+    missing_tables = list()
+
+    for boundary_dict in boundaries:
+        table_name = get_boundary_table_name(boundary_dict, settings)
+
+        if table_name not in boundary_table_names:
+            missing_tables.append("{0}.{1}".format(settings['boundary_schema'], table_name))
+
+    for table in sorted({table for stat_id, table in stats}):
+        table_name = "{0}_{1}".format(stats_boundary, table)
+
+        if table_name not in data_table_names:
+            missing_tables.append("{0}.{1}".format(settings['data_schema'], table_name))
+
+    return missing_tables
+
+
+def get_table_names(pg_conn, schema_name):
+    pg_cur = pg_conn.cursor()
+
+    try:
+        pg_cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s", (schema_name,))
+        table_names = {row[0] for row in pg_cur.fetchall()}
+    finally:
+        pg_conn.rollback()
+        pg_cur.close()
+
+    return table_names
+
+
+def get_boundary_table_name(boundary_dict, settings):
+    return "{0}_{1}_aust".format(boundary_dict["boundary"], settings['census_year'])
+
+
+def read_points(lines, input_format):
+    """
+    Read (id, longitude, latitude) tuples from lines of CSV (with a header row) or NDJSON.
+    Points without an id get their row number. Points with invalid coordinates are returned with None coordinates.
+    """
+    if input_format == "csv":
+        rows = csv.reader(lines)
+        header = [name.strip().lower() for name in next(rows, list())]
+
+        longitude_index = get_column_index(header, longitude_names)
+        latitude_index = get_column_index(header, latitude_names)
+        id_index = get_column_index(header, id_names)
+
+        if longitude_index is None or latitude_index is None:
+            raise ValueError("No longitude & latitude columns found in : {0}".format(",".join(header)))
+
+        for row_num, row in enumerate(rows, 1):
+            if len(row) == 0:
+                continue
+
+            point_id = row[id_index] if id_index is not None and id_index < len(row) else str(row_num)
+
+            yield point_id, get_coordinate(row, longitude_index), get_coordinate(row, latitude_index)
+    else:  # input_format == "ndjson"
+        row_num = 0
+
+        for line in lines:
+            if line.strip() == "":
+                continue
+
+            row_num += 1
+            point_dict = {key.lower(): value for key, value in json.loads(line).items()}
+
+            point_id = get_value(point_dict, id_names)
+
+            yield (str(point_id) if point_id is not None else str(row_num),
+                   get_float(get_value(point_dict, longitude_names)),
+                   get_float(get_value(point_dict, latitude_names)))
+
+
+def get_column_index(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+
+    return None
+
+
+def get_value(point_dict, names):
+    for name in names:
+        if name in point_dict:
+            return point_dict[name]
+
+    return None
+
+
+def get_coordinate(row, index):
+    return get_float(row[index]) if index < len(row) else None
+
+
+def get_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return value if math.isfinite(value) else None
+
+
+def get_output_columns(boundaries, stats):
+    return ["id", "longitude", "latitude"] + ["{0}_id".format(boundary_dict["boundary"])
+                                              for boundary_dict in boundaries] + [stat_id for stat_id, table in stats]
+
+
+def get_lookup_sql(boundaries, stats, stats_boundary, settings):
+    # the first boundary with each id containing the point (boundaries can have more than one polygon)
+    select_list = ["pnt.point_id", "pnt.longitude", "pnt.latitude"]
+    join_list = list()
+
+    for i, boundary_dict in enumerate(boundaries):
+        select_list.append("bdy_{0}.id".format(i))
+        join_list.append("LEFT JOIN LATERAL (SELECT {0}::text AS id FROM {1}.{2} "
+                         "WHERE ST_Intersects(geom, ST_SetSRID(ST_MakePoint(pnt.longitude, pnt.latitude), 4283)) "
+                         "LIMIT 1) AS bdy_{3} ON TRUE"
+                         .format(boundary_dict["id_field"], settings['boundary_schema'],
+                                 get_boundary_table_name(boundary_dict, settings), i))
+
+    # the stats come from the data tables of one of the boundaries
+    if len(stats) > 0:
+        boundary_index = [boundary_dict["boundary"] for boundary_dict in boundaries].index(stats_boundary)
+        table_aliases = dict()
+
+        for stat_id, table in stats:
+            if table not in table_aliases:
+                table_aliases[table] = "tab_{0}".format(len(table_aliases))
+                join_list.append("LEFT JOIN {0}.{1}_{2} AS {3} ON {3}.{4} = bdy_{5}.id"
+                                 .format(settings['data_schema'], stats_boundary, table, table_aliases[table],
+                                         settings['region_id_field'], boundary_index))
+
+            select_list.append("{0}.{1}".format(table_aliases[table], stat_id))
+
+    return "SELECT {0} FROM lookup_points AS pnt {1} ORDER BY pnt.point_num" \
+        .format(", ".join(select_list), " ".join(join_list))
+
+
+def lookup_points(pg_conn, points, boundaries, stats, stats_boundary, settings, statement_timeout=0):
+    """
+    Look up an iterable of (id, longitude, latitude) points. Returns a generator of lists of result rows (in the
+    order of get_output_columns()), one list per batch of points.
+    Stats are a list of (stat id, table) tuples from the data tables of stats_boundary, which must be one of the
+    boundaries.
+    """
+    sql = get_lookup_sql(boundaries, stats, stats_boundary, settings)
+    pg_cur = pg_conn.cursor()
+
+    try:
+        for batch in get_batches(points):
+            # the temp table only lasts for the batch's transaction
+            pg_cur.execute("CREATE TEMP TABLE lookup_points (point_num integer, point_id text, "
+                           "longitude double precision, latitude double precision) ON COMMIT DROP")
+
+            if statement_timeout > 0:
+                pg_cur.execute("SET LOCAL statement_timeout = %s", (statement_timeout,))
+
+            copy_file = io.StringIO()
+
+            for point_num, (point_id, longitude, latitude) in enumerate(batch):
+                copy_file.write("{0}\t{1}\t{2}\t{3}\n".format(point_num, get_copy_text(point_id),
+                                                              get_copy_number(longitude), get_copy_number(latitude)))
+
+            copy_file.seek(0)
+            pg_cur.copy_expert("COPY lookup_points FROM STDIN", copy_file)
+
+            pg_cur.execute(sql)
+            rows = pg_cur.fetchall()
+
+            pg_conn.commit()
+
+            yield rows
+    finally:
+        pg_conn.rollback()
+        pg_cur.close()
+
+
+def get_batches(points):
+    batch = list()
+
+    for point in points:
+        batch.append(point)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+
+    if len(batch) > 0:
+        yield batch
+
+
+# escapes text for Postgres' COPY text format
+def get_copy_text(value):
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def get_copy_number(value):
+    return "\\N" if value is None else repr(value)
+
+
+def get_output_lines(row_batches, columns, output_format):
+    """
+    Format batches of result rows as CSV (with a header row) or NDJSON. Returns a generator of strings, one per
+    batch (plus the CSV header).
+    """
+    if output_format == "csv":
+        output_file = io.StringIO()
+        writer = csv.writer(output_file, lineterminator="\n")
+        writer.writerow(columns)
+
+        yield output_file.getvalue()
+
+        for rows in row_batches:
+            output_file = io.StringIO()
+            writer = csv.writer(output_file, lineterminator="\n")
+            writer.writerows(rows)
+
+            yield output_file.getvalue()
+    else:  # output_format == "ndjson"
+        for rows in row_batches:
+            yield "".join([json.dumps(dict(zip(columns, row))) + "\n" for row in rows])
@@ -0,0 +1,263 @@
+
+# runs the loader's jobs as a dependency graph in a multiprocessing pool
+#
+# each job starts as soon as the jobs it depends on have finished. When more jobs are ready than there are free
+# processes, the ones at the head of the longest remaining chain of work (the critical path) go first, e.g. the
+# meshblock and SA1 shapefiles and their display boundaries
+
+import queue
+
+from datetime import datetime
+
+# minimum time (in seconds) to measure a stage's throughput over when adapting its concurrency
+min_window_seconds = 2.0
+
+
+class Job:
+    def __init__(self, name, kind, function, args, cost=1.0, deps=None):
+        self.name = name
+        self.kind = kind  # the load stage the job belongs to, for logging
+        self.function = function  # must be a module level function so it can be pickled
+        self.args = args
+        self.cost = float(cost)  # relative estimate of the job's run time (e.g. its file size)
+        self.deps = list(deps or list())
+
+        self.dependents = list()
+        self.priority = 0.0  # cost of the longest chain of jobs from this one to the end of the graph
+        self.remaining_deps = 0
+        self.start_time = None
+        self.result = None
+
+
+class JobScheduler:
+    def __init__(self, logger):
+        self.logger = logger
+        self.jobs = dict()
+
+    def add(self, job):
+        if job.name in self.jobs:
+            raise ValueError("Duplicate job name : {0}".format(job.name))
+
+        self.jobs[job.name] = job
+
+        return job
+
+    def add_list(self, job_list):
+        for job in job_list:
+            self.add(job)
+
+    def run(self, pool, max_jobs, min_jobs=None, get_load=None):
+        """
+        Run all jobs in the pool, with at most max_jobs running at once.
+        If min_jobs is set, the number of jobs of each stage (kind) running at once is adjusted between min_jobs and
+        max_jobs to get the most work done per second - get_load() can also report the database as overloaded.
+        Failed jobs are logged - the jobs that depend on them still run (the same as the loader's stage by stage
+        multiprocessing).
+        """
+        start_time = datetime.now()
+
+        self.prepare()
+
+        # jobs left to finish for each stage, to log when a stage is done
+        kind_counts = dict()
+
+        for job in self.jobs.values():
+            kind_counts[job.kind] = kind_counts.get(job.kind, 0) + 1
+
+        # the concurrency for each stage - fixed at max_jobs unless adaptive
+        controllers = dict()
+
+        for kind in kind_counts.keys():
+            if min_jobs is None:
+                controllers[kind] = FixedConcurrency(max_jobs)
+            else:
+                controllers[kind] = AdaptiveConcurrency(kind, min_jobs, max_jobs, get_load, self.logger)
+
+        kind_running = {kind: 0 for kind in kind_counts.keys()}
+
+        ready = [job for job in self.jobs.values() if job.remaining_deps == 0]
+        finished = queue.Queue()
+        running = 0
+        num_finished = 0
+
+        while num_finished < len(self.jobs):
+            # start the highest priority ready jobs, within each stage's concurrency
+            ready.sort(key=lambda j: j.priority, reverse=True)
+
+            for job in list(ready):
+                if running >= max_jobs:
+                    break
+
+                if kind_running[job.kind] >= controllers[job.kind].limit:
+                    continue
+
+                ready.remove(job)
+                job.start_time = datetime.now()
+
+                pool.apply_async(job.function, (job.args,),
+                                 callback=lambda result, j=job: finished.put((j, result)),
+                                 error_callback=lambda ex, j=job: finished.put((j, "JOB FAILED! : {0}".format(ex))))
+                running += 1
+                kind_running[job.kind] += 1
+
+            if running == 0:
+                # only possible if there's a dependency cycle
+                self.logger.fatal("\t- Job graph can't be completed - {0} jobs are waiting on each other"
+                                  .format(len(self.jobs) - num_finished))
+                break
+
+            job, result = finished.get()
+            job.result = result
+            running -= 1
+            kind_running[job.kind] -= 1
+            num_finished += 1
+
+            controllers[job.kind].job_finished(job)
+
+            if result != "SUCCESS":
+                self.logger.info(result)
+
+            self.logger.debug("\t\t- {0} : {1}".format(job.name, datetime.now() - job.start_time))
+
+            kind_counts[job.kind] -= 1
+
+            if kind_counts[job.kind] == 0:
+                self.logger.info("\t- {0} jobs done : {1}".format(job.kind, datetime.now() - start_time))
+                controllers[job.kind].log_summary()
+
+            for dependent in job.dependents:
+                dependent.remaining_deps -= 1
+
+                if dependent.remaining_deps == 0:
+                    ready.append(dependent)
+
+        return num_finished == len(self.jobs)
+
+    def prepare(self):
+        for job in self.jobs.values():
+            job.dependents = list()
+            job.remaining_deps = 0
+
+        for job in self.jobs.values():
+            for dep_name in job.deps:
+                dep = self.jobs.get(dep_name)
+
+                # a missing input (e.g. a boundary without a shapefile) is logged, the job's SQL will fail as before
+                if dep is None:
+                    self.logger.warning("\t- {0} depends on {1}, which isn't in the load".format(job.name, dep_name))
+                else:
+                    dep.dependents.append(job)
+                    job.remaining_deps += 1
+
+        # priorities are the longest path from each job to the end of the graph (in reverse topological order)
+        for job in reversed(self.get_topological_order()):
+            job.priority = job.cost + max([dependent.priority for dependent in job.dependents] or [0.0])
+
+    def get_topological_order(self):
+        remaining = {job.name: job.remaining_deps for job in self.jobs.values()}
+        order = [job for job in self.jobs.values() if job.remaining_deps == 0]
+        i = 0
+
+        while i < len(order):
+            for dependent in order[i].dependents:
+                remaining[dependent.name] -= 1
+
+                if remaining[dependent.name] == 0:
+                    order.append(dependent)
+
+            i += 1
+
+        return order
+
+
+class FixedConcurrency:
+    def __init__(self, limit):
+        self.limit = limit
+
+    def job_finished(self, job):
+        pass
+
+    def log_summary(self):
+        pass
+
+
+# hill climbs the number of a stage's jobs running at once. After each window of finished jobs, the work done per
+# second (their total cost / time) is compared to the last window's - concurrency keeps moving the same way while
+# throughput improves and turns around when it drops, or is lowered if the database is overloaded
+class AdaptiveConcurrency:
+    def __init__(self, kind, min_jobs, max_jobs, get_load, logger):
+        self.kind = kind
+        self.min_jobs = max(min(min_jobs, max_jobs), 1)
+        self.max_jobs = max_jobs
+        self.get_load = get_load
+        self.logger = logger
+
+        # start at the configured maximum and try fewer first
+        self.limit = max_jobs
+        self.direction = -1
+
+        # the window starts when the stage's first job does
+        self.window_start = None
+        self.window_jobs = 0
+        self.window_cost = 0.0
+        self.last_throughput = None
+
+        # throughput achieved at each concurrency
+        self.history = dict()
+
+    def job_finished(self, job):
+        if self.window_start is None:
+            self.window_start = job.start_time
+
+        self.window_jobs += 1
+        self.window_cost += job.cost
+
+        seconds = (datetime.now() - self.window_start).total_seconds()
+
+        # wait for enough jobs to measure the current concurrency
+        if self.window_jobs < max(self.limit, 2) or seconds < min_window_seconds:
+            return
+
+        throughput = self.window_cost / seconds
+        self.history.setdefault(self.limit, list()).append(throughput)
+
+        load = self.get_load() if self.get_load is not None else None
+
+        if load is not None and load["overloaded"]:
+            self.direction = -1
+        elif self.last_throughput is not None and throughput < self.last_throughput * 0.95:
+            self.direction = -self.direction
+
+        new_limit = min(max(self.limit + self.direction, self.min_jobs), self.max_jobs)
+
+        self.logger.info("\t\t- {0} : {1} processes, throughput {2:.1f}/s{3} - next {4} processes"
+                         .format(self.kind, self.limit, throughput, get_load_text(load), new_limit))
+
+        # at a bound - head back the other way next time
+        if new_limit == self.limit:
+            self.direction = -self.direction
+
+        self.limit = new_limit
+        self.last_throughput = throughput
+
+        self.window_start = datetime.now()
+        self.window_jobs = 0
+        self.window_cost = 0.0
+
+    def log_summary(self):
+        if len(self.history) == 0:
+            return
+
+        averages = {limit: sum(values) / len(values) for limit, values in self.history.items()}
+        best_limit = max(averages, key=averages.get)
+
+        self.logger.info("\t\t- {0} : best throughput {1:.1f}/s with {2} processes"
+                         .format(self.kind, averages[best_limit], best_limit))
+
+
+def get_load_text(load):
+    if load is None:
+        return ""
+
+    return ", " + ", ".join(["{0} {1}".format(key, value) for key, value in sorted(load.items())
+                             if key != "overloaded" and value is not None])
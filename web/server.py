@@ -1,21 +1,39 @@
-
 import ast
+import functools
+import hashlib
+import io
+import itertools
 import json
 # import math
-# import os
+import os
 import psycopg2
+import threading
 
 # import sys
+import cache
+import cancellation
+import catalogue
+import classify
+import export
+import lookup
+import singleflight
+import twkb
 import utils
+import warmup
 
 from datetime import datetime
 
 from contextlib import contextmanager
+from contextlib import ExitStack
 
 from flask import Flask
+from flask import g
+from flask import make_response
 from flask import render_template
 from flask import request
 from flask import Response
+from flask import send_file
+from flask import stream_with_context
 from flask_compress import Compress
 
 from psycopg2 import extras
@@ -69,6 +87,139 @@ def get_db_cursor(commit=False):
             cursor.close()
 
 
+def get_density_grids():
+    """
+    Load the per boundary grids of feature counts created by the loader.
+    Used to estimate the number of features in a map view without querying the boundaries.
+    """
+    density_grids = dict()
+
+    with get_db_cursor() as pg_cur:
+        try:
+            pg_cur.execute("SELECT boundary, cell_x, cell_y, features FROM {0}.boundary_density"
+                           .format(settings['web_schema']))
+        except psycopg2.Error:
+            print("No boundary density grids found - using fixed boundaries for each zoom level")
+            return density_grids
+
+        for row in pg_cur.fetchall():
+            density_grids.setdefault(row["boundary"], dict())[(row["cell_x"], row["cell_y"])] = row["features"]
+
+    return density_grids
+
+
+density_grids = get_density_grids()
+
+
+def get_metadata_catalogue():
+    """
+    Load the census metadata tables into memory - they never change after a load.
+    """
+    metadata_catalogue = catalogue.MetadataCatalogue()
+
+    with get_db_cursor() as pg_cur:
+        metadata_catalogue.load(pg_cur, settings)
+
+    print("Loaded metadata for {0} tables and {1} stats"
+          .format(len(metadata_catalogue.tables), len(metadata_catalogue.stats)))
+
+    return metadata_catalogue
+
+
+metadata_catalogue = get_metadata_catalogue()
+
+# the boundaries that have web display tables
+web_boundaries = [boundary_dict["boundary"] for boundary_dict in settings["bdy_table_dicts"]
+                  if boundary_dict["boundary"] != "mb"]
+
+
+# maximum number of boundaries in a /get-geometry request (the vertex & byte budget still applies to them)
+max_geometry_ids = 10000
+
+
+def get_error_response(message, status):
+    return Response(json.dumps({"error": message}), status=status, mimetype='application/json')
+
+
+def get_cancelled_response(query):
+    # cancelled by a newer request or a disconnected client, otherwise the statement timed out
+    if query.cancelled_reason is not None:
+        return get_error_response(query.cancelled_reason, 409)
+    else:
+        return get_error_response("Map data query timed out - zoom in to see data", 503)
+
+
+def get_request_key():
+    # the request's path and querystring, ignoring the client id & request generation
+    arg_list = sorted("{0}={1}".format(key, value) for key, value in request.args.items(multi=True)
+                      if key not in ("c", "g"))
+
+    return request.path + "?" + "&".join(arg_list)
+
+
+# successful map data responses - the same map view always gets the same response
+response_cache = cache.LRUCache(settings['response_cache_bytes'])
+
+
+def cached_response(view_function):
+    """
+    Return the cached response for the request if there is one, otherwise run the view and cache its response if it
+    succeeded.
+    """
+    @functools.wraps(view_function)
+    def wrapper(*args, **kwargs):
+        if settings['response_cache_bytes'] <= 0:
+            return view_function(*args, **kwargs)
+
+        key = get_request_key()
+        body = response_cache.get(key)
+
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+        response = make_response(view_function(*args, **kwargs))
+
+        if response.status_code == 200 and response.mimetype == 'application/json':
+            body = response.get_data()
+            response_cache.put(key, body, len(body))
+
+        return response
+
+    return wrapper
+
+
+# concurrent identical requests share one database query
+flights = singleflight.SingleFlight()
+
+
+def single_flight(view_function):
+    """
+    Coalesce concurrent requests with the same path and querystring (ignoring the client id & request generation).
+    The first request runs the view, the others wait for it and get a copy of its response. Cancelled (409)
+    responses are only for the request whose query was cancelled - the others run the view again.
+    """
+    @functools.wraps(view_function)
+    def wrapper(*args, **kwargs):
+        g.flight_key = get_request_key()
+
+        def run_view():
+            response = make_response(view_function(*args, **kwargs))
+            return response.get_data(), response.status_code, response.mimetype
+
+        body, status, mimetype = flights.do(g.flight_key, run_view, lambda result: result[1] != 409)
+
+        return Response(body, status=status, mimetype=mimetype)
+
+    return wrapper
+
+
+def get_is_shared_request():
+    # a function saying whether other requests are waiting on this one's response - if not, it stops any more joining
+    # it. The flight is bound now, as the function is called from other threads (without this request's context)
+    # when they cancel its query
+    return functools.partial(flights.check_shared, g.flight_key, flights.get_call(g.flight_key))
+
+
 @app.route("/")
 def homepage():
     return render_template('index.html')
@@ -91,6 +242,7 @@ def get_boundary_name():
 
 
 @app.route("/get-metadata")
+@single_flight
 def get_metadata():
     full_start_time = datetime.now()
     # start_time = datetime.now()
@@ -106,6 +258,9 @@ def get_metadata():
     except TypeError:
         num_classes = 7
 
+    # add the map classes of the change since the previous census
+    with_change = request.args.get('ch') == "1"
+
     # replace all maths operators to get list of all the stats we need to query for
     search_stats = raw_stats.upper().replace(" ", "").replace("(", "").replace(")", "") \
         .replace("+", ",").replace("-", ",").replace("/", ",").replace("*", ",").split(",")
@@ -137,25 +292,7 @@ def get_metadata():
             test_names.append(bdy_name)
 
     # get stats metadata, including the all important table number and map type (raw values based or normalised by pop)
-    sql = "SELECT lower(sequential_id) AS id, " \
-          "lower(table_number) AS \"table\", " \
-          "replace(long_id, '_', ' ') AS description, " \
-          "column_heading_description AS type, " \
-          "CASE WHEN lower(sequential_id) = 'b3' OR lower(long_id) LIKE '%%median%%' OR lower(long_id) " \
-          "LIKE '%%average%%' THEN 'values' " \
-          "ELSE 'percent' END AS maptype " \
-          "FROM {0}.metadata_stats " \
-          "WHERE lower(sequential_id) IN %s " \
-          "ORDER BY sequential_id".format(settings["data_schema"], )
-
-    with get_db_cursor() as pg_cur:
-        try:
-            pg_cur.execute(sql, (search_stats_tuple,))
-        except psycopg2.Error:
-            return "I can't SELECT:<br/><br/>" + sql
-
-        # Retrieve the results of the query
-        rows = pg_cur.fetchall()
+    rows = metadata_catalogue.get_stats_output(search_stats_tuple)
 
     # output is the main content, row_output is the content from each record returned
     response_dict = dict()
@@ -176,27 +313,40 @@ def get_metadata():
     # For each row returned assemble a dictionary
     for row in rows:
         feature_dict = dict(row)
-        feature_dict["id"] = feature_dict["id"].lower()
-        feature_dict["table"] = feature_dict["table"].lower()
+
+        approximate_dict = dict()
 
         for boundary in boundary_names:
-            boundary_table = "{0}.{1}".format(settings["web_schema"], boundary["name"])
+            bins, rank_error = get_class_breaks(boundary["name"], boundary["min"], feature_dict, num_classes)
+            feature_dict[boundary["name"]] = bins
 
-            data_table = "{0}.{1}_{2}".format(settings["data_schema"], boundary["name"], feature_dict["table"])
+            # flag the boundaries with classes from a sample & how far their ranks could be out (95% confidence)
+            if rank_error is not None:
+                approximate_dict[boundary["name"]] = rank_error
 
-            # get the values for the map classes
+        if len(approximate_dict) > 0:
+            feature_dict["approximate"] = approximate_dict
+
+        if with_change:
+            # only the boundaries loaded with the previous census' stats have classes (the others get null)
             with get_db_cursor() as pg_cur:
-                if feature_dict["maptype"] == "values":
-                    stat_field = "tab.{0}" \
-                        .format(feature_dict["id"], )
-                else:  # feature_dict["maptype"] == "percent"
-                    stat_field = "CASE WHEN bdy.population > 0 THEN tab.{0} / bdy.population * 100.0 ELSE 0 END" \
-                        .format(feature_dict["id"], )
-
-                # feature_dict[boundary_name] = utils.get_equal_interval_bins(
-                feature_dict[boundary["name"]] = utils.get_kmeans_bins(
-                    data_table, boundary_table, stat_field, num_classes, boundary["min"], feature_dict["maptype"],
-                    pg_cur, settings)
+                change_boundaries = [boundary for boundary in boundary_names
+                                     if has_previous_table(boundary["name"], feature_dict["table"], pg_cur)]
+
+            if len(change_boundaries) == 0:
+                return get_error_response("No previous census data for {0}".format(feature_dict["id"]), 404)
+
+            for change_type in ("change", "change_percent"):
+                feature_dict[change_type] = dict()
+
+                for boundary in boundary_names:
+                    if boundary in change_boundaries:
+                        bins, rank_error = get_class_breaks(boundary["name"], boundary["min"], feature_dict,
+                                                            num_classes, change_type)
+                    else:
+                        bins = None
+
+                    feature_dict[change_type][boundary["name"]] = bins
 
         # add dict to output array of metadata
         feature_array.append(feature_dict)
@@ -214,54 +364,225 @@ def get_metadata():
     return Response(json.dumps(response_dict), mimetype='application/json')
 
 
+# map classes for each boundary, stat, number of classes & method - kept for good as the data never changes
+class_breaks_cache = dict()
+
+
+# returns the map classes and their maximum rank error if they're from a sample of the values (otherwise None).
+# change_type gets the classes of the 'change' or 'change_percent' since the previous census
+def get_class_breaks(boundary_name, min_val, stat_dict, num_classes, change_type=None):
+    key = (boundary_name, stat_dict["id"], num_classes, settings["classification"], change_type)
+    result = class_breaks_cache.get(key)
+
+    if result is None:
+        boundary_table = "{0}.{1}".format(settings["web_schema"], boundary_name)
+        data_table = "{0}.{1}_{2}".format(settings["data_schema"], boundary_name, stat_dict["table"])
+        map_type = stat_dict["maptype"]
+
+        if change_type is not None:
+            data_table = "(SELECT cur.{0}, cur.{1} AS current, prev.{1} AS previous FROM {2} AS cur " \
+                         "INNER JOIN {2}_previous AS prev ON prev.{0} = cur.{0})" \
+                .format(settings["region_id_field"], stat_dict["id"], data_table)
+            map_type = "change"
+
+            if change_type == "change":
+                stat_field = "tab.current - tab.previous"
+            else:  # change_type == "change_percent"
+                stat_field = "CASE WHEN tab.previous > 0 THEN (tab.current - tab.previous) / tab.previous * 100.0 END"
+        elif stat_dict["maptype"] == "values":
+            stat_field = "tab.{0}" \
+                .format(stat_dict["id"], )
+        else:  # stat_dict["maptype"] == "percent"
+            stat_field = "CASE WHEN bdy.population > 0 THEN tab.{0} / bdy.population * 100.0 ELSE 0 END" \
+                .format(stat_dict["id"], )
+
+        rank_error = None
+
+        # get the stat's values once and classify them in memory. Big boundaries only use a sample of them - if it's
+        # small enough to be worth it
+        sample_size = classify.get_sample_size(settings["class_breaks_rank_error"])
+
+        with get_db_cursor() as pg_cur:
+            try:
+                row_count = get_boundary_row_count(boundary_table, pg_cur)
+
+                if 0 < settings["approx_class_breaks_rows"] < row_count and sample_size * 4 <= row_count:
+                    rank_error = settings["class_breaks_rank_error"]
+
+                    values = classify.get_sample_values(data_table, boundary_table, stat_field, min_val,
+                                                        map_type, sample_size, pg_cur, settings)
+                else:
+                    values = classify.get_values(data_table, boundary_table, stat_field, min_val,
+                                                 map_type, pg_cur, settings)
+            except psycopg2.Error as ex:
+                print("{0} - {1} Failed: {2}".format(data_table, stat_field, ex))
+                values = list()
+
+        result = (classify.get_bins(values, num_classes, settings["classification"]), rank_error)
+        class_breaks_cache[key] = result
+
+    return result
+
+
+# whether each data table has the previous census' stats - they're only loaded with --previous-census-year
+previous_tables = dict()
+
+
+def has_previous_table(boundary_name, table_id, pg_cur):
+    table_name = "{0}.{1}_{2}_previous".format(settings['data_schema'], boundary_name, table_id)
+    table_exists = previous_tables.get(table_name)
+
+    if table_exists is None:
+        pg_cur.execute("SELECT to_regclass(%s) IS NOT NULL AS table_exists", (table_name,))
+        table_exists = pg_cur.fetchone()["table_exists"]
+        previous_tables[table_name] = table_exists
+
+    return table_exists
+
+
+# number of rows in each boundary table - Postgres' estimate is close enough to decide whether to sample
+boundary_row_counts = dict()
+
+
+def get_boundary_row_count(boundary_table, pg_cur):
+    row_count = boundary_row_counts.get(boundary_table)
+
+    if row_count is None:
+        pg_cur.execute("SELECT reltuples::bigint AS row_count FROM pg_class WHERE oid = '{0}'::regclass"
+                       .format(boundary_table))
+        row_count = pg_cur.fetchone()["row_count"]
+        boundary_row_counts[boundary_table] = row_count
+
+    return row_count
+
+
 @app.route("/get-data")
+@cached_response
+@single_flight
 def get_data():
     full_start_time = datetime.now()
     start_time = datetime.now()
 
     # Get parameters from querystring
 
-    map_left = request.args.get('ml')
-    map_bottom = request.args.get('mb')
-    map_right = request.args.get('mr')
-    map_top = request.args.get('mt')
+    map_left = float(request.args.get('ml'))
+    map_bottom = float(request.args.get('mb'))
+    map_right = float(request.args.get('mr'))
+    map_top = float(request.args.get('mt'))
 
     stat_id = request.args.get('s')
     table_id = request.args.get('t')
     boundary_name = request.args.get('b')
     zoom_level = int(request.args.get('z'))
 
+    # optional client id and request generation - lets a newer request from the same map cancel older ones
+    client_id = request.args.get('c')
+    generation = request.args.get('g', type=int)
+
     # TODO: add support for equations
 
-    # get the boundary table name from zoom level
+    # validate the stat, table and boundary against the metadata (they're used as table & field names)
+    if not metadata_catalogue.is_valid_stat(stat_id, table_id):
+        return get_error_response("Invalid stat or table : {0} {1}".format(stat_id, table_id), 400)
+
+    if boundary_name is not None and boundary_name not in web_boundaries:
+        return get_error_response("Invalid boundary : {0}".format(boundary_name), 400)
+
+    stat_id = stat_id.lower()
+    table_id = table_id.lower()
+
+    # get the boundary table name from the number of features in the map view, or from the zoom level
     if boundary_name is None:
-        boundary_name, min_val = utils.get_boundary(zoom_level)
+        if settings['feature_budget'] > 0 and len(density_grids) > 0:
+            boundary_name, min_val = utils.get_adaptive_boundary(zoom_level, map_left, map_bottom, map_right,
+                                                                 map_top, density_grids, settings)
+        else:
+            boundary_name, min_val = utils.get_boundary(zoom_level)
+    else:
+        min_val = dict(utils.get_boundary_list()).get(boundary_name, utils.get_boundary(zoom_level)[1])
 
-    display_zoom = str(zoom_level).zfill(2)
+    # display geometries are only available for zoom levels 4 to 17
+    geometry_zoom = min(max(zoom_level, 4), 17)
 
-    with get_db_cursor() as pg_cur:
+    envelope_sql = "ST_MakeEnvelope({0}, {1}, {2}, {3}, 4283)".format(map_left, map_bottom, map_right, map_top)
+
+    client_socket = cancellation.get_client_socket(request.environ)
+
+    with get_db_cursor() as pg_cur, \
+            cancellation.cancellable_query(pg_cur.connection, client_id, generation, client_socket,
+                                           get_is_shared_request()) as query:
         print("Connected to database in {0}".format(datetime.now() - start_time))
         start_time = datetime.now()
 
-        # envelope_sql = "ST_MakeEnvelope({0}, {1}, {2}, {3}, 4283)".format(map_left, map_bottom, map_right, map_top)
-        # geom_sql = "geojson_{0}".format(display_zoom)
+        # don't bother if a newer request has already arrived
+        if query.cancelled_reason is not None:
+            return get_error_response(query.cancelled_reason, 409)
+
+        # stop long running queries from tying up the connection pool (only lasts for this transaction)
+        if settings['statement_timeout'] > 0:
+            pg_cur.execute("SET LOCAL statement_timeout = %s", (settings['statement_timeout'],))
+
+        # fall back to more simplified boundaries if the response would be too big
+        try:
+            geometry_zoom = utils.get_budget_zoom_level("{0}.{1}".format(settings['web_schema'], boundary_name),
+                                                        geometry_zoom, envelope_sql, pg_cur, settings)
+        except psycopg2.extensions.QueryCanceledError:
+            return get_cancelled_response(query)
+        except psycopg2.Error:
+            return get_error_response("Unable to estimate map data size for {0}".format(boundary_name), 500)
+
+        if geometry_zoom is None:
+            return get_error_response("Too much map data requested - zoom in to see data", 413)
+
+        # progressive delivery - send more simplified boundaries first, the client then gets the detailed ones for the
+        # same ids from /get-geometry
+        refine_zoom = None
+
+        if request.args.get('p') == "1" and settings['progressive_zoom_offset'] > 0:
+            coarse_zoom = max(geometry_zoom - settings['progressive_zoom_offset'], 4)
+
+            if coarse_zoom < geometry_zoom:
+                refine_zoom = geometry_zoom
+                geometry_zoom = coarse_zoom
+
+        geom_column = utils.get_geometry_column(geometry_zoom, settings)
+
+        # the change since the previous census - its stats are already apportioned to this census' boundaries
+        if request.args.get('ch') == "1":
+            try:
+                if not has_previous_table(boundary_name, table_id, pg_cur):
+                    return get_error_response("No previous census data for {0} {1}".format(boundary_name, table_id),
+                                              404)
+            except psycopg2.extensions.QueryCanceledError:
+                return get_cancelled_response(query)
+
+            change_select = ", prev.{0} AS previous, tab.{0} - prev.{0} AS change, " \
+                            "CASE WHEN prev.{0} > 0 THEN (tab.{0} - prev.{0}) / prev.{0} * 100.0 END " \
+                            "AS change_percent".format(stat_id)
+            change_join = "LEFT JOIN {0}.{1}_{2}_previous AS prev ON prev.{3} = tab.{3}" \
+                .format(settings['data_schema'], boundary_name, table_id, settings['region_id_field'])
+        else:
+            change_select = ""
+            change_join = ""
 
         # build SQL with SQL injection protection
         sql_template = "SELECT bdy.id, bdy.name, bdy.population, tab.%s / bdy.area AS density, " \
               "CASE WHEN bdy.population > 0 THEN tab.%s / bdy.population * 100.0 ELSE 0 END AS percent, " \
-              "tab.%s, geojson_%s AS geometry " \
+              "tab.%s%s, %s AS geometry " \
               "FROM {0}.%s AS bdy " \
-              "INNER JOIN {1}.%s_%s AS tab ON bdy.id = tab.{2} " \
-              "WHERE bdy.geom && ST_MakeEnvelope(%s, %s, %s, %s, 4283)" \
+              "INNER JOIN {1}.%s_%s AS tab ON bdy.id = tab.{2} %s " \
+              "WHERE bdy.geom && %s" \
             .format(settings['web_schema'], settings['data_schema'], settings['region_id_field'])
 
-        sql = pg_cur.mogrify(sql_template, (AsIs(stat_id), AsIs(stat_id), AsIs(stat_id), AsIs(display_zoom),
-                                            AsIs(boundary_name), AsIs(boundary_name), AsIs(table_id), AsIs(map_left),
-                                            AsIs(map_bottom), AsIs(map_right), AsIs(map_top)))
+        sql = pg_cur.mogrify(sql_template, (AsIs(stat_id), AsIs(stat_id), AsIs(stat_id), AsIs(change_select),
+                                            AsIs(geom_column), AsIs(boundary_name), AsIs(boundary_name),
+                                            AsIs(table_id), AsIs(change_join), AsIs(envelope_sql)))
 
         try:
             # yes, this is ridiculous - if someone can find a shorthand way of doing this then great!
             pg_cur.execute(sql)
+        except psycopg2.extensions.QueryCanceledError:
+            return get_cancelled_response(query)
         except psycopg2.Error:
             return "I can't SELECT:<br/><br/>" + str(sql)
 
@@ -277,6 +598,13 @@ def get_data():
     # output is the main content, row_output is the content from each record returned
     output_dict = dict()
     output_dict["type"] = "FeatureCollection"
+    output_dict["boundary"] = boundary_name
+    output_dict["min"] = min_val
+    output_dict["zoom"] = geometry_zoom
+
+    # the refined geometries have to fit in one /get-geometry request
+    if refine_zoom is not None and len(rows) <= max_geometry_ids:
+        output_dict["refine"] = refine_zoom
 
     i = 0
     feature_array = list()
@@ -291,7 +619,7 @@ def get_data():
         # For each field returned, assemble the feature and properties dictionaries
         for col in col_names:
             if col == 'geometry':
-                feature_dict["geometry"] = ast.literal_eval(str(row[col]))
+                feature_dict["geometry"] = get_geometry_output(row[col])
             elif col == 'id':
                 feature_dict["id"] = row[col]
             else:
@@ -313,6 +641,694 @@ def get_data():
     return Response(json.dumps(output_dict), mimetype='application/json')
 
 
+def get_geometry_output(value):
+    # GeoJSON geometry from a display table's stored geometry
+    if settings['geometry_format'] == "twkb":
+        return twkb.to_geojson(value)
+    else:
+        return ast.literal_eval(str(value))
+
+
+@app.route("/get-geometry", methods=['POST'])
+def get_geometry():
+    """
+    Get the display geometries of a list of boundaries at a zoom level, e.g. to refine the simplified boundaries
+    from a progressive /get-data response.
+    Takes a JSON body with the boundary (b), zoom level (z), ids and optionally the client id (c) & request
+    generation (g) of the map data request it refines.
+    """
+    start_time = datetime.now()
+
+    params = request.get_json(silent=True) or dict()
+
+    boundary_name = params.get("b")
+    ids = params.get("ids")
+
+    try:
+        zoom_level = int(params.get("z"))
+    except (TypeError, ValueError):
+        return get_error_response("Invalid zoom level : {0}".format(params.get("z")), 400)
+
+    if boundary_name not in web_boundaries:
+        return get_error_response("Invalid boundary : {0}".format(boundary_name), 400)
+
+    if not isinstance(ids, list) or len(ids) == 0 or len(ids) > max_geometry_ids:
+        return get_error_response("Invalid list of ids", 400)
+
+    # optional request generation - must be an integer, like on /get-data
+    generation = params.get("g")
+
+    if generation is not None:
+        try:
+            generation = int(generation)
+        except (TypeError, ValueError):
+            return get_error_response("Invalid request generation : {0}".format(generation), 400)
+
+    region_ids = [str(region_id) for region_id in ids]
+
+    # display geometries are only available for zoom levels 4 to 17
+    geometry_zoom = min(max(zoom_level, 4), 17)
+
+    client_socket = cancellation.get_client_socket(request.environ)
+
+    with get_db_cursor() as pg_cur, \
+            cancellation.cancellable_query(pg_cur.connection, params.get("c"), generation, client_socket) as query:
+        if query.cancelled_reason is not None:
+            return get_error_response(query.cancelled_reason, 409)
+
+        if settings['statement_timeout'] > 0:
+            pg_cur.execute("SET LOCAL statement_timeout = %s", (settings['statement_timeout'],))
+
+        # fall back to more simplified boundaries if the response would be too big - same limits as /get-data
+        try:
+            geometry_zoom = utils.get_budget_zoom_level("{0}.{1}".format(settings['web_schema'], boundary_name),
+                                                        geometry_zoom, None, pg_cur, settings, region_ids)
+        except psycopg2.extensions.QueryCanceledError:
+            return get_cancelled_response(query)
+        except psycopg2.Error:
+            return get_error_response("Unable to estimate geometry size for {0}".format(boundary_name), 500)
+
+        if geometry_zoom is None:
+            return get_error_response("Too much geometry requested", 413)
+
+        sql = "SELECT id, {0} AS geometry FROM {1}.{2} WHERE id = ANY(%s)" \
+            .format(utils.get_geometry_column(geometry_zoom, settings), settings['web_schema'], boundary_name)
+
+        try:
+            pg_cur.execute(sql, (region_ids,))
+        except psycopg2.extensions.QueryCanceledError:
+            return get_cancelled_response(query)
+        except psycopg2.Error:
+            return get_error_response("Unable to get geometry for {0}".format(boundary_name), 500)
+
+        rows = pg_cur.fetchall()
+
+    output_dict = dict()
+    output_dict["boundary"] = boundary_name
+    output_dict["zoom"] = geometry_zoom
+    output_dict["geometries"] = {row["id"]: get_geometry_output(row["geometry"]) for row in rows}
+
+    print("Returned {0} geometries in {1}".format(len(rows), datetime.now() - start_time))
+
+    return Response(json.dumps(output_dict), mimetype='application/json')
+
+
+@app.route("/lookup-points", methods=['POST'])
+def lookup_points():
+    """
+    Find the boundaries a streamed list of points are in, and their stats. The points are CSV (with longitude,
+    latitude & optional id columns) or NDJSON. The results are streamed back in the same format, unless overridden.
+    Querystring parameters:
+        format : 'csv' or 'ndjson' - defaults to csv, unless the content type is NDJSON
+        output : 'csv' or 'ndjson' - defaults to the input format
+        b : comma separated boundaries to look up - defaults to all the loaded ones
+        stats : comma separated stat ids
+        sb : boundary to get the stats for - defaults to sa1
+    """
+    input_format = request.args.get('format')
+
+    if input_format is None:
+        input_format = "ndjson" if "json" in (request.content_type or "") else "csv"
+
+    output_format = request.args.get('output', input_format)
+
+    if input_format not in ("csv", "ndjson") or output_format not in ("csv", "ndjson"):
+        return get_error_response("Invalid format : {0} {1}".format(input_format, output_format), 400)
+
+    raw_boundaries = request.args.get('b')
+    raw_stats = request.args.get('stats')
+    stats_boundary = request.args.get('sb', 'sa1')
+
+    try:
+        boundaries = lookup.get_lookup_boundaries(settings, raw_boundaries.lower().split(",")
+                                                  if raw_boundaries else None)
+    except ValueError as ex:
+        return get_error_response(str(ex), 400)
+
+    # validate the stats against the metadata (they're used as field names)
+    stats = list()
+
+    for stat_id in (raw_stats.lower().split(",") if raw_stats else list()):
+        stat_dict = metadata_catalogue.get_stat(stat_id)
+
+        if stat_dict is None:
+            return get_error_response("Invalid stat : {0}".format(stat_id), 400)
+
+        stats.append((stat_dict["id"], stat_dict["table"]))
+
+    # check the tables are loaded before streaming starts - errors after that can only cut the response off
+    with get_db_connection() as connection:
+        try:
+            if not raw_boundaries:
+                boundaries = lookup.get_loaded_boundaries(connection, boundaries, settings)
+
+            if len(stats) > 0 and stats_boundary not in [boundary_dict["boundary"] for boundary_dict in boundaries]:
+                return get_error_response("Stats boundary isn't one of the boundaries : {0}".format(stats_boundary),
+                                          400)
+
+            missing_tables = lookup.get_missing_tables(connection, boundaries, stats, stats_boundary, settings)
+        except psycopg2.Error:
+            return get_error_response("Unable to check the lookup tables", 500)
+
+    if len(boundaries) == 0:
+        return get_error_response("No boundaries have been loaded", 500)
+
+    if len(missing_tables) > 0:
+        return get_error_response("Tables not loaded : {0}".format(", ".join(missing_tables)), 400)
+
+    columns = lookup.get_output_columns(boundaries, stats)
+
+    points = lookup.read_points(io.TextIOWrapper(request.stream, encoding="utf-8"), input_format)
+
+    # read the first point now, so a bad CSV header or JSON gets an error response
+    try:
+        first_points = [next(points)]
+    except StopIteration:
+        first_points = list()
+    except ValueError as ex:
+        return get_error_response(str(ex), 400)
+
+    points = itertools.chain(first_points, points)
+
+    start_time = datetime.now()
+
+    # the connection is kept until the response has been sent (or the client has gone)
+    response_resources = ExitStack()
+    connection = response_resources.enter_context(get_db_connection())
+
+    row_batches = lookup.lookup_points(connection, points, boundaries, stats, stats_boundary, settings,
+                                       settings['statement_timeout'])
+    response_resources.callback(row_batches.close)
+
+    # look up the first batch now too, so a database error gets an error response instead of a cut off one
+    try:
+        first_batches = list(itertools.islice(row_batches, 1))
+    except psycopg2.extensions.QueryCanceledError:
+        response_resources.close()
+        return get_error_response("Lookup took too long - try fewer points or boundaries", 503)
+    except psycopg2.Error:
+        response_resources.close()
+        return get_error_response("Unable to look up points", 500)
+    except ValueError as ex:
+        response_resources.close()
+        return get_error_response(str(ex), 400)
+
+    def generate():
+        for output in lookup.get_output_lines(itertools.chain(first_batches, row_batches), columns, output_format):
+            yield output
+
+        print("Looked up points in {0}".format(datetime.now() - start_time))
+
+    if output_format == "csv":
+        mimetype = "text/csv"
+    else:
+        mimetype = "application/x-ndjson"
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.call_on_close(response_resources.close)
+
+    return response
+
+
+# the boundary whose data tables custom area stats are estimated from
+summary_boundary = "sa1"
+
+
+@app.route("/summarise", methods=['POST'])
+def summarise():
+    """
+    Estimate the stats for a custom area (e.g. a trade area or drive time zone) from the SA1s it covers.
+    Takes a JSON body with a GeoJSON polygon geometry (or feature) and a list of stat ids.
+    The meshblocks with their point inside the area only decide how much of each SA1 is in it - each SA1's stats are
+    split by area (its people are assumed to be spread evenly over its area, there are no meshblock counts). Counts
+    are added up, medians & averages are averaged weighted by population.
+    """
+    start_time = datetime.now()
+
+    params = request.get_json(silent=True) or dict()
+
+    geometry = params.get("geometry")
+
+    if isinstance(geometry, dict) and geometry.get("type") == "Feature":
+        geometry = geometry.get("geometry")
+
+    if not isinstance(geometry, dict) or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+        return get_error_response("A GeoJSON Polygon or MultiPolygon geometry is needed", 400)
+
+    # validate the stats against the metadata (they're used as field names)
+    stat_dicts = list()
+
+    for stat_id in params.get("stats") or list():
+        stat_dict = metadata_catalogue.get_stat(str(stat_id))
+
+        if stat_dict is None:
+            return get_error_response("Invalid stat : {0}".format(stat_id), 400)
+
+        stat_dicts.append(stat_dict)
+
+    geometry_json = json.dumps(geometry, sort_keys=True)
+    geometry_key = hashlib.sha1(geometry_json.encode("utf-8")).hexdigest()
+
+    response_key = "/summarise?{0}&stats={1}".format(geometry_key, ",".join([stat_dict["id"]
+                                                                             for stat_dict in stat_dicts]))
+    body = response_cache.get(response_key)
+
+    if body is not None:
+        return Response(body, mimetype='application/json')
+
+    with get_db_cursor() as pg_cur:
+        if settings['statement_timeout'] > 0:
+            pg_cur.execute("SET LOCAL statement_timeout = %s", (settings['statement_timeout'],))
+
+        try:
+            parts = get_summary_parts(geometry_key, geometry_json, pg_cur)
+            summary_dict = get_summary(parts, stat_dicts, pg_cur)
+        except psycopg2.extensions.QueryCanceledError:
+            return get_error_response("Custom area query timed out - try a smaller area", 503)
+        except psycopg2.DataError:
+            return get_error_response("Invalid GeoJSON geometry", 400)
+        except psycopg2.Error:
+            return get_error_response("Unable to summarise area - are the meshblock tables loaded?", 500)
+
+    print("Summarised {0} meshblocks in {1}".format(summary_dict["meshblocks"], datetime.now() - start_time))
+
+    body = json.dumps(summary_dict).encode("utf-8")
+    response_cache.put(response_key, body, len(body))
+
+    return Response(body, mimetype='application/json')
+
+
+def get_summary_parts(geometry_key, geometry_json, pg_cur):
+    """
+    Get the SA1s that have meshblocks inside an area, with the number and area of those meshblocks. Cached, so
+    summarising the same area again (e.g. for other stats) doesn't need the spatial query.
+    """
+    parts_key = "/summarise-parts?{0}".format(geometry_key)
+    parts_json = response_cache.get(parts_key)
+
+    if parts_json is not None:
+        return json.loads(parts_json.decode("utf-8"))
+
+    sql = "SELECT cor.id, count(*) AS meshblocks, SUM(mb.area) AS area FROM {0}.meshblocks AS mb " \
+          "INNER JOIN {0}.mb_boundaries AS cor ON cor.mb_id = mb.id AND cor.boundary = %s " \
+          "WHERE ST_Intersects(mb.geom, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4283)) " \
+          "GROUP BY cor.id".format(settings['web_schema'])
+
+    pg_cur.execute(sql, (summary_boundary, geometry_json))
+    parts = [[row["id"], row["meshblocks"], row["area"]] for row in pg_cur.fetchall()]
+
+    parts_json = json.dumps(parts).encode("utf-8")
+    response_cache.put(parts_key, parts_json, len(parts_json))
+
+    return parts
+
+
+def get_summary(parts, stat_dicts, pg_cur):
+    # each SA1's share of its stats is the share of its area in the custom area (by area only - not population)
+    select_list = ["count(*) AS regions", "SUM(parts.area) AS area",
+                   "SUM(parts.population * parts.share) AS population"]
+    join_list = list()
+    table_aliases = dict()
+
+    for stat_dict in stat_dicts:
+        if stat_dict["table"] not in table_aliases:
+            table_aliases[stat_dict["table"]] = "tab_{0}".format(len(table_aliases))
+            join_list.append("LEFT JOIN {0}.{1}_{2} AS {3} ON {3}.{4} = parts.id"
+                             .format(settings['data_schema'], summary_boundary, stat_dict["table"],
+                                     table_aliases[stat_dict["table"]], settings['region_id_field']))
+
+        stat_field = "{0}.{1}".format(table_aliases[stat_dict["table"]], stat_dict["id"])
+
+        if is_summary_average(stat_dict):
+            select_list.append("SUM({0} * parts.population * parts.share) / "
+                               "NULLIF(SUM(CASE WHEN {0} IS NOT NULL THEN parts.population * parts.share END), 0) "
+                               "AS {1}".format(stat_field, stat_dict["id"]))
+        else:
+            select_list.append("SUM({0} * parts.share) AS {1}".format(stat_field, stat_dict["id"]))
+
+    sql = "SELECT {0} FROM (" \
+          "SELECT bdy.id, part.area, bdy.population, LEAST(part.area / NULLIF(bdy.area, 0), 1.0) AS share " \
+          "FROM unnest(%s::text[], %s::double precision[]) AS part(id, area) " \
+          "INNER JOIN {1}.{2} AS bdy ON bdy.id = part.id" \
+          ") AS parts {3}" \
+        .format(", ".join(select_list), settings['web_schema'], summary_boundary, " ".join(join_list))
+
+    pg_cur.execute(sql, ([part[0] for part in parts], [part[2] for part in parts]))
+    row = pg_cur.fetchone()
+
+    summary_dict = dict()
+    summary_dict["type"] = "Summary"
+    summary_dict["boundary"] = summary_boundary
+    summary_dict["regions"] = row["regions"]
+    summary_dict["meshblocks"] = sum([part[1] for part in parts])
+    summary_dict["area"] = row["area"]
+    summary_dict["population"] = row["population"]
+    summary_dict["stats"] = list()
+
+    for stat_dict in stat_dicts:
+        output_dict = metadata_catalogue.get_stat_output(stat_dict["id"])
+        output_dict["value"] = row[stat_dict["id"]]
+
+        if stat_dict["maptype"] == "percent" and row[stat_dict["id"]] is not None and row["population"]:
+            output_dict["percent"] = row[stat_dict["id"]] / row["population"] * 100.0
+
+        summary_dict["stats"].append(output_dict)
+
+    return summary_dict
+
+
+def is_summary_average(stat_dict):
+    # medians & averages can't be added up
+    long_id = stat_dict["long_id"].lower()
+
+    return "median" in long_id or "average" in long_id
+
+
+@app.route("/get-related-regions")
+@cached_response
+def get_related_regions():
+    """
+    Drill down (or up) from a region to the regions of another boundary type that overlap it, using the boundary
+    concordance - e.g. the SA2s in an LGA. Optionally gets those regions' stats & estimates the region's stats from
+    them (counts weighted by how much of each region overlaps it, medians & averages by population too).
+    Querystring parameters:
+        b : the region's boundary
+        id : the region's id
+        rb : the related regions' boundary
+        stats : comma separated stat ids
+        ms : minimum share of a related region's population that overlaps the region - defaults to 0
+    """
+    start_time = datetime.now()
+
+    boundary_name = request.args.get('b')
+    region_id = request.args.get('id')
+    related_boundary_name = request.args.get('rb')
+    raw_stats = request.args.get('stats')
+
+    try:
+        min_share = float(request.args.get('ms', 0.0))
+    except ValueError:
+        return get_error_response("Invalid minimum share : {0}".format(request.args.get('ms')), 400)
+
+    for name in (boundary_name, related_boundary_name):
+        if name not in web_boundaries:
+            return get_error_response("Invalid boundary : {0}".format(name), 400)
+
+    if region_id is None:
+        return get_error_response("No region id", 400)
+
+    stat_dicts = list()
+
+    for stat_id in (raw_stats.lower().split(",") if raw_stats else list()):
+        stat_dict = metadata_catalogue.get_stat(stat_id)
+
+        if stat_dict is None:
+            return get_error_response("Invalid stat : {0}".format(stat_id), 400)
+
+        stat_dicts.append(stat_dict)
+
+    # the related regions' names & stats, and how much of each is in the region (and vice versa)
+    select_list = ["con.to_id AS id", "bdy.name", "con.area", "con.population", "con.from_area_share",
+                   "con.from_population_share", "con.to_area_share", "con.to_population_share"]
+    join_list = list()
+    table_aliases = dict()
+
+    for stat_dict in stat_dicts:
+        if stat_dict["table"] not in table_aliases:
+            table_aliases[stat_dict["table"]] = "tab_{0}".format(len(table_aliases))
+            join_list.append("LEFT JOIN {0}.{1}_{2} AS {3} ON {3}.{4} = con.to_id"
+                             .format(settings['data_schema'], related_boundary_name, stat_dict["table"],
+                                     table_aliases[stat_dict["table"]], settings['region_id_field']))
+
+        select_list.append("{0}.{1}".format(table_aliases[stat_dict["table"]], stat_dict["id"]))
+
+    sql = "SELECT {0} FROM {1}.boundary_concordance AS con " \
+          "LEFT JOIN {1}.{2} AS bdy ON bdy.id = con.to_id {3} " \
+          "WHERE con.from_boundary = %s AND con.from_id = %s AND con.to_boundary = %s " \
+          "AND COALESCE(con.to_population_share, con.to_area_share, 0) >= %s " \
+          "ORDER BY con.population DESC" \
+        .format(", ".join(select_list), settings['web_schema'], related_boundary_name, " ".join(join_list))
+
+    with get_db_cursor() as pg_cur:
+        if settings['statement_timeout'] > 0:
+            pg_cur.execute("SET LOCAL statement_timeout = %s", (settings['statement_timeout'],))
+
+        try:
+            pg_cur.execute(sql, (boundary_name, region_id, related_boundary_name, min_share))
+        except psycopg2.extensions.QueryCanceledError:
+            return get_error_response("Related regions query timed out", 503)
+        except psycopg2.Error:
+            return get_error_response("Unable to get related regions - is the boundary concordance loaded?", 500)
+
+        rows = pg_cur.fetchall()
+
+    output_dict = dict()
+    output_dict["type"] = "RelatedRegions"
+    output_dict["boundary"] = boundary_name
+    output_dict["id"] = region_id
+    output_dict["related_boundary"] = related_boundary_name
+    output_dict["regions"] = list()
+
+    for row in rows:
+        region_dict = {field: row[field] for field in ["id", "name", "area", "population", "from_area_share",
+                                                       "from_population_share", "to_area_share",
+                                                       "to_population_share"]}
+        region_dict["stats"] = {stat_dict["id"]: row[stat_dict["id"]] for stat_dict in stat_dicts}
+        output_dict["regions"].append(region_dict)
+
+    output_dict["estimates"] = get_related_estimates(rows, stat_dicts)
+
+    print("Got {0} related regions in {1}".format(len(rows), datetime.now() - start_time))
+
+    return Response(json.dumps(output_dict), mimetype='application/json')
+
+
+# the region's stats estimated from the related regions' stats
+def get_related_estimates(rows, stat_dicts):
+    estimates = dict()
+
+    for stat_dict in stat_dicts:
+        stat_id = stat_dict["id"]
+        rows_with_values = [row for row in rows if row[stat_id] is not None]
+
+        if is_summary_average(stat_dict):
+            weight = sum([row["population"] for row in rows_with_values])
+            estimates[stat_id] = sum([row[stat_id] * row["population"]
+                                      for row in rows_with_values]) / weight if weight > 0 else None
+        else:
+            estimates[stat_id] = sum([row[stat_id] * (row["to_population_share"] or 0.0) for row in rows_with_values])
+
+    return estimates
+
+
+@app.route("/get-region/<boundary_name>/<region_id>")
+@cached_response
+@single_flight
+def get_region(boundary_name, region_id):
+    """
+    Get a region's name, area, population & stats - all of them, or the comma separated stat ids in stats.
+    Reads the region's precomputed profile, so it's one index lookup however many tables the stats are in.
+    """
+    start_time = datetime.now()
+
+    if boundary_name not in web_boundaries:
+        return get_error_response("Invalid boundary : {0}".format(boundary_name), 400)
+
+    raw_stats = request.args.get('stats')
+    stat_ids = list()
+
+    for stat_id in (raw_stats.lower().split(",") if raw_stats else list()):
+        if metadata_catalogue.get_stat(stat_id) is None:
+            return get_error_response("Invalid stat : {0}".format(stat_id), 400)
+
+        stat_ids.append(stat_id)
+
+    # psycopg2 returns the jsonb profile as a dict
+    if len(stat_ids) > 0:
+        profile_sql = "(SELECT jsonb_object_agg(key, value) FROM jsonb_each(pro.profile) " \
+                      "WHERE key = ANY(%s)) AS profile"
+        params = [stat_ids]
+    else:
+        profile_sql = "pro.profile"
+        params = list()
+
+    sql = "SELECT bdy.name, bdy.area, bdy.population, {0} FROM {1}.region_profiles AS pro " \
+          "INNER JOIN {1}.{2} AS bdy ON bdy.id = pro.id " \
+          "WHERE pro.boundary = %s AND pro.id = %s".format(profile_sql, settings['web_schema'], boundary_name)
+
+    with get_db_cursor() as pg_cur:
+        if settings['statement_timeout'] > 0:
+            pg_cur.execute("SET LOCAL statement_timeout = %s", (settings['statement_timeout'],))
+
+        try:
+            pg_cur.execute(sql, params + [boundary_name, region_id])
+        except psycopg2.Error:
+            return get_error_response("Unable to get region - are the region profiles loaded?", 500)
+
+        row = pg_cur.fetchone()
+
+    if row is None:
+        return get_error_response("Region not found : {0} {1}".format(boundary_name, region_id), 404)
+
+    output_dict = dict()
+    output_dict["type"] = "Region"
+    output_dict["boundary"] = boundary_name
+    output_dict["id"] = region_id
+    output_dict["name"] = row["name"]
+    output_dict["area"] = row["area"]
+    output_dict["population"] = row["population"]
+    output_dict["stats"] = row["profile"] or dict()
+
+    print("Got region {0} {1} in {2}".format(boundary_name, region_id, datetime.now() - start_time))
+
+    return Response(json.dumps(output_dict), mimetype='application/json')
+
+
+# exported files are kept for good (the data never changes) and served with support for range requests, so big
+# downloads can be resumed
+export_directory = os.path.join(settings['cache_directory'], "exports")
+
+# one lock per export file, so concurrent requests for the same export only create it once
+export_locks = dict()
+export_locks_lock = threading.Lock()
+
+
+@app.route("/export")
+def export_boundary():
+    """
+    Download the stats of every region of a boundary type, and optionally their boundaries.
+    Querystring parameters:
+        b : the boundary
+        stats : comma separated stat ids
+        format : 'csv', 'parquet' or 'gpkg' - defaults to csv
+        z : zoom level (4 to 17) of the display boundaries to include - defaults to none
+    """
+    boundary_name = request.args.get('b')
+    raw_stats = request.args.get('stats')
+    output_format = request.args.get('format', 'csv')
+
+    if boundary_name not in web_boundaries:
+        return get_error_response("Invalid boundary : {0}".format(boundary_name), 400)
+
+    if output_format not in export.export_formats:
+        return get_error_response("Invalid format : {0}".format(output_format), 400)
+
+    if request.args.get('z') is not None:
+        try:
+            geometry_column = utils.get_geometry_column(min(max(int(request.args.get('z')), 4), 17), settings)
+        except ValueError:
+            return get_error_response("Invalid zoom level : {0}".format(request.args.get('z')), 400)
+    else:
+        geometry_column = None
+
+    stats = list()
+
+    for stat_id in (raw_stats.lower().split(",") if raw_stats else list()):
+        stat_dict = metadata_catalogue.get_stat(stat_id)
+
+        if stat_dict is None:
+            return get_error_response("Invalid stat : {0}".format(stat_id), 400)
+
+        stats.append((stat_dict["id"], stat_dict["table"]))
+
+    key = "{0}|{1}|{2}|{3}|{4}|{5}".format(settings['web_schema'], settings['data_schema'], boundary_name,
+                                           ",".join([stat_id for stat_id, table in stats]), geometry_column,
+                                           output_format)
+    file_name = "{0}_{1}.{2}".format(boundary_name, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],
+                                     output_format)
+    file_path = os.path.join(export_directory, file_name)
+
+    with export_locks_lock:
+        export_lock = export_locks.setdefault(file_path, threading.Lock())
+
+    with export_lock:
+        # files planted in a directory someone else can write to would be served
+        try:
+            utils.get_cache_directory(settings, "exports")
+        except OSError as ex:
+            print("Unable to use the export directory : {0}".format(ex))
+            return get_error_response("Unable to export {0}".format(boundary_name), 500)
+
+        if not os.path.isfile(file_path):
+            start_time = datetime.now()
+
+            try:
+                with get_db_connection() as connection:
+                    num_rows = export.export_boundary(connection, file_path, boundary_name, stats, geometry_column,
+                                                      output_format, settings)
+            except psycopg2.Error:
+                return get_error_response("Unable to export {0}".format(boundary_name), 500)
+            except ImportError as ex:
+                return get_error_response("Unable to export {0} : {1}".format(output_format, ex), 501)
+
+            print("Exported {0} {1} rows in {2}".format(num_rows, boundary_name, datetime.now() - start_time))
+
+    return send_file(file_path, mimetype=export.export_formats[output_format], as_attachment=True,
+                     download_name="{0}.{1}".format(boundary_name, output_format), conditional=True)
+
+
+@app.route("/search-stats")
+def search_stats():
+    # Get parameters from querystring
+    query = request.args.get('q', '')
+
+    try:
+        limit = int(request.args.get('limit'))
+    except TypeError:
+        limit = 20
+
+    response_dict = dict()
+    response_dict["type"] = "StatsSearch"
+    response_dict["stats"] = metadata_catalogue.search(query, limit)
+
+    return Response(json.dumps(response_dict), mimetype='application/json')
+
+
+@app.route("/get-server-stats")
+def get_server_stats():
+    stats_dict = dict()
+    stats_dict["single_flight"] = flights.get_stats()
+    stats_dict["response_cache"] = response_cache.get_stats()
+
+    return Response(json.dumps(stats_dict), mimetype='application/json')
+
+
+def get_warm_up_paths():
+    """
+    The requests to warm the caches with - the metadata for the map's default stats, the map views of the bookmarked
+    places for those stats and the most requested map views in the access log.
+    """
+    if settings["census_year"] == "2011":
+        stat_ids = ["b3", "b1", "b2"]
+    else:
+        stat_ids = ["g3", "g1", "g2"]
+
+    stats = [(stat_id, metadata_catalogue.get_stat(stat_id)["table"]) for stat_id in stat_ids
+             if metadata_catalogue.get_stat(stat_id) is not None]
+
+    paths = ["/get-metadata?n=7&stats=" + ",".join([stat_id for stat_id, table_id in stats])]
+
+    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "static", "bookmarks.json"), "r") as f:
+        bookmarks = json.load(f)
+
+    paths.extend(warmup.get_bookmark_paths(bookmarks, stats, 4, 16, utils.get_viewport_bbox))
+
+    if settings['warm_cache_log'] is not None:
+        paths.extend(warmup.get_log_paths(settings['warm_cache_log'], settings['warm_cache_views']))
+
+    return paths
+
+
+def get_warm_up_response(path):
+    return app.test_client().get(path).status_code
+
+
+# warm up in the process that serves requests (not the dev server's reloader process)
+if settings['warm_cache'] and (__name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") is not None):
+    warmup.start(get_warm_up_paths, get_warm_up_response, settings['warm_cache_threads'],
+                 settings['warm_cache_interval'])
+
+
 if __name__ == '__main__':
     # import threading, webbrowser
     # # url = "http://127.0.0.1:8081?stats=B2712,B2772,B2775,B2778,B2781,B2793"
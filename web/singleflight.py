@@ -0,0 +1,102 @@
+
+# coalesces concurrent identical requests - the first caller runs the work and the others wait for its result
+#
+# e.g. when a link to the map is shared, hundreds of clients ask for the same metadata & first map view at once.
+# only one of them needs to hit the database
+
+import threading
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shareable = True
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, function, is_shareable=None):
+        """
+        Run function() and return its result, unless a call with the same key is already running.
+        In that case wait for it and return (or raise) its result instead - unless is_shareable(result) says the
+        result only applies to the caller that ran it (e.g. it was cancelled). The waiters then try again.
+        """
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+
+                if call is not None:
+                    call.waiters += 1
+                    self.coalesced += 1
+                    is_leader = False
+                else:
+                    call = Call()
+                    self.calls[key] = call
+                    self.executed += 1
+                    is_leader = True
+
+            if is_leader:
+                break
+
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            if call.shareable:
+                return call.result
+
+        try:
+            call.result = function()
+            call.shareable = is_shareable is None or is_shareable(call.result)
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self.lock:
+                # a closed call has already been removed - the key may have a new call by now
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+
+            call.done.set()
+
+        return call.result
+
+    def has_waiters(self, key):
+        with self.lock:
+            call = self.calls.get(key)
+
+            return call is not None and call.waiters > 0
+
+    def get_call(self, key):
+        with self.lock:
+            return self.calls.get(key)
+
+    def check_shared(self, key, call):
+        """
+        Return whether other callers are waiting on a running call. If not, close it so no more can join - the next
+        caller with the same key starts a new call. Both in one step, so nothing can join between them.
+        """
+        with self.lock:
+            if call is None:
+                return False
+
+            if call.waiters > 0:
+                return True
+
+            if self.calls.get(key) is call:
+                del self.calls[key]
+
+            return False
+
+    def get_stats(self):
+        with self.lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self.calls)}
@@ -3,6 +3,7 @@
 var bdyNamesUrl = "../get-bdy-names";
 var metadataUrl = "../get-metadata";
 var dataUrl = "../get-data";
+var geometryUrl = "../get-geometry";
 
 var map;
 var info;
@@ -20,6 +21,13 @@ var currentStat;
 var boundaryZooms;
 var currentStats;
 var boundaryOverride = "";
+var changeType = ""; // "change" or "change_percent" to map the change since the previous census
+
+// identifies this map's requests, so the server can cancel the ones that have been superseded
+var clientId = Math.random().toString(36).substring(2);
+var requestGeneration = 0;
+var dataRequest;
+var geometryRequest;
 
 var currentBoundary = "";
 var currentBoundaryMin = 7;
@@ -62,6 +70,13 @@ if (queryObj["b"] !== undefined) {
     boundaryOverride = queryObj["b"].toLowerCase();
 }
 
+// map the change since the previous census instead of the stat (ch=1), or the percent change (ch=percent)
+if (queryObj["ch"] === "1") {
+    changeType = "change";
+} else if (queryObj["ch"] === "percent") {
+    changeType = "change_percent";
+}
+
 // start zoom level
 if (!queryObj["z"]) {
     currentZoomLevel = 11;
@@ -164,7 +179,20 @@ function init() {
             if (props.population === 0) {
                 infoStr = "<h3>" + name + "</h3><span style='font-size: 1.1em; font-weight: bold'>no population";
             } else {
-                if (currentStat.maptype === "values") {
+                if (isChangeMap()) {
+                    infoStr = "<h3>" + name + "</h3>" +
+                        "<span style='font-weight: bold'>" + currentStat.description + ": " + props[currentStatId].toLocaleString(["en-AU"]) + "</span><br/>";
+
+                    if (props.change === null) {
+                        infoStr += "no previous census data";
+                    } else {
+                        infoStr += "Change: " + props.change.toLocaleString(["en-AU"]);
+
+                        if (props.change_percent !== null) {
+                            infoStr += " (" + props.change_percent.toFixed(1).toLocaleString(["en-AU"]) + "%)";
+                        }
+                    }
+                } else if (currentStat.maptype === "values") {
                     infoStr = "<h3>" + name + "</h3>" +
                         "<span style='font-weight: bold'>" + currentStat.type + ": " + props[currentStatId].toLocaleString(["en-AU"]) + "</span><br/>" +
                         "Persons: " + props.population.toLocaleString(["en-AU"]);
@@ -193,9 +221,10 @@ function init() {
         return this._div;
     };
     legend.update = function () {
-        var len = currentStat[currentBoundary].length,
-            min = stringNumber(currentStat[currentBoundary][0]),
-            max = stringNumber(currentStat[currentBoundary][len - 1]);
+        var classes = getClasses(),
+            len = classes.length,
+            min = stringNumber(classes[0]),
+            max = stringNumber(classes[len - 1]);
 
         this._div.innerHTML = "<div><table><tr><td>" + min + "</td><td class='colours' style='width: 15.0em'></td><td>" + max + "</td></tr></table></div>";
     };
@@ -238,7 +267,7 @@ function init() {
     // and get stats metadata, including map theme classes
     $.when(
         $.getJSON(bdyNamesUrl + "?min=" +  + minZoom.toString() + "&max=" + maxZoom.toString()),
-        $.getJSON(metadataUrl + "?n=" +  + numClasses.toString() + "&stats=" + statsArray.join())
+        $.getJSON(metadataUrl + "?n=" +  + numClasses.toString() + "&stats=" + statsArray.join() + (changeType ? "&ch=1" : ""))
     ).done(function(bdysResponse, metadataResponse) {
         if (!boundaryOverride){
             boundaryZooms = bdysResponse[0];
@@ -311,10 +340,25 @@ function getCurrentStatMetadata() {
     }
 }
 
+// the change classes are null for boundaries without the previous census' data - they're mapped as usual
+function isChangeMap() {
+    return changeType !== "" && currentStat[changeType] !== undefined && currentStat[changeType][currentBoundary] !== null;
+}
+
+function getClasses() {
+    if (isChangeMap()) {
+        return currentStat[changeType][currentBoundary];
+    } else {
+        return currentStat[currentBoundary];
+    }
+}
+
 function stringNumber(val) {
     var numString = "";
 
-    if (currentStat.maptype === "values") {
+    if (isChangeMap() && changeType === "change_percent") {
+        numString = Math.round(val).toString() + "%";
+    } else if (currentStat.maptype === "values" || isChangeMap()) {
         // format number to nearest 100"s or 1000"s
         var len = val.toString().length - 2;
 
@@ -372,19 +416,49 @@ function getData() {
     ua.push(currentStat.id);
     ua.push("&t=");
     ua.push(currentStat.table);
-    ua.push("&b=");
-    ua.push(currentBoundary);
+    // the server chooses the boundary that suits the map view, unless it's been overridden
+    if (boundaryOverride) {
+        ua.push("&b=");
+        ua.push(boundaryOverride);
+    }
     ua.push("&m=");
     ua.push(currentStat.maptype);
     ua.push("&z=");
     ua.push((currentZoomLevel).toString());
+    // get simplified boundaries first, then the detailed ones
+    ua.push("&p=1");
+    // and the change since the previous census
+    if (isChangeMap()) {
+        ua.push("&ch=1");
+    }
+
+    requestGeneration += 1;
+    ua.push("&c=");
+    ua.push(clientId);
+    ua.push("&g=");
+    ua.push(requestGeneration.toString());
 
     var requestString = ua.join("");
 
 //    console.log(requestString);
 
+    // abort the previous request if it hasn't come back yet - the map has moved on
+    if (dataRequest !== undefined) {
+        dataRequest.abort();
+    }
+
+    if (geometryRequest !== undefined) {
+        geometryRequest.abort();
+    }
+
     //Fire off AJAX request
-    $.getJSON(requestString, gotData);
+    dataRequest = $.getJSON(requestString, gotData)
+        .fail(function (jqXHR) {
+            // e.g. too much data requested or the query timed out
+            if (jqXHR.responseJSON !== undefined && jqXHR.responseJSON.error !== undefined) {
+                console.log(jqXHR.responseJSON.error);
+            }
+        });
 }
 
 function gotData(json) {
@@ -392,6 +466,13 @@ function gotData(json) {
     console.time("parsed GeoJSON");
 
     if (json !== null) {
+        // update the boundary and legend with the boundary the server chose
+        if (json.boundary !== undefined && json.boundary !== currentBoundary) {
+            currentBoundary = json.boundary;
+            currentBoundaryMin = json.min;
+            legend.update();
+        }
+
         if(geojsonLayer !== undefined) {
             geojsonLayer.clearLayers();
         }
@@ -400,6 +481,11 @@ function gotData(json) {
             style : style,
             onEachFeature : onEachFeature
         }).addTo(map);
+
+        // the boundaries are simplified - get the detailed ones for the same ids
+        if (json.refine !== undefined) {
+            getRefinedGeometry(json, requestGeneration);
+        }
     } else {
         alert("No data returned!")
     }
@@ -407,11 +493,62 @@ function gotData(json) {
     console.timeEnd("parsed GeoJSON");
 }
 
+function getRefinedGeometry(json, generation) {
+    var ids = [];
+
+    for (var i = 0; i < json.features.length; i++) {
+        ids.push(json.features[i].id);
+    }
+
+    if (ids.length === 0) {
+        return;
+    }
+
+    geometryRequest = $.ajax({
+        url : geometryUrl,
+        type : "POST",
+        contentType : "application/json",
+        dataType : "json",
+        data : JSON.stringify({ b : json.boundary, z : json.refine, ids : ids, c : clientId, g : generation })
+    }).done(function (geometryJson) {
+        // ignore it if the map has moved on
+        if (generation !== requestGeneration) {
+            return;
+        }
+
+        console.time("refined GeoJSON");
+
+        geojsonLayer.eachLayer(function (layer) {
+            var geometry = geometryJson.geometries[layer.feature.id];
+
+            if (geometry !== undefined) {
+                layer.feature.geometry = geometry;
+                layer.setLatLngs(L.GeoJSON.geometryToLayer(layer.feature).getLatLngs());
+            }
+        });
+
+        console.timeEnd("refined GeoJSON");
+    });
+}
+
 function style(feature) {
     var renderVal;
     var props = feature.properties;
 
-    if (currentStat.maptype === "values") {
+    if (isChangeMap()) {
+        // no previous census data
+        if (props[changeType] === null) {
+            return {
+                weight : 2,
+                opacity : 1.0,
+                color : "#422",
+                fillOpacity : 1.0,
+                fillColor : "#422"
+            };
+        }
+
+        renderVal = parseInt(props[changeType]);
+    } else if (currentStat.maptype === "values") {
         renderVal = parseInt(props[currentStatId]);
     } else {
         renderVal = parseInt(props.percent);
@@ -430,7 +567,7 @@ function style(feature) {
 
 // get color depending on ratio of count versus max value
 function getColor(d, pop) {
-    var classes = currentStat[currentBoundary];
+    var classes = getClasses();
 
     // show generic gray if no population
     if (pop === 0){
@@ -0,0 +1,153 @@
+
+# decodes Tiny Well-known Binary (TWKB) geometries into GeoJSON geometry dictionaries
+# the format is described here: https://github.com/TWKB/Specification/blob/master/twkb.md
+#
+# coordinates are stored as integers quantized to the precision they were encoded with (e.g. by PostGIS ST_AsTWKB),
+# which makes the display tables much smaller than jsonb GeoJSON and lets the map server decode them at the edge
+
+geojson_types = {1: "Point",
+                 2: "LineString",
+                 3: "Polygon",
+                 4: "MultiPoint",
+                 5: "MultiLineString",
+                 6: "MultiPolygon"}
+
+
+def to_geojson(twkb):
+    data = bytes(twkb)
+
+    # header byte: geometry type in the low 4 bits, zigzag encoded decimal precision in the high 4 bits
+    geom_type = data[0] & 0x0F
+    precision = unzigzag(data[0] >> 4)
+
+    if geom_type not in geojson_types:
+        raise ValueError("Unsupported TWKB geometry type: {0}".format(geom_type))
+
+    # metadata byte: flags for bbox, size, id list, extended dimensions and empty geometries
+    metadata = data[1]
+    position = 2
+
+    has_bbox = metadata & 0x01
+    has_size = metadata & 0x02
+    has_ids = metadata & 0x04
+    is_empty = metadata & 0x10
+
+    # get the number of dimensions and the scale factor for each of them (Z & M have their own precisions)
+    scales = [10.0 ** precision, 10.0 ** precision]
+    has_z = False
+
+    if metadata & 0x08:
+        extended = data[position]
+        position += 1
+
+        if extended & 0x01:
+            has_z = True
+            scales.append(10.0 ** ((extended >> 2) & 0x07))
+        if extended & 0x02:
+            scales.append(10.0 ** ((extended >> 5) & 0x07))
+
+    geometry = dict()
+    geometry["type"] = geojson_types[geom_type]
+
+    if is_empty:
+        geometry["coordinates"] = list()
+        return geometry
+
+    # everything after the header is a varint - decode them all in one pass for speed
+    values = read_varints(data, position)
+    index = 0
+
+    if has_size:
+        index += 1
+    if has_bbox:
+        index += 2 * len(scales)
+
+    # coordinates are deltas from the previous point, across the whole geometry
+    decoder = CoordinateDecoder(values, index, scales, has_z)
+
+    if geom_type == 1:
+        geometry["coordinates"] = decoder.read_points(1)[0]
+    elif geom_type == 2:
+        geometry["coordinates"] = decoder.read_points(decoder.read_count())
+    elif geom_type == 3:
+        geometry["coordinates"] = decoder.read_polygon()
+    else:
+        num_parts = decoder.read_count()
+
+        # skip the id list, the feature ids are already in the display tables
+        if has_ids:
+            decoder.index += num_parts
+
+        if geom_type == 4:
+            geometry["coordinates"] = decoder.read_points(num_parts)
+        elif geom_type == 5:
+            geometry["coordinates"] = [decoder.read_points(decoder.read_count()) for i in range(0, num_parts)]
+        else:
+            geometry["coordinates"] = [decoder.read_polygon() for i in range(0, num_parts)]
+
+    return geometry
+
+
+class CoordinateDecoder:
+    def __init__(self, values, index, scales, has_z):
+        self.values = values
+        self.index = index
+        self.scales = scales
+        self.dims = len(scales)
+
+        # GeoJSON has no measure values, they get dropped
+        if has_z:
+            self.output_dims = 3
+        else:
+            self.output_dims = 2
+
+        self.previous = [0] * self.dims
+
+    def read_count(self):
+        count = self.values[self.index]
+        self.index += 1
+        return count
+
+    def read_points(self, num_points):
+        points = list()
+        values = self.values
+        index = self.index
+
+        for i in range(0, num_points):
+            point = list()
+
+            for dim in range(0, self.dims):
+                self.previous[dim] += unzigzag(values[index])
+                point.append(self.previous[dim] / self.scales[dim])
+                index += 1
+
+            points.append(point[:self.output_dims])
+
+        self.index = index
+
+        return points
+
+    def read_polygon(self):
+        return [self.read_points(self.read_count()) for i in range(0, self.read_count())]
+
+
+def read_varints(data, position):
+    values = list()
+    value = 0
+    shift = 0
+
+    for byte in data[position:]:
+        value |= (byte & 0x7F) << shift
+
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
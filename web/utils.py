@@ -1,18 +1,27 @@
 import argparse
+import hashlib
 import io
 import multiprocessing
+import multiprocessing.util
 import math
 import os
+import numpy
 import platform
 import psycopg2
 import subprocess
 import sys
+import time
 
 from psycopg2.extensions import AsIs
 
 
 # set the command line arguments for the script
 def set_arguments():
+    return get_argument_parser().parse_args()
+
+
+# get the command line argument parser - scripts with their own arguments can add them to it
+def get_argument_parser():
     parser = argparse.ArgumentParser(
         description='A quick way to load the complete GNAF and PSMA Admin Boundaries into Postgres, '
                     'simplified and ready to use as reference data for geocoding, analysis and visualisation.')
@@ -22,6 +31,22 @@ def set_arguments():
         help='Maximum number of parallel processes to use for the data load. (Set it to the number of cores on the '
              'Postgres server minus 2, limit to 12 if 16+ cores - there is minimal benefit beyond 12). Defaults to 3.')
 
+    parser.add_argument(
+        '--adaptive-processes', action='store_true',
+        help='Adjust the number of parallel processes for each stage of the data load between --min-processes and '
+             '--max-processes, based on the throughput achieved and the load on the database.')
+    parser.add_argument(
+        '--min-processes', type=int, default=1,
+        help='Minimum number of parallel processes to use with --adaptive-processes. Defaults to 1.')
+
+    parser.add_argument(
+        '--fast-load', action='store_true',
+        help='Load into unlogged tables and create their primary keys & spatial indexes, and analyse them, at the end '
+             'of the load. Faster, but unlogged tables are emptied if Postgres crashes - see --set-logged.')
+    parser.add_argument(
+        '--set-logged', action='store_true',
+        help='With --fast-load, switch the tables to logged (crash safe) tables at the end of the load.')
+
     # PG Options
     parser.add_argument(
         '--pghost',
@@ -59,6 +84,99 @@ def set_arguments():
         '--web-schema', default='census_' + census_year + '_web',
         help='Schema name to store web optimised boundary tables in. Defaults to \'census_' + census_year + '_web\'.')
 
+    # a previous census load (in its own schemas) to map the changes since
+    parser.add_argument(
+        '--previous-census-year', choices=['2011'],
+        help='Census year of a previous load to map the changes since. Adds the previous census\' stats, matched by '
+             'their long ids & apportioned to this census\' boundaries by meshblock, to the load. The previous load '
+             'must include the meshblock tables.')
+    parser.add_argument(
+        '--previous-data-schema',
+        help='Schema name of the previous census\' data tables. Defaults to \'census_<previous year>_data\'.')
+    parser.add_argument(
+        '--previous-web-schema',
+        help='Schema name of the previous census\' web tables. Defaults to \'census_<previous year>_web\'.')
+
+    # storage format for the web display geometries
+    parser.add_argument(
+        '--geometry-format', default='geojson', choices=['geojson', 'twkb'],
+        help='Storage format for the web optimised boundaries. \'geojson\' stores jsonb GeoJSON, \'twkb\' stores '
+             'compact TWKB binary geometries that are decoded to GeoJSON by the map server. '
+             'The map server must be run with the same value. Defaults to \'geojson\'.')
+
+    # physical ordering of the web and data tables
+    parser.add_argument(
+        '--no-hilbert-order', action='store_true',
+        help='Don\'t physically order the web and data tables by the Hilbert curve key of each region\'s centroid. '
+             'Ordering makes map queries read fewer, contiguous pages but adds a few minutes to the load.')
+
+    # map server options
+    parser.add_argument(
+        '--feature-budget', type=int, default=2000,
+        help='Map server only. Maximum estimated number of boundaries to return for a map view. The server shows the '
+             'finest boundary type that fits within the budget, instead of a fixed boundary type per zoom level. '
+             'Set to 0 to use the fixed zoom levels. Defaults to 2000.')
+
+    parser.add_argument(
+        '--max-response-points', type=int, default=1000000,
+        help='Map server only. Maximum number of boundary vertices to return for a map view. Larger requests get '
+             'more simplified boundaries, or are refused if even the most simplified ones are over the limit. '
+             'Set to 0 for no limit. Defaults to 1000000.')
+    parser.add_argument(
+        '--max-response-bytes', type=int, default=25000000,
+        help='Map server only. Maximum number of bytes of stored boundaries to read for a map view. Works the same '
+             'way as --max-response-points. Set to 0 for no limit. Defaults to 25000000.')
+    parser.add_argument(
+        '--statement-timeout', type=int, default=30000,
+        help='Map server only. Postgres statement timeout (in milliseconds) for map data queries. '
+             'Set to 0 for no timeout. Defaults to 30000.')
+
+    parser.add_argument(
+        '--classification', default='kmeans', choices=['kmeans', 'jenks', 'quantile', 'equal-interval'],
+        help='Map server only. Method used to create the map classes for each stat. \'kmeans\' is 1D k-means, '
+             '\'jenks\' is Fisher-Jenks natural breaks, \'quantile\' has an equal count of boundaries in each '
+             'class, \'equal-interval\' has classes of equal width. Defaults to \'kmeans\'.')
+
+    # the sample for a rank error of 0.02 is 4,612 values (Dvoretzky-Kiefer-Wolfowitz bound) - under a quarter of the
+    # boundaries at 20,000 and under a tenth of the SA1s. At 0.01 it's 18,445, which saves little on any boundary
+    parser.add_argument(
+        '--approx-class-breaks-rows', type=int, default=20000,
+        help='Map server only. Boundaries with more rows than this (and at least 4 times the sample size) get their '
+             'map classes from a sample of their values. Set to 0 to always use every value. Defaults to 20000.')
+    parser.add_argument(
+        '--class-breaks-rank-error', type=float, default=0.02,
+        help='Map server only. Maximum error (as a fraction of the boundaries) in the rank of sampled values, with '
+             '95%% confidence. Sets the sample size for approximate map classes - 0.02 samples 4,612 values, 0.01 '
+             'samples 18,445 (4 times as many for half the error). Defaults to 0.02.')
+
+    parser.add_argument(
+        '--progressive-zoom-offset', type=int, default=3,
+        help='Map server only. For progressive map data requests, send boundaries simplified for this many zoom '
+             'levels out first, then the map gets the detailed ones. Set to 0 to always send the detailed '
+             'boundaries. Defaults to 3.')
+    parser.add_argument(
+        '--response-cache-mb', type=int, default=256,
+        help='Map server only. Size (in MB) of the in-memory cache of map data responses. Set to 0 to turn it off. '
+             'Defaults to 256.')
+    parser.add_argument(
+        '--warm-cache', action='store_true',
+        help='Map server only. Pre-compute the map classes & data for the default stats at the bookmarked places, '
+             'and the most requested map views in --warm-cache-log, when the server starts.')
+    parser.add_argument(
+        '--warm-cache-log',
+        help='Map server only. Access log file to get the most requested map views from for --warm-cache.')
+    parser.add_argument(
+        '--warm-cache-views', type=int, default=500,
+        help='Map server only. Number of the most requested map views in --warm-cache-log to warm. Defaults to 500.')
+    parser.add_argument(
+        '--warm-cache-threads', type=int, default=2,
+        help='Map server only. Number of warm up requests to run at once, keep it low to leave database '
+             'connections for users. Defaults to 2.')
+    parser.add_argument(
+        '--warm-cache-interval', type=float, default=0,
+        help='Map server only. Minutes between cache warm ups after the first one. Set to 0 to only warm up when '
+             'the server starts. Defaults to 0.')
+
     # # number of classes of data to map
     # parser.add_argument(
     #     '--num-classes', type=int, default=7,
@@ -75,13 +193,23 @@ def set_arguments():
     #     help='Local path on server corresponding to census-data-path, if different to census-data-path.')
     parser.add_argument(
         '--census-bdys-path', help='Local path to source admin boundary files.')
+    parser.add_argument(
+        '--copy-format', default='text', choices=['text', 'binary'],
+        help='How census data CSV files are copied into Postgres. \'text\' sends the CSV as is for Postgres to '
+             'parse, \'binary\' parses it in the loader\'s processes and sends binary COPY data. '
+             'Defaults to \'text\'.')
+    parser.add_argument(
+        '--cache-path',
+        help='Local path to cache the cleaned census metadata (and the map server\'s exports) in, so reloads can '
+             'skip parsing the Excel files. Must be private to the user running the loader or server. Defaults to '
+             'a census-loader folder in the user\'s cache directory (e.g. ~/.cache).')
 
     # # states to load
     # parser.add_argument('--states', nargs='+', choices=["ACT", "NSW", "NT", "OT", "QLD", "SA", "TAS", "VIC", "WA"],
     #                     default=["ACT", "NSW", "NT", "OT", "QLD", "SA", "TAS", "VIC", "WA"],
     #                     help='List of states to load data for. Defaults to all states.')
 
-    return parser.parse_args()
+    return parser
 
 
 # create the dictionary of settings
@@ -92,21 +220,51 @@ def get_settings(args):
     census_bdys_path = args.census_bdys_path or ""
 
     settings['max_concurrent_processes'] = args.max_processes
+    settings['adaptive_processes'] = args.adaptive_processes
+    settings['fast_load'] = args.fast_load
+    settings['set_logged'] = args.set_logged
+    settings['min_concurrent_processes'] = args.min_processes
     settings['census_year'] = args.census_year
     # settings['states_to_load'] = args.states
     settings['states'] = ["ACT", "NSW", "NT", "OT", "QLD", "SA", "TAS", "VIC", "WA"]
     settings['data_schema'] = args.data_schema
     settings['boundary_schema'] = args.boundary_schema
     settings['web_schema'] = args.web_schema
+    settings['previous_census_year'] = args.previous_census_year
+    settings['previous_data_schema'] = args.previous_data_schema or "census_{0}_data".format(args.previous_census_year)
+    settings['previous_web_schema'] = args.previous_web_schema or "census_{0}_web".format(args.previous_census_year)
+    settings['previous_region_id_field'] = "region_id"  # 2011
     settings['data_directory'] = census_data_path.replace("\\", "/")
     # if args.local_server_dir:
     #     settings['data_pg_server_local_directory'] = args.local_server_dir.replace("\\", "/")
     # else:
     #     settings['data_pg_server_local_directory'] = settings['data_directory']
     settings['boundaries_local_directory'] = census_bdys_path.replace("\\", "/")
+    settings['copy_format'] = args.copy_format
+    settings['cache_directory'] = args.cache_path or get_default_cache_directory()
 
     # settings['num_classes'] = args.num_classes
 
+    settings['geometry_format'] = args.geometry_format
+    settings['hilbert_order'] = not args.no_hilbert_order
+    settings['feature_budget'] = args.feature_budget
+    settings['max_response_points'] = args.max_response_points
+    settings['max_response_bytes'] = args.max_response_bytes
+    settings['statement_timeout'] = args.statement_timeout
+    settings['classification'] = args.classification
+    settings['approx_class_breaks_rows'] = args.approx_class_breaks_rows
+    settings['class_breaks_rank_error'] = args.class_breaks_rank_error
+    settings['progressive_zoom_offset'] = args.progressive_zoom_offset
+    settings['response_cache_bytes'] = args.response_cache_mb * 1024 * 1024
+    settings['warm_cache'] = args.warm_cache
+    settings['warm_cache_log'] = args.warm_cache_log
+    settings['warm_cache_views'] = args.warm_cache_views
+    settings['warm_cache_threads'] = args.warm_cache_threads
+    settings['warm_cache_interval'] = args.warm_cache_interval
+
+    # size (in decimal degrees) of the grid cells used to estimate the number of boundaries in a map view
+    settings['density_cell_size'] = 0.1
+
     # create postgres connect string
     settings['pg_host'] = args.pghost or os.getenv("PGHOST", "localhost")
     settings['pg_port'] = args.pgport or os.getenv("PGPORT", 5432)
@@ -154,7 +312,7 @@ def get_settings(args):
              # {"boundary": "sos", "id_field": "sos_code16", "name_field": "sos_name16", "area_field": "areasqkm16"},
              # {"boundary": "sosr", "id_field": "sosr_code16", "name_field": "sosr_name16", "area_field": "areasqkm16"},
              {"boundary": "ssc", "id_field": "ssc_code16", "name_field": "ssc_name16", "area_field": "areasqkm16"},
-             {"boundary": "ste", "id_field": "state_code16", "name_field": "state_name16", "area_field": "areasqkm16"},
+             {"boundary": "ste", "id_field": "ste_code16", "name_field": "ste_name16", "area_field": "areasqkm16"},
              # {"boundary": "sua", "id_field": "sua_code16", "name_field": "sua_name16", "area_field": "areasqkm16"},
              {"boundary": "tr", "id_field": "tr_code16", "name_field": "tr_name16", "area_field": "areasqkm16"}]
     # {"boundary": "ucl", "id_field": "ucl_code16", "name_field": "ucl_name16", "area_field": "areasqkm16"}]
@@ -224,6 +382,94 @@ def get_boundary(zoom_level):
     return boundary_name, min_display_value
 
 
+# gets the lat/long bounding box of a map viewport (in pixels) at a tiled map zoom level
+def get_viewport_bbox(latitude, longitude, zoom_level, width=1280, height=800):
+
+    # size of the world in pixels at this zoom level
+    world_pixels = 256.0 * math.pow(2.0, float(zoom_level))
+
+    # centre of the viewport in spherical mercator pixels
+    centre_x = (longitude + 180.0) / 360.0 * world_pixels
+    sin_lat = math.sin(math.radians(latitude))
+    centre_y = (0.5 - math.log((1.0 + sin_lat) / (1.0 - sin_lat)) / (4.0 * math.pi)) * world_pixels
+
+    def pixels_to_lat_long(x, y):
+        lon = x / world_pixels * 360.0 - 180.0
+        lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / world_pixels))))
+        return lat, lon
+
+    bottom, left = pixels_to_lat_long(centre_x - width / 2.0, centre_y + height / 2.0)
+    top, right = pixels_to_lat_long(centre_x + width / 2.0, centre_y - height / 2.0)
+
+    return left, bottom, right, top
+
+
+# get the boundaries used by the map and their minimum values to colour in, from coarsest to finest
+def get_boundary_list():
+    boundary_list = list()
+
+    for zoom_level in range(0, 17):
+        boundary = get_boundary(zoom_level)
+
+        if boundary not in boundary_list:
+            boundary_list.append(boundary)
+
+    return boundary_list
+
+
+# choose the finest boundary whose estimated feature count in the map extent stays under the budget
+def get_adaptive_boundary(zoom_level, left, bottom, right, top, density_grids, settings):
+    boundary_list = [boundary for boundary in get_boundary_list() if boundary[0] in density_grids]
+
+    if len(boundary_list) == 0:
+        return get_boundary(zoom_level)
+
+    for boundary_name, min_display_value in reversed(boundary_list):
+        feature_count = get_estimated_feature_count(density_grids[boundary_name], left, bottom, right, top,
+                                                    settings['density_cell_size'])
+
+        if feature_count <= settings['feature_budget']:
+            return boundary_name, min_display_value
+
+    # nothing fits - use the coarsest boundary
+    return boundary_list[0]
+
+
+# estimate the number of features in a bounding box from a grid of feature counts, prorating partial grid cells
+def get_estimated_feature_count(density_grid, left, bottom, right, top, cell_size):
+    min_x = int(math.floor(left / cell_size))
+    max_x = int(math.floor(right / cell_size))
+    min_y = int(math.floor(bottom / cell_size))
+    max_y = int(math.floor(top / cell_size))
+
+    # only visit the grid cells that have features in them if there are less of those than cells in the bbox
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > len(density_grid):
+        cells = [(cell, features) for cell, features in density_grid.items()
+                 if min_x <= cell[0] <= max_x and min_y <= cell[1] <= max_y]
+    else:
+        cells = list()
+
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                features = density_grid.get((cell_x, cell_y))
+
+                if features is not None:
+                    cells.append(((cell_x, cell_y), features))
+
+    feature_count = 0.0
+
+    for cell, features in cells:
+        cell_left = cell[0] * cell_size
+        cell_bottom = cell[1] * cell_size
+
+        overlap_x = min(right, cell_left + cell_size) - max(left, cell_left)
+        overlap_y = min(top, cell_bottom + cell_size) - max(bottom, cell_bottom)
+
+        feature_count += features * (overlap_x * overlap_y) / (cell_size * cell_size)
+
+    return feature_count
+
+
 # calculates the area tolerance (in m2) for vector simplification using the Visvalingam-Whyatt algorithm
 def get_tolerance(zoom_level):
 
@@ -269,6 +515,51 @@ def get_decimal_places(zoom_level):
     return places
 
 
+# the display table column that holds the geometries for a zoom level
+def get_geometry_column(zoom_level, settings):
+    display_zoom = str(zoom_level).zfill(2)
+
+    if settings['geometry_format'] == "twkb":
+        return "twkb_{0}".format(display_zoom)
+    else:
+        return "geojson_{0}".format(display_zoom)
+
+
+# get the most detailed geometry zoom level (up to the map's zoom level) whose estimated response size is within the
+# vertex and byte limits, using the per row counts stored in the display tables. returns None if nothing fits.
+# the rows are the ones in the map envelope, or a list of ids if there is one
+def get_budget_zoom_level(boundary_table, zoom_level, envelope_sql, pg_cur, settings, ids=None):
+    max_points = settings['max_response_points']
+    max_bytes = settings['max_response_bytes']
+
+    if max_points <= 0 and max_bytes <= 0:
+        return zoom_level
+
+    # the geometry arrays start at zoom level 4
+    sum_list = list()
+
+    for zoom in range(4, zoom_level + 1):
+        sum_list.append("COALESCE(SUM(geometry_points[{0}]), 0) AS points_{1}, "
+                        "COALESCE(SUM(geometry_bytes[{0}]), 0) AS bytes_{1}".format(zoom - 3, zoom))
+
+    if ids is None:
+        sql = "SELECT {0} FROM {1} WHERE geom && {2}".format(", ".join(sum_list), boundary_table, envelope_sql)
+        pg_cur.execute(sql)
+    else:
+        sql = "SELECT {0} FROM {1} WHERE id = ANY(%s)".format(", ".join(sum_list), boundary_table)
+        pg_cur.execute(sql, (ids,))
+    row = pg_cur.fetchone()
+
+    for zoom in range(zoom_level, 3, -1):
+        points = row["points_{0}".format(zoom)]
+        byte_count = row["bytes_{0}".format(zoom)]
+
+        if (max_points <= 0 or points <= max_points) and (max_bytes <= 0 or byte_count <= max_bytes):
+            return zoom
+
+    return None
+
+
 def get_kmeans_bins(data_table, boundary_table, stat_field, num_classes, min_val, map_type, pg_cur, settings):
 
     # query to get min and max values (filter small populations that overly influence the map visualisation)
@@ -423,7 +714,7 @@ def get_equal_count_bins(data_table, boundary_table, stat_field, num_classes, ma
 
 # takes a list of sql queries or command lines and runs them using multiprocessing
 def multiprocess_csv_import(work_list, settings, logger):
-    pool = multiprocessing.Pool(processes=settings['max_concurrent_processes'])
+    pool = get_worker_pool(settings)
 
     num_jobs = len(work_list)
 
@@ -447,9 +738,7 @@ def run_csv_import_multiprocessing(args):
     file_dict = args[0]
     settings = args[1]
 
-    pg_conn = psycopg2.connect(settings['pg_connect_string'])
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
+    pg_cur = get_worker_cursor()
 
     # CREATE TABLE
 
@@ -473,59 +762,346 @@ def run_csv_import_multiprocessing(args):
     table_name = file_dict["boundary"] + "_" + file_dict["table"]
 
     create_table_sql = "DROP TABLE IF EXISTS {0}.{1} CASCADE;" \
-                       "CREATE TABLE {0}.{1} ({4} text, {2}) WITH (OIDS=FALSE);" \
+                       "CREATE {5} {0}.{1} ({4} text, {2}) WITH (OIDS=FALSE);" \
                        "ALTER TABLE {0}.metadata_tables OWNER TO {3}" \
         .format(settings['data_schema'], table_name, fields_string,
-                settings['pg_user'], settings['region_id_field'])
+                settings['pg_user'], settings['region_id_field'], get_create_table_type(settings))
 
     pg_cur.execute(create_table_sql)
 
     # IMPORT CSV FILE
 
     try:
-        # read CSV into a string
-        raw_string = open(file_dict["path"], 'r').read()
-
-        # clean whitespace and rogue non-ascii characters
-        clean_string = raw_string.lstrip().rstrip().replace(" ", "").replace("\x1A", "")
-
-        # convert to in memory stream
-        csv_file = io.StringIO(clean_string)
-        csv_file.seek(0)  # move position back to beginning of file before reading
-
-        # import into Postgres
-        sql = "COPY {0}.{1} FROM stdin WITH CSV HEADER DELIMITER as ',' NULL as '..'" \
-            .format(settings['data_schema'], table_name)
-        pg_cur.copy_expert(sql, csv_file)
-
+        copy_csv_file(pg_cur, file_dict["path"], settings['data_schema'] + "." + table_name, len(field_list),
+                      settings['copy_format'])
     except Exception as ex:
         return "IMPORT CSV INTO POSTGRES FAILED! : {0} : {1}".format(file_dict["path"], ex)
 
-    # add primary key and vacuum index
-    sql = "ALTER TABLE {0}.{1} ADD CONSTRAINT {1}_pkey PRIMARY KEY ({2});" \
-          "ALTER TABLE {0}.{1} CLUSTER ON {1}_pkey" \
-        .format(settings['data_schema'], table_name, settings['region_id_field'])
-    pg_cur.execute(sql)
+    # add primary key and vacuum index (done at the end of the load for a fast load)
+    if not settings['fast_load']:
+        sql = "ALTER TABLE {0}.{1} ADD CONSTRAINT {1}_pkey PRIMARY KEY ({2});" \
+              "ALTER TABLE {0}.{1} CLUSTER ON {1}_pkey" \
+            .format(settings['data_schema'], table_name, settings['region_id_field'])
+        pg_cur.execute(sql)
 
-    pg_cur.execute("VACUUM ANALYSE {0}.{1}".format(settings['data_schema'], table_name))
+        pg_cur.execute("VACUUM ANALYSE {0}.{1}".format(settings['data_schema'], table_name))
 
     result = "SUCCESS"
 
     pg_cur.close()
-    pg_conn.close()
 
     return result
 
 
-# takes a list of sql queries or command lines and runs them using multiprocessing
-def multiprocess_list(mp_type, work_list, settings, logger):
+# parses the census metadata Excel worksheets using multiprocessing, returning them as tab delimited text to COPY
+def multiprocess_metadata_sheets(work_list, settings, logger):
     pool = multiprocessing.Pool(processes=settings['max_concurrent_processes'])
 
     num_jobs = len(work_list)
 
+    results = pool.imap_unordered(run_metadata_sheet_multiprocessing, [[w, settings] for w in work_list])
+
+    pool.close()
+    pool.join()
+
+    result_list = list(results)
+    num_results = len(result_list)
+
+    if num_jobs > num_results:
+        logger.warning("\t- A MULTIPROCESSING PROCESS FAILED WITHOUT AN ERROR\nACTION: Check the record counts")
+
+    sheet_list = list()
+
+    for result in result_list:
+        if isinstance(result, dict):
+            sheet_list.append(result)
+        else:
+            logger.info(result)
+
+    return sheet_list
+
+
+def get_default_cache_directory():
+    # a per user folder - a shared one (e.g. in /tmp) could have files planted in it by other users
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(cache_home, "census-loader")
+
+
+def get_cache_directory(settings, sub_directory=None):
+    """
+    Create (if needed) and return the cache directory, or a folder in it. Both are only accessible by this user.
+    Raises an OSError if either is owned by, or writable by, someone else - the loader reads the files in it and the
+    map server serves them.
+    """
+    directory_list = [settings['cache_directory']]
+
+    if sub_directory is not None:
+        directory_list.append(os.path.join(settings['cache_directory'], sub_directory))
+
+    for directory in directory_list:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # no owners or permissions to check on Windows
+        if hasattr(os, "getuid"):
+            directory_stat = os.stat(directory)
+
+            if directory_stat.st_uid != os.getuid() or directory_stat.st_mode & 0o022:
+                raise OSError("Cache directory {0} must be owned by, and only writable by, the current user"
+                              .format(directory))
+
+    return directory_list[-1]
+
+
+# hashes a file in chunks - used to key cached copies of parsed input files
+def get_file_hash(file_path):
+    file_hash = hashlib.sha1()
+
+    with open(file_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1048576), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def run_metadata_sheet_multiprocessing(args):
+    sheet_dict = args[0]
+    settings = args[1]
+
+    # only needed by the loader, not the map server
+    import pandas  # module needs to be installed (IMPORTANT: needs the 'xlrd' module to read .xls(x) files)
+
+    try:
+        # cleaned worksheets are cached (as the tab delimited text that's imported) by the hash of the workbook, so an
+        # unchanged workbook is never parsed twice
+        cache_file = sheet_dict["cache_file"]
+
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file, 'r', encoding='utf-8', newline='') as tsv_file:
+                tsv = tsv_file.read()
+        else:
+            df = pandas.read_excel(sheet_dict["path"], sheet_name=sheet_dict["sheet"])
+
+            # find the header row and drop it and the unwanted rows above it
+            first_column = df.iloc[:, 0].astype(str).str.lower().values
+            matches = (first_column == sheet_dict["first_row"]).nonzero()[0]
+
+            if len(matches) == 0:
+                return "METADATA HEADER ROW NOT FOUND! : {0} : sheet {1}".format(sheet_dict["path"],
+                                                                                 sheet_dict["sheet"])
+
+            df_clean = df.drop(df.index[0:matches[0] + 1])
+
+            # drop excess columns in unclean Excel worksheets
+            if sheet_dict["table"] == "metadata_stats":
+                try:
+                    df_clean.drop(df.columns[[6, 7, 8]], axis=1, inplace=True)
+                except:
+                    pass
+
+            # export to in-memory tab delimited text
+            tsv_file = io.StringIO()
+            df_clean.to_csv(tsv_file, sep="\t", index=False, header=False)
+            tsv = tsv_file.getvalue()
+
+            # write to a temp file first - other processes could be reading the cache
+            if cache_file is not None:
+                temp_file = "{0}.{1}".format(cache_file, os.getpid())
+
+                with open(temp_file, 'w', encoding='utf-8', newline='') as cache_output:
+                    cache_output.write(tsv)
+
+                os.replace(temp_file, cache_file)
+
+    except Exception as ex:
+        return "PARSE METADATA FAILED! : {0} : sheet {1} : {2}".format(sheet_dict["path"], sheet_dict["sheet"], ex)
+
+    result = dict()
+    result["name"] = sheet_dict["name"]
+    result["table"] = sheet_dict["table"]
+    result["tsv"] = tsv
+
+    return result
+
+
+# copies a census data CSV file into a table with a text id field followed by num_fields double precision fields
+def copy_csv_file(pg_cur, file_path, table_name, num_fields, copy_format):
+    csv_file = get_clean_csv_file(file_path)
+
+    if copy_format == "binary":
+        region_ids, values = read_census_csv(csv_file, num_fields)
+
+        sql = "COPY {0} FROM stdin WITH (FORMAT binary)".format(table_name)
+        pg_cur.copy_expert(sql, io.BytesIO(get_pgcopy_data(region_ids, values)))
+    else:
+        sql = "COPY {0} FROM stdin WITH CSV HEADER DELIMITER as ',' NULL as '..'".format(table_name)
+        pg_cur.copy_expert(sql, csv_file)
+
+
+def get_clean_csv_file(file_path):
+    # read CSV into a string
+    raw_string = open(file_path, 'r').read()
+
+    # clean whitespace and rogue non-ascii characters
+    clean_string = raw_string.lstrip().rstrip().replace(" ", "").replace("\x1A", "")
+
+    # convert to in memory stream
+    csv_file = io.StringIO(clean_string)
+    csv_file.seek(0)  # move position back to beginning of file before reading
+
+    return csv_file
+
+
+# parses a census data CSV into an array of region ids and a 2D array of values, with NaNs for the nulls ('..')
+def read_census_csv(csv_file, num_fields):
+    # only needed by the loader, not the map server
+    import pandas
+
+    df = pandas.read_csv(csv_file, dtype={0: str}, na_values=[".."], keep_default_na=False)
+
+    if len(df.columns) != num_fields + 1:
+        raise ValueError("CSV has {0} columns, table has {1}".format(len(df.columns), num_fields + 1))
+
+    region_ids = df.iloc[:, 0].str.encode("utf-8").values
+    values = df.iloc[:, 1:].to_numpy(dtype=numpy.float64)
+
+    return region_ids, values
+
+
+# creates Postgres binary COPY data for rows of a text id and double precision values (NaN = null). Rows without nulls
+# (nearly all of them) are packed with NumPy, the rest one at a time
+def get_pgcopy_data(region_ids, values):
+    num_rows, num_fields = values.shape
+
+    output = io.BytesIO()
+
+    # header: signature, flags & header extension length
+    output.write(b"PGCOPY\n\xff\r\n\x00" + numpy.array([0, 0], dtype=">i4").tobytes())
+
+    null_rows = numpy.isnan(values).any(axis=1)
+    id_lengths = numpy.array([len(region_id) for region_id in region_ids], dtype=numpy.int64)
+
+    # fixed width rows, grouped by the length of their id
+    for id_length in numpy.unique(id_lengths[~null_rows]):
+        rows = ~null_rows & (id_lengths == id_length)
+
+        fields = [("num_fields", ">i2"), ("id_length", ">i4"), ("id", "S{0}".format(id_length))]
+
+        for i in range(0, num_fields):
+            fields.extend([("length_{0}".format(i), ">i4"), ("value_{0}".format(i), ">f8")])
+
+        records = numpy.empty(int(rows.sum()), dtype=fields)
+        records["num_fields"] = num_fields + 1
+        records["id_length"] = id_length
+        records["id"] = region_ids[rows]
+
+        row_values = values[rows]
+
+        for i in range(0, num_fields):
+            records["length_{0}".format(i)] = 8
+            records["value_{0}".format(i)] = row_values[:, i]
+
+        output.write(records.tobytes())
+
+    # rows with nulls
+    for row in numpy.nonzero(null_rows)[0]:
+        region_id = region_ids[row]
+        output.write(numpy.array([num_fields + 1], dtype=">i2").tobytes())
+        output.write(numpy.array([len(region_id)], dtype=">i4").tobytes() + region_id)
+
+        for value in values[row]:
+            if numpy.isnan(value):
+                output.write(numpy.array([-1], dtype=">i4").tobytes())
+            else:
+                output.write(numpy.array([8], dtype=">i4").tobytes() + numpy.array([value], dtype=">f8").tobytes())
+
+    # trailer
+    output.write(numpy.array([-1], dtype=">i2").tobytes())
+
+    return output.getvalue()
+
+
+# a fast load creates unlogged tables - they don't write WAL, but are emptied if Postgres crashes
+def get_create_table_type(settings):
+    if settings['fast_load']:
+        return "UNLOGGED TABLE"
+    else:
+        return "TABLE"
+
+
+# each process in the loader's multiprocessing pools keeps one Postgres connection for all of its jobs, so a load
+# uses at most --max-processes connections (plus the main one) instead of one per job
+worker_settings = None
+worker_pg_conn = None
+
+
+def get_worker_pool(settings):
+    return multiprocessing.Pool(processes=settings['max_concurrent_processes'],
+                                initializer=init_worker, initargs=(settings,))
+
+
+def init_worker(settings):
+    global worker_settings
+
+    worker_settings = settings
+
+    # close the connection when the process exits (i.e. when the pool is closed & joined)
+    multiprocessing.util.Finalize(None, close_worker_connection, exitpriority=10)
+
+
+def get_worker_cursor():
+    global worker_pg_conn
+
+    # reset the session left by the last job (e.g. a failed transaction) - if that fails the connection is broken
+    if worker_pg_conn is not None:
+        try:
+            with worker_pg_conn.cursor() as pg_cur:
+                if worker_pg_conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    pg_cur.execute("ROLLBACK")
+
+                pg_cur.execute("DISCARD ALL")
+        except psycopg2.Error:
+            close_worker_connection()
+
+    # (re)connect, retrying a couple of times in case Postgres is briefly unavailable
+    attempt = 0
+
+    while worker_pg_conn is None:
+        try:
+            worker_pg_conn = psycopg2.connect(worker_settings['pg_connect_string'])
+            worker_pg_conn.autocommit = True
+        except psycopg2.OperationalError:
+            attempt += 1
+
+            if attempt >= 3:
+                raise
+
+            time.sleep(attempt)
+
+    return worker_pg_conn.cursor()
+
+
+def close_worker_connection():
+    global worker_pg_conn
+
+    if worker_pg_conn is not None:
+        try:
+            worker_pg_conn.close()
+        except psycopg2.Error:
+            pass
+
+        worker_pg_conn = None
+
+
+# takes a list of sql queries or command lines and runs them using multiprocessing
+def multiprocess_list(mp_type, work_list, settings, logger):
+    num_jobs = len(work_list)
+
     if mp_type == "sql":
+        pool = get_worker_pool(settings)
         results = pool.imap_unordered(run_sql_multiprocessing, [[w, settings] for w in work_list])
     else:
+        pool = multiprocessing.Pool(processes=settings['max_concurrent_processes'])
         results = pool.imap_unordered(run_command_line, work_list)
 
     pool.close()
@@ -544,10 +1120,7 @@ def multiprocess_list(mp_type, work_list, settings, logger):
 
 def run_sql_multiprocessing(args):
     the_sql = args[0]
-    settings = args[1]
-    pg_conn = psycopg2.connect(settings['pg_connect_string'])
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
+    pg_cur = get_worker_cursor()
 
     # # set raw gnaf database schema (it's needed for the primary and foreign key creation)
     # if settings['raw_gnaf_schema'] != "public":
@@ -560,7 +1133,26 @@ def run_sql_multiprocessing(args):
         result = "SQL FAILED! : {0} : {1}".format(the_sql, ex)
 
     pg_cur.close()
-    pg_conn.close()
+
+    return result
+
+
+# runs a list of sql statements in order (e.g. statements like VACUUM that can't be run together), stopping at the first
+# that fails
+def run_sql_list_multiprocessing(args):
+    sql_list = args[0]
+    pg_cur = get_worker_cursor()
+
+    result = "SUCCESS"
+
+    for the_sql in sql_list:
+        try:
+            pg_cur.execute(the_sql)
+        except Exception as ex:
+            result = "SQL FAILED! : {0} : {1}".format(the_sql, ex)
+            break
+
+    pg_cur.close()
 
     return result
 
@@ -637,6 +1229,36 @@ def split_sql_into_list(pg_cur, the_sql, table_schema, table_name, table_alias,
         return None
 
 
+# gets the load on the database from the other sessions' activity and, if it's on this machine, the CPU load.
+# overloaded if sessions are waiting on locks or there are more runnable processes than CPUs
+def get_database_load(pg_cur, settings):
+    load = dict()
+
+    try:
+        pg_cur.execute("SELECT count(*) FILTER (WHERE state = 'active') AS active, "
+                       "count(*) FILTER (WHERE wait_event_type = 'Lock') AS lock_waits, "
+                       "count(*) FILTER (WHERE wait_event_type = 'IO') AS io_waits "
+                       "FROM pg_stat_activity "
+                       "WHERE datname = current_database() AND pid <> pg_backend_pid()")
+        row = pg_cur.fetchone()
+
+        load["active"] = row[0]
+        load["lock_waits"] = row[1]
+        load["io_waits"] = row[2]
+    except psycopg2.Error:
+        # wait events need Postgres 9.6+
+        load["lock_waits"] = None
+
+    if settings['pg_host'] in ["localhost", "127.0.0.1", "::1"] and hasattr(os, "getloadavg"):
+        load["cpu_load"] = round(os.getloadavg()[0] / multiprocessing.cpu_count(), 2)
+    else:
+        load["cpu_load"] = None
+
+    load["overloaded"] = (load["lock_waits"] or 0) > 0 or (load["cpu_load"] or 0.0) > 1.0
+
+    return load
+
+
 def check_python_version(logger):
     # get python and psycopg2 version
     python_version = sys.version.split("(")[0].strip()
@@ -674,7 +1296,7 @@ def check_postgis_version(pg_cur, settings, logger):
 
 
 def multiprocess_shapefile_load(work_list, settings, logger):
-    pool = multiprocessing.Pool(processes=settings['max_concurrent_processes'])
+    pool = get_worker_pool(settings)
 
     num_jobs = len(work_list)
 
@@ -705,18 +1327,20 @@ def intermediate_shapefile_load_step(args):
     delete_table = work_dict['delete_table']
     spatial = work_dict['spatial']
 
-    pg_conn = psycopg2.connect(settings['pg_connect_string'])
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
+    pg_cur = get_worker_cursor()
 
-    result = import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial)
+    result = import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial,
+                                          settings['fast_load'])
+
+    pg_cur.close()
 
     return result
 
 
 # imports a Shapefile into Postgres in 2 steps: SHP > SQL; SQL > Postgres
 # overcomes issues trying to use psql with PGPASSWORD set at runtime
-def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial):
+# a fast load creates an unlogged table without a spatial index (it's added at the end of the load)
+def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial, fast_load=False):
 
     # delete target table or append to it?
     if delete_table:
@@ -725,7 +1349,9 @@ def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_
         delete_append_flag = "-a"
 
     # assign coordinate system if spatial, otherwise flag as non-spatial
-    if spatial:
+    if spatial and fast_load:
+        spatial_or_dbf_flags = "-s 4283"
+    elif spatial:
         spatial_or_dbf_flags = "-s 4283 -I"
     else:
         spatial_or_dbf_flags = "-G -n"
@@ -758,6 +1384,9 @@ def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_
     sql = sql.replace("DROP TABLE ", "DROP TABLE IF EXISTS ")
     sql = sql.replace("DROP TABLE IF EXISTS IF EXISTS ", "DROP TABLE IF EXISTS ")
 
+    if fast_load:
+        sql = sql.replace("CREATE TABLE ", "CREATE UNLOGGED TABLE ")
+
     # import data to Postgres
     try:
         pg_cur.execute(sql)
@@ -769,7 +1398,7 @@ def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_
         return "\tImporting {0} - Couldn't run Shapefile SQL\nshp2pgsql result was: {1} ".format(file_path, err)
 
     # Cluster table on spatial index for performance
-    if delete_table and spatial:
+    if delete_table and spatial and not fast_load:
         sql = "ALTER TABLE {0}.{1} CLUSTER ON {1}_geom_idx".format(pg_schema, pg_table)
 
         try:
@@ -0,0 +1,143 @@
+
+# warms the map server's caches (and Postgres' buffers) by requesting the map views users are most likely to ask for
+#
+# runs when the server starts, and optionally on a schedule, in a background thread with a few requests at a time so
+# it doesn't starve the users' requests of database connections. The map views are the bookmarked places at each
+# zoom level and the most requested areas in the server's recent access log
+
+import math
+import re
+import threading
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# a map data request in a common or combined format access log line (Flask, gunicorn, nginx, Apache)
+log_request_pattern = re.compile(r'"GET (/get-data\?[^ "]+) HTTP/[\d.]+" 200 ')
+
+
+def start(get_paths, get_response, num_threads, interval_minutes):
+    """
+    Request the paths returned by get_paths() with get_response(path), now and then every interval_minutes
+    (if greater than 0).
+    """
+    def run():
+        while True:
+            warm_up(get_paths, get_response, num_threads)
+
+            if interval_minutes <= 0:
+                break
+
+            threading.Event().wait(interval_minutes * 60.0)
+
+    thread = threading.Thread(target=run, name="cache-warm-up", daemon=True)
+    thread.start()
+
+    return thread
+
+
+def warm_up(get_paths, get_response, num_threads):
+    start_time = datetime.now()
+
+    try:
+        paths = get_paths()
+    except Exception as ex:
+        print("Cache warm up failed : {0}".format(ex))
+        return
+
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for status in executor.map(lambda path: get_status(get_response, path), paths):
+            if status != 200:
+                failed += 1
+
+    print("Warmed cache with {0} requests ({1} failed) in {2}".format(len(paths), failed, datetime.now() - start_time))
+
+
+def get_status(get_response, path):
+    try:
+        return get_response(path)
+    except Exception as ex:
+        print("Cache warm up request failed : {0} : {1}".format(path, ex))
+        return None
+
+
+# the map views of the bookmarked places at each zoom level, for each stat (a list of (stat id, table id) tuples)
+def get_bookmark_paths(bookmarks, stats, min_zoom, max_zoom, get_viewport_bbox):
+    paths = list()
+
+    for zoom_level in range(min_zoom, max_zoom + 1):
+        for bookmark in bookmarks:
+            latitude, longitude = bookmark["latlng"]
+            left, bottom, right, top = get_viewport_bbox(latitude, longitude, zoom_level)
+
+            for stat_id, table_id in stats:
+                params = [("ml", left), ("mb", bottom), ("mr", right), ("mt", top), ("s", stat_id),
+                          ("t", table_id), ("z", zoom_level)]
+                paths.append("/get-data?" + urllib.parse.urlencode(params))
+
+    return paths
+
+
+def get_log_paths(log_file_path, max_paths):
+    """
+    Get the most requested map views in an access log - counted by boundary, stat, zoom level and the map tile at the
+    centre of the view. The latest request for each of them is used.
+    """
+    key_counts = dict()
+    key_paths = dict()
+
+    with open(log_file_path, "r", errors="replace") as log_file:
+        for line in log_file:
+            match = log_request_pattern.search(line)
+
+            if match is None:
+                continue
+
+            path = match.group(1)
+            key = get_log_key(path)
+
+            if key is not None:
+                key_counts[key] = key_counts.get(key, 0) + 1
+                key_paths[key] = remove_client_params(path)
+
+    keys = sorted(key_counts.keys(), key=lambda k: key_counts[k], reverse=True)[:max_paths]
+
+    return [key_paths[key] for key in keys]
+
+
+def get_log_key(path):
+    params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(path).query))
+
+    try:
+        zoom_level = int(params["z"])
+        longitude = (float(params["ml"]) + float(params["mr"])) / 2.0
+        latitude = (float(params["mb"]) + float(params["mt"])) / 2.0
+        stat_id = params["s"].lower()
+    except (KeyError, ValueError):
+        return None
+
+    tile_x, tile_y = get_tile(latitude, longitude, zoom_level)
+
+    return params.get("b", ""), stat_id, zoom_level, tile_x, tile_y
+
+
+# the client id & request generation would let a warm up request cancel the client's own requests
+def remove_client_params(path):
+    url = urllib.parse.urlparse(path)
+    params = [(key, value) for key, value in urllib.parse.parse_qsl(url.query) if key not in ("c", "g")]
+
+    return url.path + "?" + urllib.parse.urlencode(params)
+
+
+# the (spherical mercator) map tile a point is in
+def get_tile(latitude, longitude, zoom_level):
+    num_tiles = 2.0 ** zoom_level
+    sin_lat = math.sin(math.radians(max(min(latitude, 85.0), -85.0)))
+
+    tile_x = int((longitude + 180.0) / 360.0 * num_tiles)
+    tile_y = int((0.5 - math.log((1.0 + sin_lat) / (1.0 - sin_lat)) / (4.0 * math.pi)) * num_tiles)
+
+    return tile_x, tile_y